@@ -63,12 +63,205 @@ def get_info(data):
     return None, None
 
 
+WINDOW_KINDS = ("sakoe_chiba", "itakura")
+
+
+def parse_window(window):
+    """
+    Parse the window parameter of /process_data.
+
+        sakoe_chiba:<cells>   band of <cells> each side of the diagonal, e.g. sakoe_chiba:200
+        sakoe_chiba:<pct>%    band width as a percentage of the longer series, e.g. sakoe_chiba:10%
+        itakura:<slope>       parallelogram with the path slope kept between 1/slope and slope, e.g. itakura:2
+
+    Returns:
+        (kind, size, percent) or None for no window - raises ValueError on a bad window
+    """
+    if window is None or str(window).strip() == "":
+        return None
+    kind, _, size = str(window).strip().lower().partition(":")
+    if kind not in WINDOW_KINDS or not size:
+        raise ValueError(f"Invalid window {window} - use sakoe_chiba:<cells>, sakoe_chiba:<percent>% or itakura:<slope>")
+    percent = size.endswith("%")
+    try:
+        size = float(size.rstrip("%"))
+    except ValueError:
+        raise ValueError(f"Invalid window size in {window}")
+    if kind == "sakoe_chiba" and size < 0 or kind == "itakura" and (percent or size <= 1):
+        raise ValueError(f"Invalid window size in {window} - Sakoe-Chiba needs a width >= 0, Itakura a slope > 1")
+    return kind, size, percent
+
+
+def connect_bounds(lo, hi, m):
+    # make the band one connected region from (0, 0) to (n-1, m-1) - rounding can leave gaps between rows,
+    # and every cell inside must be reachable so the backtrack never leaves the band
+    lo = np.maximum.accumulate(np.clip(lo, 0, m - 1).astype(np.int64))
+    hi = np.maximum.accumulate(np.clip(hi, 0, m - 1).astype(np.int64))
+    lo[0] = 0
+    hi[-1] = m - 1
+    if len(hi) > 1:
+        hi[1:] = np.maximum(hi[1:], min(1, m - 1))
+        lo[1:] = np.minimum(lo[1:], hi[:-1])  # each row overlaps the one before it
+        lo[1] = min(lo[1], 1)  # (1, 1) - the only way out of (0, 0), row 0 and column 0 are inf
+    hi = np.maximum(hi, lo)
+    return lo, hi
+
+
+def band_bounds(n, m, window):
+    """
+    First and last column of the band on each row.
+    The diagonal is scaled to run corner to corner so series of different lengths still line up.
+    Sakoe-Chiba: https://doi.org/10.1109/TASSP.1978.1163055, Itakura: https://doi.org/10.1109/TASSP.1975.1162641
+
+    Returns:
+        (np.ndarray, np.ndarray): lo and hi per row, inclusive - None for the full matrix
+    """
+    parsed = parse_window(window)
+    if parsed is None:
+        return None
+    kind, size, percent = parsed
+    rows = np.arange(n, dtype=np.float64)
+    centre = rows * ((m - 1) / (n - 1)) if n > 1 else np.zeros(n)
+    if kind == "sakoe_chiba":
+        width = size * max(n, m) / 100 if percent else size
+        lo = np.ceil(centre - width)
+        hi = np.floor(centre + width)
+    else:
+        # within slope of both corners, measured on the scaled diagonal
+        left = m - 1 - centre
+        lo = np.ceil(np.maximum(centre / size, m - 1 - size * left))
+        hi = np.floor(np.minimum(size * centre, m - 1 - left / size))
+    return connect_bounds(lo, hi, m)
+
+
+def diagonal_cost(x, y, independent):
+    # |x - y| of the cells on a diagonal - summed over the variables unless each keeps its own path
+    cost = np.abs(x - y)
+    return cost if independent or len(cost) == 1 else cost.sum(axis=0, keepdims=True)
+
+
+def accumulate_steps(x, y, bounds=None, independent=False):
+    """
+    Fill the cumulative cost matrix D one anti-diagonal at a time.
+
+    Cell (i, j) only needs (i-1, j), (i, j-1) and (i-1, j-1), which all sit on the two diagonals before it,
+    so every cell of a diagonal is computed in one numpy step - a wavefront over n + m - 1 diagonals
+    instead of n * m python iterations. See https://en.wikipedia.org/wiki/Dynamic_time_warping
+
+    Same recurrence as before: D[0, 0] = cost[0, 0], the rest of row 0 and column 0 is inf,
+    D[i, j] = cost[i, j] + min(D[i-1, j], D[i, j-1], D[i-1, j-1]).
+
+    Only the last two diagonals of D are kept (the full matrix is 3.2GB for two 20k series) - the backtrack
+    reads the step taken into each cell instead, and path_costs() rebuilds D along the path.
+    With bounds only the cells inside the band are computed and stored, cells outside it count as inf.
+
+    Several variables (one column each) run through the same wavefront together: summed into one cost
+    for a single path (dependent DTW), or side by side as lanes with a path each (independent DTW).
+    See Shokoohi-Yekta et al. 2017: https://doi.org/10.1007/s10618-016-0455-0
+
+    Args:
+        x, y: the two series - 1-D, or n x d / m x d with a column per variable
+        bounds: (lo, hi) from band_bounds(), or None for the full matrix
+        independent: one path per variable instead of one over the summed cost
+    Returns:
+        (np.ndarray, np.ndarray): int8 step into each band cell per lane (one lane unless independent), row by
+                                  row - 0 up (i-1, j), 1 left (i, j-1), 2 diagonal (i-1, j-1) - and the base
+                                  backtrack() finds a cell with (base[i] + i + j)
+    """
+    n, m = len(x), len(y)
+    # variables on the first axis so one slice takes a diagonal of all of them
+    x = np.ascontiguousarray(np.reshape(x, (n, -1)).T)
+    y = np.ascontiguousarray(np.reshape(y, (m, -1)).T)
+    lanes = len(x) if independent else 1
+    lo, hi = bounds if bounds is not None else (np.zeros(n, dtype=np.int64), np.full(n, m - 1, dtype=np.int64))
+    rows = np.arange(n, dtype=np.int64)
+    widths = hi - lo + 1
+    offsets = np.concatenate(([0], np.cumsum(widths)[:-1]))
+    base = offsets - lo - rows
+    steps = np.zeros((lanes, int(widths.sum())), dtype=np.int8)
+
+    # the band cells on diagonal k are the rows first[k]..last[k] - lo + i and hi + i only ever go up
+    diagonals = np.arange(n + m - 1)
+    first = np.searchsorted(hi + rows, diagonals, side="left")
+    last = np.searchsorted(lo + rows, diagonals, side="right") - 1
+
+    # D on diagonals k-2, k-1 and k, indexed by row i (column is k - i)
+    # the cell either side of a diagonal's band is set to inf so reads outside the band see inf
+    prev2 = np.full((lanes, n + 1), np.inf)
+    prev1 = np.full((lanes, n + 1), np.inf)
+    cur = np.full((lanes, n + 1), np.inf)
+    prev1[:, 0] = diagonal_cost(x[:, :1], y[:, :1], independent)[:, 0]
+
+    for k in range(1, n + m - 1):
+        a, b = first[k], last[k]
+        if a == 0:
+            cur[:, 0] = np.inf  # row 0
+        if b == k:
+            cur[:, k] = np.inf  # column 0
+        lo_k = max(a, 1)
+        hi_k = min(b, k - 1)
+        if lo_k <= hi_k:
+            # cost of the cells (lo_k, k-lo_k) .. (hi_k, k-hi_k) - columns run backwards along the diagonal
+            cost = diagonal_cost(x[:, lo_k:hi_k + 1], y[:, k - hi_k:k - lo_k + 1][:, ::-1], independent)
+            up = prev1[:, lo_k - 1:hi_k]
+            left = prev1[:, lo_k:hi_k + 1]
+            diag = prev2[:, lo_k - 1:hi_k]
+            best = np.minimum(up, left)
+            # ties go to the first of up, left, diagonal - the order np.argmin used in the old backtrack
+            step = (left < up).astype(np.int8)
+            step[diag < best] = 2
+            cur[:, lo_k:hi_k + 1] = cost + np.minimum(best, diag)
+            if bounds is None:
+                # cells of one anti-diagonal are m - 1 apart in the full matrix
+                steps[:, lo_k * (m - 1) + k:hi_k * (m - 1) + k + 1:m - 1] = step
+            else:
+                steps[:, base[lo_k:hi_k + 1] + k] = step
+        if a > 0:
+            cur[:, a - 1] = np.inf
+        cur[:, b + 1] = np.inf
+        prev2, prev1, cur = prev1, cur, prev2
+
+    return steps, base
+
+
+def backtrack(steps, base, n, m):
+    # optimal path from the top right corner back to (0, 0), returned in forward order
+    i, j = n - 1, m - 1
+    path = [(i, j)]
+    while i > 0 or j > 0:
+        if i == 0:
+            j -= 1
+        elif j == 0:
+            i -= 1
+        else:
+            step = steps[base[i] + i + j]
+            if step == 0:
+                i -= 1
+            elif step == 1:
+                j -= 1
+            else:
+                i -= 1
+                j -= 1
+        path.append((i, j))
+    return path[::-1]
+
+
+def path_costs(x, y, path):
+    # D along the path - each cell is its own cost plus D of the cell before it, summed in the same
+    # order as the full matrix so the values match it exactly. Several columns are summed as dependent DTW.
+    index = np.array(path, dtype=np.int64).reshape(-1, 2)
+    rows, cols = index[:, 0], index[:, 1]
+    x = np.ascontiguousarray(np.reshape(x, (len(x), -1)).T)
+    y = np.ascontiguousarray(np.reshape(y, (len(y), -1)).T)
+    costs = np.add.accumulate(diagonal_cost(x[:, rows], y[:, cols], False)[0])
+    costs[(rows == 0) != (cols == 0)] = np.inf  # row 0 / column 0 outside (0, 0)
+    return costs
+
+
 #print(data.head())
 
-def dtw_custom(df_1, data_info_1, df_2, data_info_2) -> float:
-    logger.info("Starting DTW custom function")  # Log function start
-        
-    start_time = time()
+def load_series(df_1, data_info_1, df_2, data_info_2):
+    # the min-max normalised numeric column of each dataframe - None if either can't be normalised
     # extract the data from both dataframes in line with the data info provided 
     """
         return {
@@ -128,62 +321,13 @@ def dtw_custom(df_1, data_info_1, df_2, data_info_2) -> float:
         return None
 
     logger.info("Normalisation complete")  # Log normalisation completion
+    return baseline_data_norm, post_change_data_norm
 
-    # Initialise
-    n = len(baseline_data_norm)
-    m = len(post_change_data_norm)
-    cost_matrix = np.zeros((n, m))
-
-    for i in range(n):
-        for j in range(m):
-            cost_matrix[i, j] = np.abs(baseline_data_norm[i] - post_change_data_norm[j])
-    
-
-    cumulative_cost_matrix = cost_matrix.copy()
-    # we want D_0,i and D_0,j to be = 
-    cumulative_cost_matrix[1:, 0] = np.inf
-    cumulative_cost_matrix[0, 1:] = np.inf
-
-
-    cumulative_cost_matrix[0, 0] = cost_matrix[0, 0]
-
-    logger.info("Cumulative cost matrix initialised")  # Log cumulative cost matrix initialisation
-
-    for i in range(1, n):
-        for j in range(1, m):
-            cumulative_cost_matrix[i, j] = cost_matrix[i, j] + min(
-                cumulative_cost_matrix[i-1, j],
-                cumulative_cost_matrix[i, j-1],
-                cumulative_cost_matrix[i-1, j-1]
-            )
-
-    # right corner
-    i, j = n - 1, m - 1
-    path = [(i, j)]
 
-    #  optimal path
-    while i > 0 or j > 0:
-        if i == 0:
-            j -= 1
-        elif j == 0:
-            i -= 1
-        else:
-        # find min
-            min_index = np.argmin([cumulative_cost_matrix[i-1, j], cumulative_cost_matrix[i, j-1], cumulative_cost_matrix[i-1, j-1]])
-            if min_index == 0:
-                i -= 1
-            elif min_index == 1:
-                j -= 1
-            else:
-                i -= 1
-                j -= 1
-        path.append((i, j))
-
-    logger.info("Optimal path found")  # Log optimal path finding
-
-    path = path[::-1] # reverse the path
-
-    dtw_distance = cumulative_cost_matrix[-1, -1]
+def path_frame(baseline_data_norm, post_change_data_norm, path):
+    # the DataFrame every DTW operation returns - one row per path cell
+    cumulative_costs = path_costs(baseline_data_norm, post_change_data_norm, path)
+    dtw_distance = cumulative_costs[-1]
     logger.info(f"DTW distance: {dtw_distance}")  # Log DTW distance
 
 
@@ -191,10 +335,46 @@ def dtw_custom(df_1, data_info_1, df_2, data_info_2) -> float:
     dtw_df = pd.DataFrame({
         'Baseline Data Index': [i for i, j in path],
         'Post-Change Data Index': [j for i, j in path],
-        'Cumulative Cost': [cumulative_cost_matrix[i, j] for i, j in path]
+        'Cumulative Cost': cumulative_costs
     })
     dtw_df['DTW Distance'] = dtw_distance
     dtw_df['Path'] = path
+    return dtw_df
+
+
+def dtw_custom(df_1, data_info_1, df_2, data_info_2, window=None) -> float:
+    """
+    window: optional band the warping path has to stay in - see parse_window(). Memory and time then
+    scale with the band (n * w cells) instead of n * m, at the cost of paths that warp further than the band.
+    """
+    logger.info("Starting DTW custom function")  # Log function start
+        
+    start_time = time()
+    series = load_series(df_1, data_info_1, df_2, data_info_2)
+    if series is None:
+        return None
+    baseline_data_norm, post_change_data_norm = series
+
+    n = len(baseline_data_norm)
+    m = len(post_change_data_norm)
+    try:
+        bounds = band_bounds(n, m, window)
+    except ValueError as e:
+        logger.error(f"Error in DTW window: {e}")
+        return None
+    if bounds is not None:
+        logger.info(f"Window {window}: {int((bounds[1] - bounds[0] + 1).sum())} of {n * m} cells")
+
+    steps, base = accumulate_steps(baseline_data_norm, post_change_data_norm, bounds)
+
+    logger.info("Cumulative cost matrix filled")  # Log wavefront completion
+
+    path = backtrack(steps[0], base, n, m)
+    del steps
+
+    logger.info("Optimal path found")  # Log optimal path finding
+
+    dtw_df = path_frame(baseline_data_norm, post_change_data_norm, path)
 
     end_time = time()
     logger.info(f"Time taken: {end_time - start_time}")  # Log time taken
@@ -230,3 +410,446 @@ def dtw_custom(df_1, data_info_1, df_2, data_info_2) -> float:
     plt.show()
     index += 1
     """
+
+
+# Approximate DTW - FastDTW, Salvador & Chan 2007: https://cs.fit.edu/~pkc/papers/tdm04.pdf
+# Solve on series halved in length, project the path back up and only search within radius cells of it,
+# so each level costs about n * radius instead of n * m.
+
+DEFAULT_RADIUS = 10
+# radius 0 only follows the projected path and can land several times over the exact distance.
+# Accuracy falls off quickly below a few cells - on random walks of 300 points the worst case was
+# 4.9x at radius 0, 2.8x at 1, 1.5x at 2 and 1.13x at the default of 10
+MIN_RADIUS = 1
+
+def coarsen(data):
+    # halve the resolution by averaging pairs of points - an odd last point is kept as it is
+    pairs = len(data) // 2 * 2
+    coarse = (data[0:pairs:2] + data[1:pairs:2]) / 2
+    return np.append(coarse, data[pairs:])
+
+
+def project_path(path, n, m, radius):
+    """
+    Band at the next resolution up around a path found on the coarsened series.
+    Each coarse cell (i, j) covers rows 2i..2i+1 and columns 2j..2j+1; the band is that area widened by radius.
+
+    Returns:
+        (np.ndarray, np.ndarray): lo and hi per row, as band_bounds()
+    """
+    cells = np.array(path, dtype=np.int64).reshape(-1, 2)
+    lo = np.full(n, m - 1, dtype=np.int64)
+    hi = np.zeros(n, dtype=np.int64)
+    for row_offset in (0, 1):
+        rows = np.minimum(cells[:, 0] * 2 + row_offset, n - 1)
+        np.minimum.at(lo, rows, cells[:, 1] * 2)
+        np.maximum.at(hi, rows, np.minimum(cells[:, 1] * 2 + 1, m - 1))
+    # the path only moves forward, so the smallest lo within radius rows is radius rows back
+    # and the largest hi is radius rows on
+    rows = np.arange(n)
+    lo = lo[np.maximum(rows - radius, 0)] - radius
+    hi = hi[np.minimum(rows + radius, n - 1)] + radius
+    return connect_bounds(lo, hi, m)
+
+
+def fast_path(x, y, radius):
+    # warping path of x against y - exact once the series are too short to be worth coarsening
+    n, m = len(x), len(y)
+    bounds = None
+    if min(n, m) > radius + 2:
+        coarse = fast_path(coarsen(x), coarsen(y), radius)
+        bounds = project_path(coarse, n, m, radius)
+    steps, base = accumulate_steps(x, y, bounds)
+    return backtrack(steps[0], base, n, m)
+
+
+def dtw_fast(df_1, data_info_1, df_2, data_info_2, radius=DEFAULT_RADIUS):
+    """
+    Approximate DTW of the same two series as dtw_custom, in about n * radius time and memory.
+    A larger radius gets closer to the exact distance (see MIN_RADIUS) - the radius used is returned in the 'Radius' column.
+    """
+    logger.info("Starting DTW fast function")
+    start_time = time()
+    radius = int(radius)
+    if radius < MIN_RADIUS:
+        logger.error(f"Invalid radius {radius} - must be {MIN_RADIUS} or more")
+        return None
+    series = load_series(df_1, data_info_1, df_2, data_info_2)
+    if series is None:
+        return None
+    baseline_data_norm, post_change_data_norm = series
+
+    path = fast_path(baseline_data_norm, post_change_data_norm, radius)
+    logger.info("Approximate path found")
+
+    dtw_df = path_frame(baseline_data_norm, post_change_data_norm, path)
+    dtw_df['Radius'] = radius
+
+    logger.info(f"Time taken: {time() - start_time}")
+    return dtw_df
+
+
+# Subsequence search - UCR suite, Rakthanmanon et al. 2012: https://www.cs.ucr.edu/~eamonn/SIGKDD_trillion.pdf
+# Every window of the target as long as the query is z-normalised and compared to the z-normalised query with
+# DTW in a Sakoe-Chiba band. Cheap lower bounds rule most windows out before any DTW is run:
+#   LB_Kim    first and last points - O(1) a window, done for every window at once
+#   LB_Keogh  each window point against the query envelope (EQ), then each query point against the
+#             window envelope (EC) - O(L) a window, done in blocks of windows
+# and the DTW itself stops as soon as what it has so far plus the LB_Keogh of the rest is past the k-th best.
+# Distances here are on squared differences, as in the UCR suite, and reported as their square root.
+
+DEFAULT_TOP_K = 5
+SEARCH_WINDOW = "sakoe_chiba:10%"  # band when none is given - as a percentage of the query length
+LB_BLOCK_CELLS = 4000000  # windows x points per lower bound block
+DTW_BATCH = 256  # windows run through DTW together
+
+
+def z_normalize(data):
+    sd = np.std(data)
+    return (data - np.mean(data)) / (sd if sd > 0 else 1.0)
+
+
+def running_stats(target, length):
+    # mean and standard deviation of every window from cumulative sums - centred first so the sums stay accurate
+    offset = np.mean(target)
+    centred = target - offset
+    sums = np.concatenate(([0.0], np.cumsum(centred)))
+    squares = np.concatenate(([0.0], np.cumsum(centred * centred)))
+    mean = (sums[length:] - sums[:-length]) / length
+    sd = np.sqrt(np.maximum((squares[length:] - squares[:-length]) / length - mean * mean, 0))
+    sd[sd < 1e-8] = 1.0  # flat window - normalises to all zeros
+    return mean + offset, sd
+
+
+def envelope(data, radius):
+    # upper and lower envelope - max / min of the points within radius of each point
+    padded = np.pad(data, radius, mode="edge")
+    view = np.lib.stride_tricks.sliding_window_view(padded, 2 * radius + 1)
+    return view.max(axis=1), view.min(axis=1)
+
+
+def dtw_batch(query, windows, radius, tail, best):
+    """
+    Squared DTW of the query against every row of windows at once, inside a Sakoe-Chiba band.
+    Same anti-diagonal wavefront as accumulate_steps(), with a batch dimension and the standard border
+    (D accumulates along row 0 and column 0). Rows are dropped once they can no longer beat best.
+
+    Args:
+        windows: z-normalised windows, one per row, as long as the query
+        tail: lower bound of the cost still to come after each query point - tail[:, i + 1] for point i
+        best: squared distance to beat
+    Returns:
+        np.ndarray: squared distance per row, inf for the rows that were abandoned
+    """
+    count, length = windows.shape
+    distances = np.full(count, np.inf)
+    alive = np.arange(count)
+    # D on diagonals k-2, k-1 and k, column i + 1 for row i - columns 0 and length + 1 stay inf
+    prev2 = np.full((count, length + 2), np.inf)
+    prev1 = np.full((count, length + 2), np.inf)
+    cur = np.full((count, length + 2), np.inf)
+    prev1[:, 1] = (query[0] - windows[:, 0]) ** 2
+    last_bound = prev1[:, 1] + tail[:, 1]
+
+    for k in range(1, 2 * length - 1):
+        a = max(0, k - length + 1, -((radius - k) // 2))  # ceil((k - radius) / 2)
+        b = min(length - 1, k, (k + radius) // 2)
+        if a > b:
+            cur.fill(np.inf)  # radius 0 - odd diagonals are outside the band
+            bound = np.full(len(alive), np.inf)
+        else:
+            cost = (query[a:b + 1] - windows[:, k - b:k - a + 1][:, ::-1]) ** 2
+            best_prev = np.minimum(np.minimum(prev1[:, a:b + 1], prev1[:, a + 1:b + 2]), prev2[:, a:b + 1])
+            cur[:, a + 1:b + 2] = cost + best_prev
+            cur[:, a] = np.inf
+            cur[:, b + 2] = np.inf
+            bound = (cur[:, a + 1:b + 2] + tail[:, a + 1:b + 2]).min(axis=1)
+        # a path steps over at most one diagonal, so it crosses this one or the one before
+        keep = np.minimum(bound, last_bound) <= best
+        last_bound = bound
+        prev2, prev1, cur = prev1, cur, prev2
+        if not keep.all():
+            if not keep.any():
+                return distances
+            alive, windows, tail, last_bound = alive[keep], windows[keep], tail[keep], last_bound[keep]
+            prev2, prev1, cur = prev2[keep], prev1[keep], cur[keep]
+
+    distances[alive] = prev1[:, length]
+    return distances
+
+
+def top_matches(found, top_k, exclusion):
+    # best windows, skipping any that start within exclusion of a better one - those are the same occurrence
+    picked = []
+    for distance, start in sorted(found):
+        if all(abs(start - other) >= exclusion for _, other in picked):
+            picked.append((distance, start))
+            if len(picked) == top_k:
+                break
+    return picked
+
+
+def search_subsequence(query, target, top_k=DEFAULT_TOP_K, radius=0, exclusion=None):
+    """
+    Top k windows of target closest to query under z-normalised, banded DTW.
+
+    Returns:
+        (list, dict): (squared distance, start) of each match, best first, and how many windows each stage removed
+    """
+    length = len(query)
+    count = len(target) - length + 1
+    exclusion = max(1, length // 2) if exclusion is None else exclusion
+    query = z_normalize(np.asarray(query, dtype=np.float64))
+    target = np.asarray(target, dtype=np.float64)
+    stats = {"windows": max(count, 0), "lb_kim": 0, "lb_keogh_eq": 0, "lb_keogh_ec": 0, "dtw_abandoned": 0, "dtw": 0}
+    if count < 1:
+        return [], stats
+
+    # windows with a missing point are never matched
+    missing = np.isnan(target)
+    missing_count = np.concatenate(([0], np.cumsum(missing)))
+    has_missing = missing_count[length:] - missing_count[:-length] > 0
+    target = np.where(missing, 0.0, target)
+
+    mean, sd = running_stats(target, length)
+    windows = np.lib.stride_tricks.sliding_window_view(target, length)
+    upper_q, lower_q = envelope(query, radius)
+    upper_t, lower_t = envelope(target, radius)
+
+    kim = (query[0] - (target[:count] - mean) / sd) ** 2 + (query[-1] - (target[length - 1:] - mean) / sd) ** 2
+    kim[has_missing] = np.inf
+
+    found = []
+    best = np.inf
+
+    def run_dtw(starts, tail):
+        nonlocal best, found
+        distances = dtw_batch(query, (windows[starts] - mean[starts, None]) / sd[starts, None], radius, tail, best)
+        done = np.isfinite(distances)
+        stats["dtw"] += int(done.sum())
+        stats["dtw_abandoned"] += int((~done).sum())
+        found.extend(zip(distances[done].tolist(), starts[done].tolist()))
+        # best is taken from matches at least twice the exclusion apart - a better window found later can then
+        # only push one of them out, so the final top k never need a window that was pruned against best
+        picked = top_matches(found, top_k, 2 * exclusion)
+        if len(picked) == top_k:
+            best = picked[-1][0]
+            found = [item for item in found if item[0] <= best]
+
+    def tail_bound(starts):
+        # LB_Keogh EC per query point, summed from the end - the lower bound dtw_batch abandons on
+        upper = (upper_t[starts[:, None] + np.arange(length)] - mean[starts, None]) / sd[starts, None]
+        lower = (lower_t[starts[:, None] + np.arange(length)] - mean[starts, None]) / sd[starts, None]
+        gap = np.maximum(query - upper, 0) + np.maximum(lower - query, 0)
+        cells = gap * gap
+        tail = np.zeros((len(starts), length + 1))
+        tail[:, :length] = np.cumsum(cells[:, ::-1], axis=1)[:, ::-1]
+        return tail, tail[:, 0]
+
+    # a first best from the windows with the lowest LB_Kim, so the blocks below have something to prune against
+    seed = np.argsort(kim, kind="stable")[:top_k * 4]
+    seed = seed[np.isfinite(kim[seed])]
+    if len(seed):
+        run_dtw(seed, tail_bound(seed)[0])
+    seeded = np.zeros(count, dtype=bool)
+    seeded[seed] = True
+
+    block = max(1, LB_BLOCK_CELLS // length)
+    for first in range(0, count, block):
+        starts = np.arange(first, min(first + block, count))
+        starts = starts[~seeded[starts] & ~has_missing[starts]]
+        passed = kim[starts] <= best
+        stats["lb_kim"] += int((~passed).sum())
+        starts = starts[passed]
+        if not len(starts):
+            continue
+
+        normalised = (windows[starts] - mean[starts, None]) / sd[starts, None]
+        gap = np.maximum(normalised - upper_q, 0) + np.maximum(lower_q - normalised, 0)
+        keogh_eq = (gap * gap).sum(axis=1)
+        passed = keogh_eq <= best
+        stats["lb_keogh_eq"] += int((~passed).sum())
+        starts, keogh_eq = starts[passed], keogh_eq[passed]
+        if not len(starts):
+            continue
+
+        tail, keogh_ec = tail_bound(starts)
+        passed = keogh_ec <= best
+        stats["lb_keogh_ec"] += int((~passed).sum())
+        starts, tail = starts[passed], tail[passed]
+        bound = np.maximum(keogh_eq[passed], keogh_ec[passed])
+
+        # most promising first so best drops quickly, then re-check the bound before each batch
+        order = np.argsort(bound, kind="stable")
+        starts, tail, bound = starts[order], tail[order], bound[order]
+        for batch in range(0, len(starts), DTW_BATCH):
+            keep = bound[batch:batch + DTW_BATCH] <= best
+            stats["lb_keogh_ec"] += int((~keep).sum())
+            if keep.any():
+                run_dtw(starts[batch:batch + DTW_BATCH][keep], tail[batch:batch + DTW_BATCH][keep])
+
+    return top_matches(found, top_k, exclusion), stats
+
+
+def time_column(df, data_info):
+    for col_info in data_info['columns']:
+        if col_info.get('is_time_data') and col_info['name'] in df.columns:
+            return col_info['name']
+    return None
+
+
+def dtw_search(df_1, data_info_1, df_2, data_info_2, top_k=DEFAULT_TOP_K, window=None):
+    """
+    Find where the query series (df_1) occurs in the target series (df_2).
+
+    window: Sakoe-Chiba band as in parse_window() - a percentage is of the query length. Itakura is not
+            supported here, LB_Keogh needs a band of the same width all along.
+    Returns one row per match, best first, with its start / end index (and time when the target has one).
+    """
+    logger.info("Starting DTW subsequence search")
+    start_time = time()
+    try:
+        parsed = parse_window(window or SEARCH_WINDOW)
+    except ValueError as e:
+        logger.error(f"Error in DTW window: {e}")
+        return None
+    kind, size, percent = parsed
+    if kind != "sakoe_chiba":
+        logger.error(f"Subsequence search only supports a Sakoe-Chiba window, not {window}")
+        return None
+
+    query_name = get_info(data_info_1)
+    target_name = get_info(data_info_2)
+    if not isinstance(query_name, str) or not isinstance(target_name, str):
+        logger.error("No numeric column to search")
+        return None
+    query = df_1[query_name].to_numpy(dtype=np.float64, na_value=np.nan)
+    target = df_2[target_name].to_numpy(dtype=np.float64, na_value=np.nan)
+    query = query[~np.isnan(query)]
+    if len(query) < 2 or len(query) > len(target):
+        logger.error(f"Query of {len(query)} points can't be searched for in {len(target)} points")
+        return None
+
+    radius = int(size * len(query) / 100) if percent else int(size)
+    matches, stats = search_subsequence(query, target, top_k=int(top_k), radius=radius)
+    logger.info(f"Subsequence search of {len(query)} points in {len(target)}: {stats}")
+
+    starts = [start for _, start in matches]
+    search_df = pd.DataFrame({
+        'Rank': np.arange(1, len(matches) + 1),
+        'Start Index': starts,
+        'End Index': [start + len(query) - 1 for start in starts],
+        'DTW Distance': [np.sqrt(distance) for distance, _ in matches],
+    })
+    time_name = time_column(df_2, data_info_2)
+    if time_name is not None:
+        times = df_2[time_name].to_numpy()
+        search_df['Start Time'] = times[search_df['Start Index'].to_numpy(dtype=np.int64)]
+        search_df['End Time'] = times[search_df['End Index'].to_numpy(dtype=np.int64)]
+    search_df['Window'] = radius
+
+    logger.info(f"Time taken: {time() - start_time}")
+    return search_df
+
+
+# Multivariate DTW over several numeric columns (tags) at once - Shokoohi-Yekta et al. 2017:
+#   dependent    one warping path for all columns, on the cost summed over them (DTW_D)
+#   independent  a path per column, distance is the sum of the per column distances (DTW_I)
+# Both run every column through one wavefront pass - see accumulate_steps().
+
+MULTIVARIATE_VARIANTS = ("dependent", "independent")
+
+
+def numeric_columns(data_info, columns=None):
+    # numeric columns of the data - or the requested ones, which have to be among them
+    numeric = [col_info['name'] for col_info in data_info['columns'] if col_info['is_numeric']]
+    if not columns:
+        return numeric
+    missing = [name for name in columns if name not in numeric]
+    if missing:
+        raise ValueError(f"Columns not found or not numeric: {', '.join(missing)}")
+    return list(columns)
+
+
+def scale_columns(values, names, label):
+    # min-max per column - a flat column (setpoint, stuck sensor, bool that never changed) becomes all 0
+    # rather than 0 / 0
+    low = np.min(values, axis=0)
+    span = np.max(values, axis=0) - low
+    flat = span == 0
+    if flat.any():
+        logger.warning(f"Flat columns in {label} scaled to 0: {[name for name, f in zip(names, flat) if f]}")
+    return (values - low) / np.where(flat, 1.0, span)
+
+
+def load_columns(df_1, data_info_1, df_2, data_info_2, columns=None):
+    """
+    The selected numeric columns of both dataframes, each min-max normalised like load_series().
+    Without a selection every numeric column the two have in common is used.
+    Missing values are interpolated along the column, columns with no values at all are dropped.
+
+    Returns:
+        (list, np.ndarray, np.ndarray): column names, n x d and m x d arrays - raises ValueError on a bad selection
+    """
+    names_1 = numeric_columns(data_info_1, columns)
+    names_2 = numeric_columns(data_info_2, columns)
+    names = [name for name in names_1 if name in names_2]
+    if not names:
+        raise ValueError("No numeric columns in common")
+    # a NaN anywhere would make every cost it touches NaN - and with the summed cost of dependent DTW, the whole path
+    x = pd.DataFrame(df_1[names].to_numpy(dtype=np.float64, na_value=np.nan), columns=names).interpolate(limit_direction="both")
+    y = pd.DataFrame(df_2[names].to_numpy(dtype=np.float64, na_value=np.nan), columns=names).interpolate(limit_direction="both")
+    empty = [name for name in names if x[name].isna().any() or y[name].isna().any()]
+    if empty:
+        logger.warning(f"Columns with no values dropped: {empty}")
+        names = [name for name in names if name not in empty]
+        if not names:
+            raise ValueError("No values in the selected columns")
+    x = scale_columns(x[names].to_numpy(), names, "data 1")
+    y = scale_columns(y[names].to_numpy(), names, "data 2")
+    return names, x, y
+
+
+def dtw_multivariate(df_1, data_info_1, df_2, data_info_2, columns=None, variant="dependent", window=None):
+    """
+    DTW over several numeric columns of the two datasets.
+
+    columns: list of column names, None for every numeric column the two share
+    variant: dependent (one path) or independent (a path per column)
+    window: optional band as in dtw_custom - worth setting for independent DTW on long series,
+            it keeps a step matrix per column
+    Returns the dtw_custom frame with a Columns column for dependent, and one block of rows per column
+    (Column, its own DTW Distance and the Total Distance over the columns) for independent.
+    """
+    logger.info("Starting DTW multivariate function")
+    start_time = time()
+    if variant not in MULTIVARIATE_VARIANTS:
+        logger.error(f"Unknown variant {variant}")
+        return None
+    try:
+        names, x, y = load_columns(df_1, data_info_1, df_2, data_info_2, columns)
+        bounds = band_bounds(len(x), len(y), window)
+    except ValueError as e:
+        logger.error(f"Error in multivariate DTW: {e}")
+        return None
+    logger.info(f"Multivariate DTW ({variant}) over {len(names)} columns: {names}")
+
+    n, m = len(x), len(y)
+    steps, base = accumulate_steps(x, y, bounds, independent=variant == "independent")
+
+    if variant == "dependent":
+        path = backtrack(steps[0], base, n, m)
+        dtw_df = path_frame(x, y, path)
+        dtw_df['Columns'] = ",".join(names)
+    else:
+        frames = []
+        for lane, name in enumerate(names):
+            path = backtrack(steps[lane], base, n, m)
+            column_df = path_frame(x[:, lane], y[:, lane], path)
+            column_df.insert(0, 'Column', name)
+            frames.append(column_df)
+        dtw_df = pd.concat(frames, ignore_index=True)
+        dtw_df['Total Distance'] = dtw_df.groupby('Column', sort=False)['DTW Distance'].first().sum()
+
+    logger.info(f"Time taken: {time() - start_time}")
+    return dtw_df
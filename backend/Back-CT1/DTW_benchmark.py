@@ -0,0 +1,139 @@
+"""
+
+Benchmark of the wavefront DTW in Custom_DTW.py against the nested loop version it replaced.
+
+Checks the output is identical (path, cumulative costs and distance) and prints the time of each.
+The loop version is kept here as the reference - it takes minutes past a few thousand points,
+so it is only run up to --loop-max points.
+
+Run from this folder:  python DTW_benchmark.py --sizes 100 500 1000 2000 20000
+With --window the banded version is timed as well, e.g. --window sakoe_chiba:5%
+
+"""
+
+import argparse
+import logging
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+import Custom_DTW as dtw
+
+
+def dtw_loops(baseline_data_norm, post_change_data_norm):
+    # dtw_custom before the wavefront - cost matrix, accumulation and backtrack in python loops
+    n = len(baseline_data_norm)
+    m = len(post_change_data_norm)
+    cost_matrix = np.zeros((n, m))
+
+    for i in range(n):
+        for j in range(m):
+            cost_matrix[i, j] = np.abs(baseline_data_norm[i] - post_change_data_norm[j])
+
+    cumulative_cost_matrix = cost_matrix.copy()
+    cumulative_cost_matrix[1:, 0] = np.inf
+    cumulative_cost_matrix[0, 1:] = np.inf
+    cumulative_cost_matrix[0, 0] = cost_matrix[0, 0]
+
+    for i in range(1, n):
+        for j in range(1, m):
+            cumulative_cost_matrix[i, j] = cost_matrix[i, j] + min(
+                cumulative_cost_matrix[i-1, j],
+                cumulative_cost_matrix[i, j-1],
+                cumulative_cost_matrix[i-1, j-1]
+            )
+
+    i, j = n - 1, m - 1
+    path = [(i, j)]
+    while i > 0 or j > 0:
+        if i == 0:
+            j -= 1
+        elif j == 0:
+            i -= 1
+        else:
+            min_index = np.argmin([cumulative_cost_matrix[i-1, j], cumulative_cost_matrix[i, j-1], cumulative_cost_matrix[i-1, j-1]])
+            if min_index == 0:
+                i -= 1
+            elif min_index == 1:
+                j -= 1
+            else:
+                i -= 1
+                j -= 1
+        path.append((i, j))
+    path = path[::-1]
+
+    dtw_df = pd.DataFrame({
+        'Baseline Data Index': [i for i, j in path],
+        'Post-Change Data Index': [j for i, j in path],
+        'Cumulative Cost': [cumulative_cost_matrix[i, j] for i, j in path]
+    })
+    dtw_df['DTW Distance'] = cumulative_cost_matrix[-1, -1]
+    dtw_df['Path'] = path
+    return dtw_df
+
+
+def make_series(points, seed):
+    # sine with a phase shift and noise, as in Old_DTW_test.py - rounded so the cost matrix has ties
+    rng = np.random.default_rng(seed)
+    time_steps = np.linspace(0, 30, points)
+    baseline = np.round(np.sin(time_steps), 2)
+    post_change = np.round(np.sin(time_steps + 0.5) + rng.uniform(-.15, .15, points), 2)
+    return baseline, post_change
+
+
+def as_input(values):
+    # the dataframe / data info pair handling.py passes to dtw_custom
+    df = pd.DataFrame({"value": values})
+    info = {"columns": [{"name": "value", "is_numeric": True}]}
+    return df, info
+
+
+def run(sizes, loop_max, seed, window=None):
+    rows = []
+    for points in sizes:
+        baseline, post_change = make_series(points, seed)
+        # uneven lengths as well - the two requested ranges rarely match
+        for n, m in ((points, points), (points, max(1, points * 3 // 4))):
+            df_1, info_1 = as_input(baseline[:n])
+            df_2, info_2 = as_input(post_change[:m])
+
+            start = perf_counter()
+            fast = dtw.dtw_custom(df_1, info_1, df_2, info_2)
+            fast_time = perf_counter() - start
+
+            window_time = None
+            if window:
+                start = perf_counter()
+                dtw.dtw_custom(df_1, info_1, df_2, info_2, window=window)
+                window_time = perf_counter() - start
+
+            loop_time = None
+            same = None
+            if n <= loop_max:
+                start = perf_counter()
+                slow = dtw_loops(dtw.min_max_normalize(df_1["value"].values), dtw.min_max_normalize(df_2["value"].values))
+                loop_time = perf_counter() - start
+                same = fast.equals(slow)
+
+            rows.append({"n": n, "m": m, "wavefront_s": round(fast_time, 3),
+                         "loops_s": None if loop_time is None else round(loop_time, 3),
+                         "speedup": None if loop_time is None else round(loop_time / fast_time, 1),
+                         "window_s": None if window_time is None else round(window_time, 3),
+                         "identical": same, "distance": fast['DTW Distance'].iloc[0]})
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wavefront DTW against the nested loop version")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 1000, 2000])
+    parser.add_argument("--loop-max", type=int, default=2000, help="largest series the loop version is run on")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--window", default=None, help="also time dtw_custom with this window")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = run(args.sizes, args.loop_max, args.seed, args.window)
+    print(results.to_string(index=False))
+    if (results["identical"] == False).any():  # noqa: E712 - None means the loop version was not run
+        raise SystemExit("Wavefront output differs from the loop version")
@@ -2,7 +2,7 @@
 
 
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 import subprocess
 import requests
 import pandas as pd
@@ -10,9 +10,12 @@ import numpy as np
 from contextlib import asynccontextmanager
 import logging
 import redis as rd
+import redis.asyncio as ard
+import asyncio
 import json
 import random
 from time import sleep
+import time
 from typing import Dict, Any
 
 import Custom_Fuzzy as fuzzy
@@ -20,6 +23,8 @@ import Custom_DTW as dtw
 import step_analysis as step
 
 import processing_script as processing
+import cache_codec
+import metrics
 
 import simple_analysis as smp
 
@@ -40,6 +45,14 @@ logger.info("Starting FastAPI lifespan function...")
 
 redis_client = None
 
+# served on /metrics - see metrics.py
+HTTP_SECONDS = metrics.histogram("backend_http_request_seconds", "Time to answer an HTTP request", ("path", "status"))
+PROCESS_SECONDS = metrics.histogram("backend_process_seconds", "Time spent in each processing step", ("operation",))
+CACHE_REQUESTS = metrics.counter("backend_cache_requests_total", "/process_data lookups - hit or miss", ("route", "result"))
+PAYLOAD_BYTES = metrics.histogram("backend_payload_bytes", "Size of values read from and written to redis", ("direction",), buckets=metrics.SIZE_BUCKETS)
+BYTES_TRANSFERRED = metrics.counter("backend_bytes_total", "Bytes read from and written to redis", ("direction",))
+SERIALIZE_SECONDS = metrics.histogram("backend_serialize_seconds", "Time to encode and compress processed data", ("kind",))
+
 
 
 # Load the existing config
@@ -130,13 +143,15 @@ def pull_config_data():
     pass
 
 
-def get_redis_client():
+async def get_redis_client():
+    # one async connection pool shared by every request so redis calls do not block the event loop
     con_redis = None
     redis_ep=CONFIG['endpoints']['redis-memory-store']['ip']
     redis_port=CONFIG['endpoints']['redis-memory-store']['port']
     try:
-        con_redis = rd.StrictRedis(host=redis_ep, port=redis_port, db=0)
-        con_redis.ping()
+        pool = ard.ConnectionPool(host=redis_ep, port=redis_port, db=0, max_connections=CONFIG.get('redis', {}).get('max_connections', 50))
+        con_redis = ard.Redis(connection_pool=pool)
+        await con_redis.ping()
         logger.info("Connected to Redis server successfully.")
         return con_redis
     except rd.ConnectionError as e:
@@ -161,19 +176,21 @@ def app_startup_routine():
         
     load_config_call()
 
-    
+
+async def connect_redis():
+    # async client has to be created on the event loop so this runs from lifespan after app_startup_routine
     global redis_client
     redis_con_attempt = 0
     redis_con_max_attempts = 5
     while redis_client is None and redis_con_attempt < redis_con_max_attempts:
         try:
-            redis_client = get_redis_client()
-            sleep(1)  # Sleep for 1 second before retrying
+            redis_client = await get_redis_client()
+            await asyncio.sleep(1)  # Sleep for 1 second before retrying
             if redis_client is None:
                 logger.error("Failed to connect to Redis server.")
                 redis_con_attempt += 1
                 raise Exception("Redis connection failed")
-            if redis_client.ping():
+            if await redis_client.ping():
                 logger.info("Redis client ping successful.")
                 logger.info("Redis client initialized successfully.")
                 break
@@ -193,6 +210,7 @@ async def lifespan(app: FastAPI):
     logger.info("Starting up handling.py...")  # Log startup event
 
     app_startup_routine()
+    await connect_redis()
     
     yield
     # Define Shutdown tasks
@@ -200,7 +218,7 @@ async def lifespan(app: FastAPI):
     global redis_client
     if redis_client:
         try:
-            redis_client.close()
+            await redis_client.aclose()
             logger.info("Redis client closed successfully.")
         except Exception as e:
             logger.error(f"Error closing Redis client: {e}")
@@ -213,6 +231,28 @@ async def lifespan(app: FastAPI):
 app = FastAPI(lifespan=lifespan)
 
 
+@app.middleware("http")
+async def record_request_time(request: Request, call_next):
+    # labelled with the route template so query strings do not create new series
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_SECONDS.observe(time.perf_counter() - start, path=route.path if route else "unmatched", status=response.status_code)
+    return response
+
+
+@app.get("/metrics")
+async def get_metrics():
+    # Prometheus text format - counters are per worker process
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def timed_step(operation, func, *args):
+    # run a processing step and record how long it took - called through asyncio.to_thread
+    with PROCESS_SECONDS.time(operation=operation):
+        return func(*args)
+
+
 
 @app.post("/rec_req")
 async def rec_req(redis_key: str = None):
@@ -220,7 +260,7 @@ async def rec_req(redis_key: str = None):
     Funciton to return data from the redis store to the client
     """
     try:
-        data_send = get_redis_data(redis_key)
+        data_send = await get_redis_data(redis_key)
         if "error" in data_send:
             return {"error": data_send["error"]}
 
@@ -235,29 +275,68 @@ async def rec_req(redis_key: str = None):
 
 # process the data 
 @app.post("/process_data")
-def process_data(redis_key: str = None, operation: str = None, dual: bool = False):
+async def process_data(redis_key: str = None, operation: str = None, dual: bool = False, window: str = None, radius: int = None,
+                       top_k: int = None, columns: str = None, variant: str = "dependent"):
     """
     Function to process the data that has been passed in the request
+    Redis calls are awaited and the analysis itself runs in a worker thread so the event loop stays free
+
+    window: DTW_analysis / DTW_search - band the warping path is kept in, e.g. sakoe_chiba:200, sakoe_chiba:10% or itakura:2
+    radius: DTW_fast only - cells searched either side of the projected path at each resolution, at least 1
+    top_k: DTW_search only - number of matches returned, redis_key is "<query key>,<target key>"
+    columns: DTW_multivariate only - comma separated numeric columns, every shared numeric column if not given
+    variant: DTW_multivariate only - dependent (one path over all columns) or independent (a path per column)
     """
     global redis_client
     
     logger.info(f"Processing data for redis key: {redis_key}")
 
-    # build redis key from the request
-    redis_query_key = f'{redis_key}{operation}{dual}'
+    try:
+        window = window.strip().lower() if dtw.parse_window(window) else None
+    except ValueError as e:
+        logger.error(f"Invalid window: {e}")
+        return {"error": str(e)}
+
+    if operation == "DTW_fast":
+        # the radius already bounds the search - a window would be ignored, so say so rather than cache it apart
+        if window:
+            return {"error": "DTW_fast does not take a window - use radius"}
+        radius = dtw.DEFAULT_RADIUS if radius is None else radius
+        if radius < dtw.MIN_RADIUS:
+            return {"error": f"Radius must be {dtw.MIN_RADIUS} or more"}
+    if operation == "DTW_search":
+        top_k = dtw.DEFAULT_TOP_K if top_k is None else top_k
+        if top_k < 1:
+            return {"error": "top_k must be 1 or more"}
+        if window and not window.startswith("sakoe_chiba"):
+            return {"error": "DTW_search only supports a sakoe_chiba window"}
+    if operation == "DTW_multivariate":
+        if variant not in dtw.MULTIVARIATE_VARIANTS:
+            return {"error": f"Unknown variant {variant} - use dependent or independent"}
+        columns = [name.strip() for name in columns.split(",") if name.strip()] if columns else None
+
+    # build redis key from the request - windowed results are cached apart from the full matrix
+    redis_query_key = f'{redis_key}{operation}{dual}' + (f'{window}' if window else '')
+    if operation == "DTW_fast":
+        redis_query_key += f'radius{radius}'
+    if operation == "DTW_search":
+        redis_query_key += f'top{top_k}'
+    if operation == "DTW_multivariate":
+        redis_query_key += variant + (",".join(columns) if columns else '')
     logger.info(f"Redis query key: {redis_query_key}")
     try:
         # check if the key exists in redis
-        redis_value = redis_client.get(redis_query_key)
+        redis_value = await redis_client.get(redis_query_key)
         if redis_value:
             logging.info(f"Key {redis_query_key} found in Redis, returning cached value.")
-
+            CACHE_REQUESTS.inc(route="/process_data", result="hit")
             
             return {"redis_key": redis_value}
     except Exception as e:
         logging.error(f"Error checking Redis for key {redis_query_key}: {e}")
         return {"error": f"Error checking Redis for key {redis_query_key}"}
 
+    CACHE_REQUESTS.inc(route="/process_data", result="miss")
     logger.info(f"Operation requested: {operation}")
     logger.info(f"Dual processing requested: {dual}")
     # check if key is not none 
@@ -266,7 +345,7 @@ def process_data(redis_key: str = None, operation: str = None, dual: bool = Fals
         return {"error": "Redis key is None"}
     
     #check if dual is true
-    if operation == "DTW_analysis":
+    if operation in ("DTW_analysis", "DTW_fast", "DTW_search", "DTW_multivariate"):
         if dual == True:
             try:
                 # split the redis key into two keys
@@ -277,19 +356,26 @@ def process_data(redis_key: str = None, operation: str = None, dual: bool = Fals
                 logger.info(f"Redis key 1: {redis_key_1}")
                 logger.info(f"Redis key 2: {redis_key_2}")
                 # get the data from the redis store
-                op_data_1 = get_redis_data(redis_key_1)
-                op_data_2 = get_redis_data(redis_key_2)
-
-                data_info_1, df1 = processing.configure_data(op_data_1)
-                data_info_2, df2 = processing.configure_data(op_data_2)
-
-                updated_data_df = dtw.dtw_custom(df1, data_info_1, df2, data_info_2)
+                op_data_1, op_data_2 = await asyncio.gather(get_redis_data(redis_key_1), get_redis_data(redis_key_2))
+
+                data_info_1, df1 = await asyncio.to_thread(timed_step, "configure_data", processing.configure_data, op_data_1)
+                data_info_2, df2 = await asyncio.to_thread(timed_step, "configure_data", processing.configure_data, op_data_2)
+
+                if operation == "DTW_fast":
+                    updated_data_df = await asyncio.to_thread(timed_step, operation, dtw.dtw_fast, df1, data_info_1, df2, data_info_2, radius)
+                elif operation == "DTW_search":
+                    updated_data_df = await asyncio.to_thread(timed_step, operation, dtw.dtw_search, df1, data_info_1, df2, data_info_2, top_k, window)
+                elif operation == "DTW_multivariate":
+                    updated_data_df = await asyncio.to_thread(timed_step, operation, dtw.dtw_multivariate, df1, data_info_1, df2, data_info_2,
+                                                              columns, variant, window)
+                else:
+                    updated_data_df = await asyncio.to_thread(timed_step, operation, dtw.dtw_custom, df1, data_info_1, df2, data_info_2, window)
                 if updated_data_df is None:
                     logger.error("Error in DTW processing")
                     return {"error": "Error in DTW processing"}
-                proc_key = send_processed_data_to_redis(updated_data_df, redis_query_key)
+                proc_key = await send_processed_data_to_redis(updated_data_df, redis_query_key)
                 try:
-                    val = send_data_to_server_db( proc_key, redis_key, operation, flag=1)
+                    val = await asyncio.to_thread(send_data_to_server_db, proc_key, redis_key, operation, flag=1)
                     try: 
                         if "error" in val:
                             logger.error(f"Error sending data to server: {val['error']}")
@@ -315,7 +401,7 @@ def process_data(redis_key: str = None, operation: str = None, dual: bool = Fals
             return {"error": "Dual processing not requested"}
 
 
-    op_data = get_redis_data(redis_key)
+    op_data = await get_redis_data(redis_key)
     # if  return {"error": "Redis key not found"} is returned, then we need to handle this error and return a message to the user
     # log type returned 
     logger.info(f"Data type returned: {type(op_data)}")
@@ -331,7 +417,7 @@ def process_data(redis_key: str = None, operation: str = None, dual: bool = Fals
    
     logger.info(f"Data to process: available")
     logger.info(f"Calling processing script...")
-    data_info, df = processing.configure_data(op_data)
+    data_info, df = await asyncio.to_thread(timed_step, "configure_data", processing.configure_data, op_data)
     # strip data_info of the dataframe
     logger.info(f"Data info: {data_info}")
 
@@ -349,17 +435,17 @@ def process_data(redis_key: str = None, operation: str = None, dual: bool = Fals
     try:
         if operation == "Smp_Daily_Avg":
             logger.info(f"Processing data for daily average... calling analysis function")
-            updated_data_df = smp.daily_average(df, data_info)
+            updated_data_df = await asyncio.to_thread(timed_step, operation, smp.daily_average, df, data_info)
 
         
 
 
             # send data to redis store 
             logger.info(f"Sending processed data to Redis...")
-            proc_key = send_processed_data_to_redis(updated_data_df, redis_query_key)
+            proc_key = await send_processed_data_to_redis(updated_data_df, redis_query_key)
 
             try:
-                val = send_data_to_server_db( proc_key, redis_key, operation, flag=1)
+                val = await asyncio.to_thread(send_data_to_server_db, proc_key, redis_key, operation, flag=1)
                 try: 
                     if "error" in val:
                         logger.error(f"Error sending data to server: {val['error']}")
@@ -382,14 +468,14 @@ def process_data(redis_key: str = None, operation: str = None, dual: bool = Fals
     try:
         if operation == "Smp_Daily_Statistics":
             logger.info(f"Processing data for daily statistics... calling analysis function")
-            updated_data_df = smp.daily_statistics(df, data_info)
+            updated_data_df = await asyncio.to_thread(timed_step, operation, smp.daily_statistics, df, data_info)
 
         # send data to redis store 
         logger.info(f"Sending processed data to Redis...")
-        proc_key = send_processed_data_to_redis(updated_data_df, redis_query_key)
+        proc_key = await send_processed_data_to_redis(updated_data_df, redis_query_key)
 
         try:
-            val = send_data_to_server_db( proc_key, redis_key, operation, flag=1)
+            val = await asyncio.to_thread(send_data_to_server_db, proc_key, redis_key, operation, flag=1)
             try: 
                 if "error" in val:
                     logger.error(f"Error sending data to server: {val['error']}")
@@ -436,24 +522,24 @@ def send_data_to_server_db(proc_key: str, redis_key: str, operation: str, flag:
         return {"error": "Failed to send data to server"}
 
 
-def get_redis_data(redis_key):
+async def get_redis_data(redis_key):
     """
     Function to get the data from the redis store
     """
 
     try:
-        # get redis data via the key
-        if redis_client.exists(redis_key):
-            logger.info(f"Redis key {redis_key} exists")
-            redis_data = redis_client.get(redis_key)
-
-        
-
-        else:
+        # get redis data via the key - a missing key comes back as None so no separate EXISTS is needed
+        redis_data = await redis_client.get(redis_key)
+        if redis_data is None:
             logger.info(f"Redis key {redis_key} does not exist")
             return {"error": "Redis key not found"}
+        logger.info(f"Redis key {redis_key} exists")
+        # streamed results are stored as a manifest of chunk keys - join the chunks back together
+        redis_data = await cache_codec.resolve_payload_async(redis_client, redis_data)
         if redis_data is None:
-            return {"error": f"No data found for the key {redis_key}"}
+            return {"error": f"Data for the key {redis_key} has expired"}
+        PAYLOAD_BYTES.observe(len(redis_data), direction="read")
+        BYTES_TRANSFERRED.inc(len(redis_data), direction="read")
         # Convert the redis data to a di
         logger.info(f"Redis data: Available")
         return redis_data
@@ -478,53 +564,68 @@ def json_serial(obj):
         return obj.tolist()
     raise TypeError(f"Type {type(obj)} not serializable")
 
-def send_processed_data_to_redis(data, redis_qry_key: str = None):
-    
-    """
-    Function to send the processed data back to the redis store
-    """
-    logger.info(f"Sending processed data to Redis... func")
-    # convert data to a list first before sending to redis
+def encode_processed_data(data):
+    # tables are stored in the columnar format, series and dicts stay as JSON
+    with SERIALIZE_SECONDS.time(kind=type(data).__name__):
+        return _encode_processed_data(data)
+
+
+def _encode_processed_data(data):
     if isinstance(data, pd.DataFrame):
         logger.info(f"Data is a DataFrame")
-        data = data.to_dict(orient='records')
+        payload = cache_codec.encode_frame(data, default=json_serial)
     elif isinstance(data, pd.Series):
         logger.info(f"Data is a Series")
-        data = data.to_dict()
+        payload = json.dumps(data.to_dict(), default=json_serial)
     elif isinstance(data, dict):
-        pass  # Already in the correct format
+        payload = json.dumps(data, default=json_serial)
     else:
-        logger.error(f"Unsupported data type: {type(data)}")
-        return {"error": "Unsupported data type"}
+        return None
+    cache_settings = CONFIG.get('cache', {})
+    return cache_codec.compress(
+        payload,
+        codec=cache_settings.get('compression', cache_codec.DEFAULT_CODEC),
+        min_bytes=cache_settings.get('compression_min_bytes', cache_codec.DEFAULT_MIN_BYTES),
+        level=cache_settings.get('compression_level', 3)
+    )
+
+
+async def send_processed_data_to_redis(data, redis_qry_key: str = None):
+    
+    """
+    Function to send the processed data back to the redis store
+    """
+    logger.info(f"Sending processed data to Redis... func")
+    try:
+        payload = await asyncio.to_thread(encode_processed_data, data)
+        if payload is None:
+            logger.error(f"Unsupported data type: {type(data)}")
+            return {"error": "Unsupported data type"}
+    except Exception as e:
+        logger.error(f"Error encoding processed data: {str(e)}")
+        return {"error": "Failed to encode processed data"}
 
 
     try:
-        # Convert the data to JSON
-        logger.info(f"Converting data to JSON...")
         
         # Generate a unique key for the processed data
-        key_num = random.randint(1, 10000)
-        key_str = random.choice(['a', 'b', 'c', 'd', 'e'])
-        key = f"processed_data:{key_num}{key_str}"
-        redis_key = str(key)
-        if isinstance(redis_key, tuple):
-            logger.info(f"Redis key is a tuple")
-            redis_key = redis_key[0]
+        # SET NX writes the data only if the key is free, so reserving the key and storing the data is one round trip
+        logger.info(f"Size of payload: {len(payload)}")
+        PAYLOAD_BYTES.observe(len(payload), direction="write")
+        BYTES_TRANSFERRED.inc(len(payload), direction="write")
+        while True:
+            key_num = random.randint(1, 10000)
+            key_str = random.choice(['a', 'b', 'c', 'd', 'e'])
+            redis_key = f"processed_data:{key_num}{key_str}"
+            if await redis_client.set(redis_key, payload, nx=True, ex=7200):  # TTL to 2 hours
+                break
+            logger.info(f"Key {redis_key} already exists in Redis, generating a new key...")
         logger.info(f"Generated Redis key: {redis_key}")
-        # Store the processed data in Redis
-
-        logger.info(f"Type redis_key: {type(redis_key)} | Value: {redis_key}")
-        json_payload = json.dumps(data, default=json_serial)
-        logger.info(f"Type of JSON payload: {type(json_payload)}")
-        logger.info(f"Type of redis_client.set: {type(redis_client.set)}")
-
-        redis_client.set(redis_key, json.dumps(data, default=json_serial), ex=7200)  # TTL to 2 hours
-        
 
         try:
             # Store the redis key in the redis store
             logger.info(f"Storing redis key in redis store")
-            redis_client.set(redis_qry_key, redis_key, ex=7200)  # TTL to 2 hours
+            await redis_client.set(redis_qry_key, redis_key, ex=7200)  # TTL to 2 hours
         except Exception as e:
             logger.error(f"Error storing redis key in redis store: {str(e)}")
             return {"error": "Failed to store redis key in redis store"}
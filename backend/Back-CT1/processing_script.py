@@ -15,6 +15,8 @@ import pandas as pd
 import json
 import logging
 
+import cache_codec
+
 # setup_processing_logging
 logger = logging.getLogger(__name__)
 
@@ -37,10 +39,17 @@ def _desc_data(raw_data):
     try:
         # Convert raw data to DataFrame
         
-        if isinstance(raw_data, bytes):
-            raw_data = raw_data.decode('utf-8')
-
-        df = pd.read_json(raw_data)
+        # columnar values decode straight to typed columns, older keys are still JSON
+        # the header meta from the abstraction layer catalog names the time and id columns
+        meta = {}
+        if cache_codec.is_columnar(raw_data):
+            df = cache_codec.decode_frame(raw_data)
+            meta = cache_codec.read_header(raw_data)[0].get("meta") or {}
+        else:
+            if isinstance(raw_data, bytes):
+                raw_data = raw_data.decode('utf-8')
+
+            df = pd.read_json(raw_data)
 
         logger.info(f"DataFrame shape: {df.shape}")  # Log DataFrame shape
         data_column_info = []
@@ -53,10 +62,11 @@ def _desc_data(raw_data):
         # https://pandas.pydata.org/docs/reference/api/pandas.api.types.is_integer_dtype.html
         
 
-        # drop the first column (assumed to be ID or index)
+        # drop the first column when it is the ID - results without catalog meta (JSON, older keys) assume it is
         logger.info(f"Initial DataFrame shape: {df.shape}")  # Log initial DataFrame shape
-        df.drop(df.columns[0], axis=1, inplace=True)
-        logger.info(f"DataFrame shape after dropping first column: {df.shape}")  # Log DataFrame shape after dropping first column
+        if "id_column" not in meta or (meta["id_column"] and len(df.columns) and df.columns[0] == meta["id_column"]):
+            df.drop(df.columns[0], axis=1, inplace=True)
+            logger.info(f"DataFrame shape after dropping first column: {df.shape}")  # Log DataFrame shape after dropping first column
 
         for col in df.columns:
             logger.info(f"Processing column: {col}")  # Log column processing event
@@ -68,7 +78,11 @@ def _desc_data(raw_data):
             # parse name in the columns to check for dates, datetime, time etc 
             date_list = ['date', 'datetime', 'time', 'timestamp', 'timezone', 'date_time', 'time_stamp' ]
             logger.info(f"Checking for date in column name: {col}")  # Log date check event
-            time_flag = any(date in cols_info['name'].lower() for date in date_list)
+            if meta.get("time_column"):
+                # the catalog already knows the time column - no need to guess from the name
+                time_flag = col == meta["time_column"]
+            else:
+                time_flag = any(date in cols_info['name'].lower() for date in date_list)
             cols_info['is_time_data'] = time_flag or pd.api.types.is_datetime64_any_dtype(df[col])
             if time_flag:
                 if pd.api.types.is_datetime64_any_dtype(df[col]):
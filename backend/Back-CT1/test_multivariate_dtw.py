@@ -0,0 +1,55 @@
+'''
+Multivariate DTW with a flat column and missing values - the distance has to stay finite and the path
+has to follow the data, not run along the border
+
+Run from this folder:  python -m pytest -q test_multivariate_dtw.py
+
+'''
+import numpy as np
+import pandas as pd
+
+import Custom_DTW as dtw
+
+
+def as_input(df):
+    info = {"columns": [{"name": name, "is_numeric": True} for name in df.columns]}
+    return df, info
+
+
+def make_frames():
+    t = np.linspace(0, 6, 120)
+    df_1 = pd.DataFrame({"temp": np.sin(t), "setpoint": 50.0, "flow": np.cos(t)})
+    df_2 = pd.DataFrame({"temp": np.sin(t + 0.3), "setpoint": 50.0, "flow": np.cos(t + 0.3)})
+    return df_1, df_2
+
+
+def test_constant_column():
+    df_1, df_2 = make_frames()
+    for variant in ("dependent", "independent"):
+        result = dtw.dtw_multivariate(*as_input(df_1), *as_input(df_2), variant=variant)
+        assert np.isfinite(result['DTW Distance']).all()
+        assert result['Cumulative Cost'].iloc[-1] == result['DTW Distance'].iloc[-1]
+
+    # the flat column adds nothing - same path and distance as without it
+    with_flat = dtw.dtw_multivariate(*as_input(df_1), *as_input(df_2))
+    without = dtw.dtw_multivariate(*as_input(df_1[["temp", "flow"]]), *as_input(df_2[["temp", "flow"]]))
+    assert with_flat['Path'].tolist() == without['Path'].tolist()
+    assert np.isclose(with_flat['DTW Distance'].iloc[0], without['DTW Distance'].iloc[0])
+
+
+def test_path_leaves_the_border():
+    df_1, df_2 = make_frames()
+    result = dtw.dtw_multivariate(*as_input(df_1), *as_input(df_2))
+    path = result['Path'].tolist()
+    # a NaN cost sends the backtrack along row 0 and the last column
+    assert sum(1 for i, j in path if i == 0) < 5
+
+
+def test_missing_values():
+    df_1, df_2 = make_frames()
+    df_1.loc[[0, 40, 41], "temp"] = np.nan
+    df_2["empty"] = np.nan
+    df_1["empty"] = 1.0
+    result = dtw.dtw_multivariate(*as_input(df_1), *as_input(df_2))
+    assert np.isfinite(result['DTW Distance'].iloc[0])
+    assert result['Columns'].iloc[0] == "temp,setpoint,flow"
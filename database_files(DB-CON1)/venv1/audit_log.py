@@ -0,0 +1,117 @@
+'''
+Write-behind queue for the audit tables on the platform database
+(redis_data.redis_cache_log, redis_data.reused_queries, redis_data.redis_processed_log)
+
+Requests only put a row on the queue - a background thread with its own platform connection
+writes the rows in batches with multi-row INSERTs, so a cache hit never waits on the platform database.
+
+'''
+import logging
+import queue
+import threading
+import time
+
+
+class audit_queue:
+
+    def __init__(self, connect, max_rows=10000, batch_size=500, flush_interval=2.0, max_params=2000):
+        """
+        Args:
+            connect: callable returning a connectcls_postgres for the platform database (open_server_db_con)
+            max_rows: rows held in memory - rows logged while the queue is full are dropped and counted
+            batch_size: rows that trigger a flush
+            flush_interval: seconds after which a partial batch is flushed
+            max_params: bound parameters per INSERT statement - long batches are split over several statements
+        """
+        self.connect = connect
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.max_params = max_params
+        self.rows = queue.Queue(maxsize=max(1, int(max_rows)))
+        self.dropped = 0
+        self.con = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def __str__(self):
+        return f'Audit Queue: {self.rows.qsize()} pending, {self.dropped} dropped, Batch Size: {self.batch_size}, Flush Interval: {self.flush_interval}s'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def log(self, table, columns, values):
+        # never blocks the caller - when the queue is full the row is dropped
+        try:
+            self.rows.put_nowait((table, tuple(columns), tuple(values)))
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logging.warning(f"Audit queue full - {self.dropped} rows dropped")
+
+    def stop(self, timeout=10):
+        # flush whatever is left and close the connection - called from lifespan on shutdown
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self.con is not None and self.con.conn is not None:
+            self.con.close_connection()
+            self.con = None
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while not self._stop.is_set() or not self.rows.empty():
+            try:
+                batch.append(self.rows.get(timeout=max(0.0, min(deadline - time.monotonic(), 0.5))))
+            except queue.Empty:
+                pass
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline or self._stop.is_set():
+                if batch:
+                    self.flush(batch)
+                    batch = []
+                deadline = time.monotonic() + self.flush_interval
+        if batch:
+            self.flush(batch)
+
+    def flush(self, batch):
+        # rows are grouped by table so each group goes in as one or more multi-row INSERTs
+        groups = {}
+        for table, columns, values in batch:
+            groups.setdefault((table, columns), []).append(values)
+
+        for attempt in range(2):
+            try:
+                if self.con is None or self.con.conn is None:
+                    self.con = self.connect()
+                    if self.con is None:
+                        raise ConnectionError("Platform database connection not established")
+                for (table, columns), rows in groups.items():
+                    self._insert(table, columns, rows)
+                self.con.conn.commit()
+                logging.info(f"Audit queue flushed {len(batch)} rows")
+                return
+            except Exception as e:
+                logging.error(f"Error flushing audit rows (attempt {attempt + 1}): {e}")
+                # drop the connection so the next attempt opens a fresh one
+                try:
+                    if self.con is not None and self.con.conn is not None:
+                        self.con.conn.rollback()
+                        self.con.close_connection()
+                except Exception:
+                    pass
+                self.con = None
+        logging.error(f"Dropped {len(batch)} audit rows after failed flush")
+        self.dropped += len(batch)
+
+    def _insert(self, table, columns, rows):
+        # INSERT INTO t (a, b) VALUES (?, ?), (?, ?) ... - full batches always use the same statement text
+        # so the prepared statement is reused
+        per_statement = max(1, self.max_params // len(columns))
+        placeholder = "(" + ", ".join("?" for _ in columns) + ")"
+        for i in range(0, len(rows), per_statement):
+            part = rows[i:i + per_statement]
+            query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join(placeholder for _ in part)}"
+            params = [value for row in part for value in row]
+            cursor = self.con.statement_cursor(query)
+            cursor.execute(query, params)
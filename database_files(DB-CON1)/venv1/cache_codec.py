@@ -0,0 +1,566 @@
+# Shared encoding helpers for values stored in the Redis memory store
+
+'''
+This module is used by the abstraction layer (main_abstraction.py), the backend (handling.py) and the
+Dash front end (Dash_main.py) so the writers and readers of cached data agree on the format.
+Each service is deployed on its own, so a copy of this file sits beside each of them - keep the copies in sync.
+
+Formats:
+    JSON array of row dicts - original format, still readable so keys written before the change keep working
+    Columnar - header plus one typed little-endian buffer per column, see encode_columns()
+    Chunk manifest - a streamed result split across several Redis keys, see build_manifest()
+    Spill pointer - an oversized columnar value kept in a file instead of Redis, see build_spill()
+    Compressed - any of the above compressed with zlib / zstd / lz4, see compress()
+
+Writing only needs the standard library (the abstraction layer does not install numpy),
+reading into a DataFrame uses numpy/pandas and maps the numeric buffers without copying them.
+
+'''
+import asyncio
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from datetime import datetime, date, timedelta, timezone
+from decimal import Decimal
+
+# zstd and lz4 are optional - zlib from the standard library is used if they are not installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+logger = logging.getLogger(__name__)
+_warned_codecs = set()
+
+
+# markers written at the start of a value - JSON values always start with '[' or '{'
+# the number is the format version, bump it if the layout changes
+MANIFEST_MARKER = b"FYP:MANIFEST:1\n"
+COLUMNAR_MARKER = b"FYP:COLUMNAR:1\n"
+COMPRESSED_MARKER = b"FYP:Z:1:"  # followed by the codec name and a newline
+SPILL_MARKER = b"FYP:SPILL:1\n"
+
+DEFAULT_CODEC = "zlib"
+DEFAULT_MIN_BYTES = 64 * 1024  # values smaller than this are stored as-is
+
+# column types used in the columnar header
+# numeric and datetime columns are raw little-endian buffers, text and anything else is a JSON list
+NUMPY_TYPES = {"float64": "<f8", "int64": "<i8", "bool": "|b1", "datetime64[us]": "<i8"}
+NAT = -2**63  # numpy's NaT for datetime64 stored as int64
+EPOCH = datetime(1970, 1, 1)
+ALIGN = 8
+
+
+def chunk_key(redis_key, index):
+    # key name for the index'th chunk of a streamed result
+    return f"{redis_key}:chunk:{index}"
+
+
+def build_manifest(chunk_keys, rows):
+    """
+    Build the value stored under the main key of a streamed result.
+
+    Args:
+        chunk_keys (list): Redis keys holding the chunks, in order
+        rows (int): total number of rows across all chunks
+    Returns:
+        bytes: manifest value
+    """
+    return MANIFEST_MARKER + json.dumps({"chunks": chunk_keys, "rows": rows}).encode('utf-8')
+
+
+def is_manifest(payload):
+    return isinstance(payload, (bytes, bytearray, memoryview)) and bytes(payload[:len(MANIFEST_MARKER)]) == MANIFEST_MARKER
+
+
+def read_manifest(payload):
+    return json.loads(bytes(payload[len(MANIFEST_MARKER):]).decode('utf-8'))
+
+
+def join_chunks(chunks):
+    """
+    Join the chunks of a streamed result back into one value.
+    JSON array chunks are joined without parsing them, columnar chunks are joined column by column.
+    """
+    if chunks and is_columnar(chunks[0]):
+        return concat_columnar(chunks)
+    bodies = []
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        body = bytes(chunk).strip()[1:-1].strip()
+        if body:
+            bodies.append(body)
+    return b"[" + b",".join(bodies) + b"]"
+
+
+def build_spill(path, rows, size):
+    """
+    Build the value stored in Redis for a result that was spilled to a file.
+
+    Args:
+        path (str): absolute path of the uncompressed columnar file - readers open the same path
+        rows (int): rows in the result
+        size (int): file size in bytes
+    Returns:
+        bytes: spill pointer value
+    """
+    return SPILL_MARKER + json.dumps({"path": path, "rows": rows, "bytes": size}).encode('utf-8')
+
+
+def is_spill(payload):
+    return isinstance(payload, (bytes, bytearray, memoryview)) and bytes(payload[:len(SPILL_MARKER)]) == SPILL_MARKER
+
+
+def read_spill(payload):
+    return json.loads(bytes(payload[len(SPILL_MARKER):]).decode('utf-8'))
+
+
+def write_spill(path, payload):
+    # written to a temporary name and renamed so a reader never maps a half written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+    return path
+
+
+def open_spill(payload):
+    """
+    Map a spilled result into memory read-only. Only the pages that are read are loaded from disk,
+    so decode_frame(..., columns=[...]) touches only the requested columns.
+
+    Returns:
+        memoryview: the columnar value, or None if the file has been removed
+    """
+    path = read_spill(payload)["path"]
+    try:
+        with open(path, "rb") as f:
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    except FileNotFoundError:
+        logger.warning(f"Spill file {path} not found")
+        return None
+
+
+def resolve_payload(client, payload):
+    """
+    Return the full value for a payload read from Redis - compressed values are decompressed,
+    manifests are expanded by fetching their chunks and spilled results are memory mapped.
+    Returns None if any chunk or the spill file has expired.
+    """
+    payload = decompress(payload)
+    if is_spill(payload):
+        return open_spill(payload)
+    if not is_manifest(payload):
+        return payload
+    manifest = read_manifest(payload)
+    if not manifest["chunks"]:
+        return b"[]"
+    chunks = client.mget(manifest["chunks"])
+    if any(chunk is None for chunk in chunks):
+        return None
+    return join_chunks([decompress(chunk) for chunk in chunks])
+
+
+async def resolve_payload_async(client, payload):
+    """
+    resolve_payload for a redis.asyncio client - decompressing and joining run in a worker thread
+    so large results do not block the event loop.
+    """
+    payload = await asyncio.to_thread(decompress, payload)
+    if is_spill(payload):
+        return open_spill(payload)
+    if not is_manifest(payload):
+        return payload
+    manifest = read_manifest(payload)
+    if not manifest["chunks"]:
+        return b"[]"
+    chunks = await client.mget(manifest["chunks"])
+    if any(chunk is None for chunk in chunks):
+        return None
+    return await asyncio.to_thread(lambda: join_chunks([decompress(chunk) for chunk in chunks]))
+
+
+# ---------------------
+# Compression
+# ---------------------
+
+
+def available_codec(codec):
+    # fall back to zlib if the requested codec is not installed
+    if codec in (None, "", "none"):
+        return None
+    if codec == "zstd" and zstandard is None or codec == "lz4" and lz4_frame is None or codec not in ("zlib", "zstd", "lz4"):
+        if codec not in _warned_codecs:
+            _warned_codecs.add(codec)
+            logger.warning(f"Compression codec {codec} not available, using {DEFAULT_CODEC}")
+        return DEFAULT_CODEC
+    return codec
+
+
+def compress(payload, codec=DEFAULT_CODEC, min_bytes=DEFAULT_MIN_BYTES, level=3):
+    """
+    Compress a value before it is written to Redis.
+    Values below min_bytes, or that do not get smaller, are returned unchanged.
+
+    Args:
+        payload (bytes | str): value to store
+        codec (str): "zlib", "zstd", "lz4" or "none"
+        min_bytes (int): size threshold below which the value is stored as-is
+        level (int): compression level passed to the codec
+    """
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    codec = available_codec(codec)
+    if codec is None or len(payload) < min_bytes:
+        return payload
+
+    if codec == "zstd":
+        body = zstandard.ZstdCompressor(level=level).compress(payload)
+    elif codec == "lz4":
+        body = lz4_frame.compress(payload, compression_level=level)
+    else:
+        body = zlib.compress(payload, level)
+
+    header = COMPRESSED_MARKER + codec.encode('ascii') + b"\n"
+    if len(header) + len(body) >= len(payload):
+        return payload
+    return header + body
+
+
+def decompress(payload):
+    """
+    Undo compress() - values without the compression marker are returned unchanged.
+    """
+    if not isinstance(payload, (bytes, bytearray, memoryview)) or bytes(payload[:len(COMPRESSED_MARKER)]) != COMPRESSED_MARKER:
+        return payload
+    end = bytes(payload[:32]).index(b"\n")
+    codec = bytes(payload[len(COMPRESSED_MARKER):end]).decode('ascii')
+    body = payload[end + 1:]
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("Value is zstd compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(body)
+    if codec == "lz4":
+        if lz4_frame is None:
+            raise ValueError("Value is lz4 compressed but lz4 is not installed")
+        return lz4_frame.decompress(body)
+    return zlib.decompress(body)
+
+
+# ---------------------
+# Columnar format
+# ---------------------
+# layout: COLUMNAR_MARKER | 4 byte header length | header JSON | padding | column buffers (each 8 byte aligned)
+# header: {"rows": n, "columns": [{"name", "dtype", "offset", "length"}], "meta": {}}
+
+
+def is_columnar(payload):
+    return isinstance(payload, (bytes, bytearray, memoryview)) and bytes(payload[:len(COLUMNAR_MARKER)]) == COLUMNAR_MARKER
+
+
+def _datetime_to_us(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    else:
+        value = datetime(value.year, value.month, value.day)
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _encode_column(values, default=None):
+    # work out the narrowest type that holds every value in the column and pack it - returns (dtype, bytes)
+    kinds = set()
+    has_none = False
+    for value in values:
+        if value is None:
+            has_none = True
+        elif isinstance(value, bool):
+            kinds.add("bool")
+        elif isinstance(value, int):
+            kinds.add("int")
+        elif isinstance(value, (float, Decimal)):
+            kinds.add("float")
+        elif isinstance(value, (datetime, date)):
+            kinds.add("datetime")
+        elif isinstance(value, str):
+            kinds.add("str")
+        else:
+            kinds.add("other")
+
+    try:
+        if not kinds:
+            return "null", b""
+        if kinds == {"bool"} and not has_none:
+            return "bool", bytes(bytearray(values))
+        if kinds == {"int"} and not has_none:
+            return "int64", _le(array('q', values))
+        if kinds <= {"int", "float"}:
+            # ints with gaps become floats with NaN, the same as pandas does when reading the JSON
+            return "float64", _le(array('d', [math.nan if v is None else float(v) for v in values]))
+        if kinds == {"datetime"}:
+            return "datetime64[us]", _le(array('q', [NAT if v is None else _datetime_to_us(v) for v in values]))
+        if kinds == {"str"}:
+            return "str", json.dumps(values).encode('utf-8')
+    except OverflowError:
+        pass
+    return "json", json.dumps(values, default=default).encode('utf-8')
+
+
+def _le(arr):
+    # buffers are always little-endian
+    if struct.pack('=H', 1) != struct.pack('<H', 1):
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _pack(rows, encoded, meta=None):
+    # encoded is a list of (name, dtype, bytes)
+    columns = []
+    offset = 0
+    for name, dtype, buf in encoded:
+        columns.append({"name": name, "dtype": dtype, "offset": offset, "length": len(buf)})
+        offset += len(buf) + (-len(buf) % ALIGN)
+    header = json.dumps({"rows": rows, "columns": columns, "meta": meta or {}}).encode('utf-8')
+    start = len(COLUMNAR_MARKER) + 4 + len(header)
+    parts = [COLUMNAR_MARKER, struct.pack('<I', len(header)), header, b"\0" * (-start % ALIGN)]
+    for _, _, buf in encoded:
+        parts.append(buf)
+        parts.append(b"\0" * (-len(buf) % ALIGN))
+    return b"".join(parts)
+
+
+def read_header(payload):
+    """
+    Read the header of a columnar value.
+
+    Returns:
+        (dict, int): the header and the position in the payload where the column buffers start
+    """
+    pos = len(COLUMNAR_MARKER)
+    (length,) = struct.unpack_from('<I', payload, pos)
+    pos += 4
+    header = json.loads(bytes(payload[pos:pos + length]).decode('utf-8'))
+    pos += length
+    return header, pos + (-pos % ALIGN)
+
+
+def encode_columns(names, columns, default=None, meta=None):
+    """
+    Encode column lists into the columnar format using only the standard library.
+
+    Args:
+        names (list): column names
+        columns (list): one list of values per column, all the same length
+        default: JSON serializer used for values that need the JSON fallback
+        meta (dict): extra information stored in the header
+    Returns:
+        bytes: columnar value
+    """
+    rows = len(columns[0]) if columns else 0
+    encoded = [(str(name),) + _encode_column(values, default) for name, values in zip(names, columns)]
+    return _pack(rows, encoded, meta)
+
+
+def encode_records(records, default=None, meta=None):
+    """
+    Encode a list of row dicts (the output of connectcls_*.query) into the columnar format.
+    """
+    names = list(records[0].keys()) if records else []
+    columns = [[record.get(name) for record in records] for name in names]
+    return encode_columns(names, columns, default, meta)
+
+
+def encode_frame(df, default=None, meta=None):
+    """
+    Encode a pandas DataFrame into the columnar format - numeric and datetime columns are copied straight from numpy.
+    """
+    import numpy as np
+    import pandas as pd
+
+    encoded = []
+    for name in df.columns:
+        series = df[name]
+        dtype = series.dtype
+        if pd.api.types.is_bool_dtype(dtype) and dtype != object:
+            encoded.append((str(name), "bool", series.to_numpy(dtype=np.bool_).tobytes()))
+        elif pd.api.types.is_integer_dtype(dtype) and not isinstance(dtype, pd.api.extensions.ExtensionDtype):
+            encoded.append((str(name), "int64", series.to_numpy().astype('<i8').tobytes()))
+        elif pd.api.types.is_float_dtype(dtype) and not isinstance(dtype, pd.api.extensions.ExtensionDtype):
+            encoded.append((str(name), "float64", series.to_numpy().astype('<f8').tobytes()))
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            if getattr(dtype, 'tz', None) is not None:
+                series = series.dt.tz_convert('UTC').dt.tz_localize(None)
+            encoded.append((str(name), "datetime64[us]", series.to_numpy().astype('datetime64[us]').view('<i8').tobytes()))
+        else:
+            values = [None if _is_missing(v) else v for v in series.tolist()]
+            encoded.append((str(name),) + _encode_column(values, default))
+    return _pack(len(df), encoded, meta)
+
+
+def _is_missing(value):
+    # NaN / NaT / pd.NA in object columns are stored as nulls
+    try:
+        return value is None or value != value
+    except Exception:
+        return False
+
+
+def decode_frame(payload, columns=None):
+    """
+    Decode a columnar value into a pandas DataFrame.
+    Numeric and datetime columns are numpy views on the payload buffer rather than copies,
+    so the frame is read-only until a column is replaced.
+
+    Args:
+        payload (bytes): columnar value
+        columns (list): optional subset of column names to decode
+    """
+    import numpy as np
+    import pandas as pd
+
+    header, base = read_header(payload)
+    rows = header["rows"]
+    data = {}
+    for col in header["columns"]:
+        if columns is not None and col["name"] not in columns:
+            continue
+        start = base + col["offset"]
+        if col["dtype"] in NUMPY_TYPES:
+            values = np.frombuffer(payload, dtype=NUMPY_TYPES[col["dtype"]], count=rows, offset=start)
+            if col["dtype"] == "datetime64[us]":
+                values = values.view('datetime64[us]')
+        elif col["dtype"] == "null":
+            values = np.full(rows, None, dtype=object)
+        else:
+            values = json.loads(bytes(payload[start:start + col["length"]]).decode('utf-8'))
+        data[col["name"]] = values
+    return pd.DataFrame(data, index=pd.RangeIndex(rows), copy=False)
+
+
+def _column_values(col, payload, base, rows):
+    # standard library decode of one column to a list of python values
+    start = base + col["offset"]
+    buf = bytes(payload[start:start + col["length"]])
+    if col["dtype"] == "null":
+        return [None] * rows
+    if col["dtype"] in ("str", "json"):
+        return json.loads(buf.decode('utf-8'))
+    if col["dtype"] == "bool":
+        return [bool(b) for b in buf]
+    arr = array('d' if col["dtype"] == "float64" else 'q')
+    arr.frombytes(buf)
+    if struct.pack('=H', 1) != struct.pack('<H', 1):
+        arr.byteswap()
+    if col["dtype"] == "datetime64[us]":
+        return [None if v == NAT else (EPOCH + timedelta(microseconds=v)).isoformat() for v in arr]
+    if col["dtype"] == "float64":
+        return [None if math.isnan(v) else v for v in arr]
+    return arr.tolist()
+
+
+def concat_columnar(payloads, meta=None):
+    """
+    Concatenate columnar values with the same columns into one value using only the standard library.
+    Buffers of the same type are joined as-is, int/float mixes are widened to float and
+    other mismatches fall back to JSON lists.
+    """
+    parsed = [(p,) + read_header(p) for p in payloads]
+    # empty values (e.g. a day with no data) may have no columns at all
+    if any(header["rows"] for _, header, _ in parsed):
+        parsed = [part for part in parsed if part[1]["rows"]]
+    if not parsed:
+        return encode_columns([], [], meta=meta)
+    names = [col["name"] for col in parsed[0][1]["columns"]]
+    for _, header, _ in parsed[1:]:
+        if [col["name"] for col in header["columns"]] != names:
+            raise ValueError("Cannot join columnar values with different columns")
+
+    total_rows = sum(header["rows"] for _, header, _ in parsed)
+    encoded = []
+    for index, name in enumerate(names):
+        parts = [(p, header["columns"][index], base, header["rows"]) for p, header, base in parsed]
+        dtypes = {col["dtype"] for _, col, _, rows in parts if rows and col["dtype"] != "null"}
+
+        if len(dtypes) == 1 and next(iter(dtypes)) in NUMPY_TYPES and all(col["dtype"] != "null" or rows == 0 for _, col, _, rows in parts):
+            dtype = next(iter(dtypes))
+            buf = b"".join(bytes(p[base + col["offset"]:base + col["offset"] + col["length"]]) for p, col, base, rows in parts if rows)
+            encoded.append((name, dtype, buf))
+            continue
+
+        values = []
+        for p, col, base, rows in parts:
+            values.extend(_column_values(col, p, base, rows))
+        if dtypes <= {"float64", "int64"} and dtypes:
+            encoded.append((name, "float64", _le(array('d', [math.nan if v is None else float(v) for v in values]))))
+        elif dtypes == {"datetime64[us]"}:
+            encoded.append((name, "datetime64[us]", _le(array('q', [NAT if v is None else _datetime_to_us(datetime.fromisoformat(v)) for v in values]))))
+        else:
+            encoded.append((name,) + _encode_column(values))
+    return _pack(total_rows, encoded, meta if meta is not None else parsed[0][1].get("meta"))
+
+
+FIXED_WIDTHS = {"float64": 8, "int64": 8, "datetime64[us]": 8, "bool": 1}
+
+
+def slice_columnar(payload, time_col, start, end, end_inclusive=False):
+    """
+    Return the rows of a columnar value whose time column is in [start, end), using only the standard library.
+    The rows must already be sorted on the time column.
+
+    Args:
+        payload (bytes): columnar value
+        time_col (str): name of the time column
+        start (datetime): inclusive lower bound
+        end (datetime): exclusive upper bound - inclusive with end_inclusive, as in SQL BETWEEN
+    Raises:
+        ValueError: the value has rows but no time_col column, so it can't be trimmed
+    """
+    from bisect import bisect_left, bisect_right
+
+    header, base = read_header(payload)
+    rows = header["rows"]
+    # the driver may return the name in its own case (lower case for unquoted PostgreSQL columns)
+    col = next((c for c in header["columns"] if c["name"] == time_col), None) or \
+        next((c for c in header["columns"] if c["name"].lower() == time_col.lower()), None)
+    if rows == 0:
+        return payload
+    if col is None:
+        # returning it untrimmed would leak rows outside the range into the result
+        raise ValueError(f"Time column {time_col} not in cached value")
+    if col["dtype"] == "datetime64[us]":
+        times = array('q')
+        times.frombytes(bytes(payload[base + col["offset"]:base + col["offset"] + col["length"]]))
+        if struct.pack('=H', 1) != struct.pack('<H', 1):
+            times.byteswap()
+        lo, hi = _datetime_to_us(start), _datetime_to_us(end)
+    else:
+        # times stored as text - ISO strings sort in time order
+        times = [str(v) for v in _column_values(col, payload, base, rows)]
+        lo, hi = start.isoformat(), end.isoformat()
+    first, last = bisect_left(times, lo), (bisect_right if end_inclusive else bisect_left)(times, hi)
+    if first == 0 and last == rows:
+        return payload
+
+    encoded = []
+    for c in header["columns"]:
+        buf = bytes(payload[base + c["offset"]:base + c["offset"] + c["length"]])
+        if c["dtype"] in FIXED_WIDTHS:
+            width = FIXED_WIDTHS[c["dtype"]]
+            encoded.append((c["name"], c["dtype"], buf[first * width:last * width]))
+        elif c["dtype"] == "null":
+            encoded.append((c["name"], "null", b""))
+        else:
+            values = json.loads(buf.decode('utf-8'))[first:last]
+            encoded.append((c["name"], c["dtype"], json.dumps(values).encode('utf-8')))
+    return _pack(last - first, encoded, header.get("meta"))
@@ -0,0 +1,203 @@
+'''
+Index of the query results the abstraction layer caches in Redis
+
+The index lives in Redis itself so every worker sees the same sizes and hit counts:
+    cache:size      hash   result key -> bytes it holds in redis (value + its own chunks)
+    cache:last      zset   result key -> last access time - LRU order
+    cache:hits      zset   result key -> number of hits - LFU order
+    cache:pointers  hash   result key -> JSON list of the query keys that point at it
+    cache:bytes     string total of cache:size
+
+When the total goes over the budget the least recently (lru) or least frequently (lfu) used results are
+evicted along with their chunks and query pointers. Results that keep being reused have their TTL extended
+so a hot query outlives the fixed one hour TTL.
+
+Day partitions are not indexed - they are shared between results and expire on partition_ttl.
+
+'''
+import json
+import logging
+import time
+
+import cache_codec
+
+SIZE_KEY = "cache:size"
+LAST_KEY = "cache:last"
+HITS_KEY = "cache:hits"
+POINTERS_KEY = "cache:pointers"
+BYTES_KEY = "cache:bytes"
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class cache_index:
+
+    def __init__(self, client, budget_bytes=1073741824, policy="lru", extend_after_hits=3, hot_ttl=21600, evict_batch=16):
+        """
+        Args:
+            client: sync redis client - the methods are called from worker threads
+            budget_bytes: bytes of indexed results to keep in redis - 0 turns eviction off
+            policy: "lru" or "lfu"
+            extend_after_hits: hits after which every hit keeps the result alive for hot_ttl seconds
+            hot_ttl: TTL given to hot results, their chunks and query pointers
+            evict_batch: results taken per eviction round
+        """
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"Unknown eviction policy {policy} - use lru or lfu")
+        self.client = client
+        self.budget_bytes = int(budget_bytes or 0)
+        self.policy = policy
+        self.extend_after_hits = int(extend_after_hits)
+        self.hot_ttl = int(hot_ttl)
+        self.evict_batch = max(1, int(evict_batch))
+
+    def __str__(self):
+        return f'Cache Index: Budget: {self.budget_bytes} bytes, Policy: {self.policy}, Extend After: {self.extend_after_hits} hits, Hot TTL: {self.hot_ttl}s'
+
+    def register(self, key, size, pointers=()):
+        # called once a result is stored - evicts other results if this one takes the total over the budget
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hset(SIZE_KEY, key, size)
+            pipe.zadd(LAST_KEY, {key: time.time()})
+            pipe.zadd(HITS_KEY, {key: 0}, nx=True)
+            pipe.hset(POINTERS_KEY, key, json.dumps(list(pointers)))
+            pipe.incrby(BYTES_KEY, size)
+            total = pipe.execute()[-1]
+            if self.budget_bytes and total > self.budget_bytes:
+                self.evict(keep=key)
+        except Exception as e:
+            logging.error(f"Error indexing cached result {key}: {e}")
+
+    def touch(self, key):
+        # called on a cache hit - records the access and extends the TTL of results that keep being reused
+        key = _text(key)
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.zadd(LAST_KEY, {key: time.time()}, xx=True, ch=True)
+            pipe.zincrby(HITS_KEY, 1, key)
+            pipe.ttl(key)
+            indexed, hits, ttl = pipe.execute()
+            if not indexed:
+                self.client.zrem(HITS_KEY, key)  # not an indexed result (written before the index existed)
+                return
+            # only extend once the remaining TTL has run down, so a burst of hits costs one extension
+            if hits >= self.extend_after_hits and 0 <= ttl < self.hot_ttl // 2:
+                self.extend(key)
+        except Exception as e:
+            logging.error(f"Error recording hit for {key}: {e}")
+
+    def extend(self, key):
+        # the result, its query pointers and every chunk / partition its manifest points at get hot_ttl
+        pointers = json.loads(_text(self.client.hget(POINTERS_KEY, key)) or "[]")
+        value = cache_codec.decompress(self.client.get(key))
+        parts = cache_codec.read_manifest(value)["chunks"] if cache_codec.is_manifest(value) else []
+        # shared partitions may already live longer than hot_ttl - never shorten them
+        pipe = self.client.pipeline(transaction=False)
+        for part in parts:
+            pipe.ttl(part)
+        ttls = pipe.execute() if parts else []
+        pipe = self.client.pipeline(transaction=False)
+        for name in [key] + pointers + [part for part, ttl in zip(parts, ttls) if ttl < self.hot_ttl]:
+            pipe.expire(name, self.hot_ttl)
+        pipe.execute()
+        logging.info(f"Extended TTL of hot result {key} to {self.hot_ttl}s")
+
+    def evict(self, keep=None):
+        # keep is the result that was just stored - it is never the one evicted to make room for itself
+        order = LAST_KEY if self.policy == "lru" else HITS_KEY
+        evicted = 0
+        freed = 0
+        total = int(self.client.get(BYTES_KEY) or 0)
+        while total > self.budget_bytes:
+            victims = [_text(key) for key in self.client.zrange(order, 0, self.evict_batch)]
+            victims = [key for key in victims if key != keep][:self.evict_batch]
+            if not victims:
+                break
+            progress = 0  # results dropped or orphans cleared - each pass must shrink the order or stop
+            for key in victims:
+                size = self.drop(key)
+                if size is None:
+                    # another worker dropped it, or an orphan left in cache:hits by a crashed drop / the
+                    # touch() race - take it out of cache:hits so it is not picked again
+                    progress += self.client.zrem(HITS_KEY, key)
+                    continue
+                progress += 1
+                evicted += 1
+                freed += size
+                total -= size
+                if total <= self.budget_bytes:
+                    break
+            if not progress:
+                # nothing in this batch could be dropped - cache:bytes is ahead of the index, reconcile() corrects it
+                logging.warning(f"Eviction freed nothing with {total} bytes cached against a budget of {self.budget_bytes}")
+                break
+            total = int(self.client.get(BYTES_KEY) or 0)
+        if evicted:
+            logging.info(f"Evicted {evicted} cached results ({freed} bytes) by {self.policy}")
+
+    def drop(self, key):
+        """
+        Delete a result, its own chunks and its query pointers, and take it out of the index.
+        Returns the size freed, or None if another worker already dropped it.
+        """
+        # removing the key from cache:last decides which worker owns the drop, so workers
+        # evicting at the same time never free the same result twice
+        if not self.client.zrem(LAST_KEY, key):
+            return None
+        value = cache_codec.decompress(self.client.get(key))
+        chunk_prefix = cache_codec.chunk_key(key, "")
+        chunks = [c for c in cache_codec.read_manifest(value)["chunks"] if c.startswith(chunk_prefix)] if cache_codec.is_manifest(value) else []
+
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hget(SIZE_KEY, key)
+        pipe.hget(POINTERS_KEY, key)
+        size, pointers = pipe.execute()
+        size = int(size or 0)
+        pointers = json.loads(_text(pointers) or "[]")
+        # a pointer that has since been set to a newer result is left alone
+        current = self.client.mget(pointers) if pointers else []
+        pointers = [p for p, value in zip(pointers, current) if _text(value) == key]
+
+        pipe = self.client.pipeline(transaction=False)
+        pipe.delete(key, *chunks, *pointers)
+        pipe.zrem(HITS_KEY, key)
+        pipe.hdel(SIZE_KEY, key)
+        pipe.hdel(POINTERS_KEY, key)
+        pipe.decrby(BYTES_KEY, size)
+        pipe.execute()
+        return size
+
+    def reconcile(self, batch=500):
+        # drop index entries for results that expired on their TTL so cache:bytes stays accurate
+        removed = 0
+        cursor = 0
+        while True:
+            cursor, entries = self.client.zscan(LAST_KEY, cursor, count=batch)
+            keys = [_text(key) for key, _ in entries]
+            if keys:
+                pipe = self.client.pipeline(transaction=False)
+                for key in keys:
+                    pipe.exists(key)
+                for key, found in zip(keys, pipe.execute()):
+                    if not found and self.client.zrem(LAST_KEY, key):
+                        pipe = self.client.pipeline(transaction=False)
+                        pipe.hget(SIZE_KEY, key)
+                        pipe.zrem(HITS_KEY, key)
+                        pipe.hdel(SIZE_KEY, key)
+                        pipe.hdel(POINTERS_KEY, key)
+                        size = pipe.execute()[0]
+                        self.client.decrby(BYTES_KEY, int(size or 0))
+                        removed += 1
+            if cursor == 0:
+                break
+        return removed
+
+    def stats(self):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(BYTES_KEY)
+        pipe.zcard(LAST_KEY)
+        total, count = pipe.execute()
+        return {"bytes": int(total or 0), "results": count, "budget_bytes": self.budget_bytes, "policy": self.policy}
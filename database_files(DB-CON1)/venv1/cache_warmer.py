@@ -0,0 +1,115 @@
+'''
+Request history mining for cache warming
+
+Reads the /data history from redis_data.redis_cache_log (cache misses) and redis_data.reused_queries
+(cache hits) and finds requests that repeat on a daily schedule, e.g. "line 3, yesterday to today, around 07:00".
+The abstraction layer runs those ranges shortly before they are usually asked for - see warm_cache()
+in main_abstraction.py.
+
+A pattern is a (database, table, hour of day, range end relative to the request day, range length)
+that was requested on at least min_days different days in the lookback window.
+Only plain time range reads are warmed - filtered, projected and aggregated requests are skipped.
+
+'''
+import logging
+import re
+from collections import defaultdict
+from datetime import datetime, date, timedelta
+
+from connections import IDENTIFIER
+
+WARMER_USER = "cache-warmer"  # client_ip recorded for warming requests - left out of the history
+DATE_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2})")
+
+
+def load_history(con, lookback_days=14, time_column="created_at"):
+    """
+    Requests from the last lookback_days - one row per miss and per reuse.
+
+    Args:
+        con: connectcls_postgres on the platform database
+        time_column: timestamp column of the two audit tables
+    Returns:
+        list: (query_database, query_table, query_text, requested_at) tuples
+    """
+    if not IDENTIFIER.match(time_column):
+        raise ValueError(f"Invalid time column {time_column}")
+    since = datetime.now() - timedelta(days=lookback_days)
+    # a reuse is matched to the miss that stored the key - keys are random and can come round again,
+    # so only a miss in the day before the reuse counts
+    query = f"""
+        SELECT l.query_database, l.query_table, l.query_text, l.{time_column}
+            FROM redis_data.redis_cache_log l
+            WHERE l.{time_column} >= ? AND l.client_ip <> ?
+        UNION ALL
+        SELECT l.query_database, l.query_table, l.query_text, r.{time_column}
+            FROM redis_data.reused_queries r
+            JOIN redis_data.redis_cache_log l ON l.redis_key = r.redis_key
+                AND l.{time_column} <= r.{time_column} AND l.{time_column} > r.{time_column} - INTERVAL '1 day'
+            WHERE r.{time_column} >= ?
+    """
+    cursor = con.statement_cursor(query)
+    cursor.execute(query, [since, WARMER_USER, since])
+    return [tuple(row) for row in cursor.fetchall()]
+
+
+def parse_range(query_text):
+    """
+    Date range of a plain time range read from the query_text logged for it.
+    Handles the rendered SELECT * ... BETWEEN queries and the "partition read" texts of partitioned reads
+    (older rows have the bare partition queries or "partition cache hit").
+
+    Returns:
+        (date, date): start and end, or None for filtered / projected / aggregated queries
+    """
+    if not query_text:
+        return None
+    text = query_text.strip()
+    if text.startswith("partition read:"):
+        # requested range first, then the partition queries that were run
+        dates = [date.fromisoformat(d) for d in DATE_PATTERN.findall(text)[:2]]
+        return (dates[0], dates[1]) if len(dates) == 2 and dates[0] < dates[1] else None
+    plain = text.startswith("partition cache hit:") or (
+        text.upper().startswith("SELECT * FROM")
+        and not any(word in text.upper() for word in ("GROUP BY", " OFFSET ", " LIMIT "))  # aggregates and pages
+        and ("WHERE 1=1 AND" in text or ">= '" in text)
+    )
+    if not plain:
+        return None
+    dates = sorted(date.fromisoformat(d) for d in DATE_PATTERN.findall(text))
+    if len(dates) < 2 or dates[0] == dates[-1]:
+        return None
+    return dates[0], dates[-1]
+
+
+def find_patterns(history, min_days=3):
+    """
+    Group the history into daily patterns.
+
+    Returns:
+        list: dicts with database, table, hour, end_offset (days from the request day to the range end),
+              span (days in the range) and days (how many different days it was requested on), most used first
+    """
+    seen = defaultdict(set)
+    for database, table, query_text, requested_at in history:
+        found = parse_range(query_text)
+        if found is None or not database or not table or requested_at is None:
+            continue
+        start, end = found
+        key = (database, table, requested_at.hour, (end - requested_at.date()).days, (end - start).days)
+        seen[key].add(requested_at.date())
+
+    patterns = [
+        {"database": database, "table": table, "hour": hour, "end_offset": end_offset, "span": span, "days": len(days)}
+        for (database, table, hour, end_offset, span), days in seen.items() if len(days) >= min_days
+    ]
+    patterns.sort(key=lambda p: -p["days"])
+    logging.info(f"Found {len(patterns)} daily request patterns in {len(history)} history rows")
+    return patterns
+
+
+def window_for(pattern, day):
+    # the range the pattern asks for when requested on day - as the start / end strings /data takes
+    end = day + timedelta(days=pattern["end_offset"])
+    start = end - timedelta(days=pattern["span"])
+    return start.isoformat(), end.isoformat()
@@ -8,12 +8,68 @@ Class is also set to define differnt sytnax for various databases.
 
 '''
 import pyodbc
+import asyncio
+import re
+import threading
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# async drivers are optional - the pyodbc classes are used when they are not installed
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+try:
+    import aioodbc
+except ImportError:
+    aioodbc = None
+
+
+# column and table names that can be placed in generated SQL - tables may be schema qualified
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+TABLE_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)?$')
+
+# number of prepared statements kept per connection
+STATEMENT_CACHE_SIZE = 32
+
+# aggregates and time buckets accepted for pushdown queries
+AGGREGATES = ("avg", "min", "max", "sum", "count")
+BUCKETS = ("minute", "hour", "day", "week", "month")
 
 
 class connectcls_sql_server:
-   
 
-    def __init__(self, driver_name , server_name, db_name,connection_username, connection_password, connection_id=None, user_id=None, connection_name=None,  connection_url=None, connection_type=None):
+    # SQL Server syntax for generated queries
+
+    # column types that cannot be compared / sorted - left out of the page tiebreaker
+    unordered_types = {"text", "ntext", "image", "xml", "geography", "geometry"}
+
+    @staticmethod
+    def quote_ident(name):
+        return f"[{name}]"
+
+    @staticmethod
+    def time_bucket(time_col, bucket):
+        # whole number of units since day 0 added back on to day 0 truncates to the start of the bucket
+        return f"DATEADD({bucket}, DATEDIFF({bucket}, 0, {time_col}), 0)"
+
+    @staticmethod
+    def aggregate(func, column):
+        # AVG of an integer column is an integer in SQL Server
+        if func == "avg":
+            return f"AVG(CAST({column} AS FLOAT))"
+        return f"{func.upper()}({column})"
+
+    @staticmethod
+    def page(offset, limit):
+        # OFFSET / FETCH - the query must have an ORDER BY
+        return "OFFSET ? ROWS FETCH NEXT ? ROWS ONLY", [offset, limit]
+
+
+    def __init__(self, driver_name , server_name, db_name,connection_username, connection_password, connection_id=None, user_id=None, connection_name=None,  connection_url=None, connection_type=None, login_timeout=None):
         self.driver_name = driver_name
         self.server_name = server_name
         self.db_name = db_name
@@ -24,11 +80,14 @@ class connectcls_sql_server:
         self.connection_name = connection_name
         self.connection_url = connection_url
         self.connection_type = connection_type
+        self.login_timeout = login_timeout  # seconds - None leaves the driver default
 
         
         # Placeholder testing for initalising and establishing a connection as the class is initalised - to allow reuse of connections
          
         self.conn, self.cursor, self.con_err = self.make_connection()
+        # prepared statement cache - one cursor per parameterised query, see statement_cursor()
+        self.statements = OrderedDict()
 
     def __str__(self):
         return f'Connection ID: {self.connection_id}, User ID: {self.user_id}, Connection Name: {self.connection_name}, Connection Type: {self.connection_type}, Connection URL: {self.connection_url}, Connection Username: {self.connection_username}, Connection Password: {self.connection_password}'
@@ -46,7 +105,7 @@ class connectcls_sql_server:
     def make_connection(self):
         
         try:
-            conn = pyodbc.connect(self.connect_str())
+            conn = pyodbc.connect(self.connect_str(), timeout=self.login_timeout or 0)
             
             cursor = conn.cursor()
             return conn, cursor, None
@@ -63,12 +122,35 @@ class connectcls_sql_server:
 
         
     
-    def query(self, query):
+    def statement_cursor(self, query):
+        """
+        Return the cursor used for a parameterised query.
+        pyodbc prepares a statement the first time a cursor runs it and reuses the plan while the cursor keeps
+        running the same SQL, so each query template gets its own cursor. The least recently used are closed.
+        """
+        cursor = self.statements.get(query)
+        if cursor is not None:
+            self.statements.move_to_end(query)
+            return cursor
+        cursor = self.conn.cursor()
+        self.statements[query] = cursor
+        if len(self.statements) > STATEMENT_CACHE_SIZE:
+            _, old_cursor = self.statements.popitem(last=False)
+            old_cursor.close()
+        return cursor
+
+    def query(self, query, params=None):
+        # params are bound to ? placeholders in the query
         try: 
             
-            self.cursor.execute(query)
-            rows = self.cursor.fetchall()
-            return [dict(zip([column[0] for column in self.cursor.description], row)) for row in rows]
+            if params is None:
+                cursor = self.cursor
+                cursor.execute(query)
+            else:
+                cursor = self.statement_cursor(query)
+                cursor.execute(query, params)
+            rows = cursor.fetchall()
+            return [dict(zip([column[0] for column in cursor.description], row)) for row in rows]
         except pyodbc.ProgrammingError as e:
             print(f"Query failed: {e}")
             return [{"error": "Query failure - Check SQL syntax"}]
@@ -78,25 +160,86 @@ class connectcls_sql_server:
         except pyodbc.Error as e:
             print(f"Query failed: {e}")
             return [{"error": f"General error - {str(e)}"}]
-    
+
+    def query_chunks(self, query, chunk_size=10000, params=None):
+        """
+        Run a query and yield the result in lists of at most chunk_size row dicts using fetchmany,
+        so the full result is never held in memory. On failure a single error list is yielded.
+        """
+        try:
+            if params is None:
+                cursor = self.cursor
+                cursor.execute(query)
+            else:
+                cursor = self.statement_cursor(query)
+                cursor.execute(query, params)
+            columns = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [dict(zip(columns, row)) for row in rows]
+        except pyodbc.ProgrammingError as e:
+            print(f"Query failed: {e}")
+            yield [{"error": "Query failure - Check SQL syntax"}]
+        except pyodbc.DatabaseError as e:
+            print(f"Database failure: {e}")
+            yield [{"error": "Database failure - Check database connection and query"}]
+        except pyodbc.Error as e:
+            print(f"Query failed: {e}")
+            yield [{"error": f"General error - {str(e)}"}]
+
+    def available(self):
+        # a query can be tried on this connection
+        return self.conn is not None
+
     def close_connection(self):
-        self.conn.close()
+        for cursor in self.statements.values():
+            cursor.close()
+        self.statements.clear()
+        if self.conn is not None:
+            self.conn.close()
         print("Connection closed")
 
 # class for the connections to postgresql
 
 class connectcls_postgres:
 
-    def __init__(self, driver_name, server_name, db_name, connection_username, connection_password, port=5432):
+    # PostgreSQL syntax for generated queries
+
+    unordered_types = {"json", "xml", "point", "line", "lseg", "box", "path", "polygon", "circle"}
+
+    @staticmethod
+    def quote_ident(name):
+        # names are checked against IDENTIFIER before use - left unquoted so PostgreSQL folds case
+        # the same way it does for the existing queries
+        return name
+
+    @staticmethod
+    def time_bucket(time_col, bucket):
+        return f"date_trunc('{bucket}', {time_col})"
+
+    @staticmethod
+    def aggregate(func, column):
+        return f"{func.upper()}({column})"
+
+    @staticmethod
+    def page(offset, limit):
+        return "LIMIT ? OFFSET ?", [limit, offset]
+
+    def __init__(self, driver_name, server_name, db_name, connection_username, connection_password, port=5432, login_timeout=None):
         self.driver_name = driver_name
         self.server_name = server_name
         self.db_name = db_name
         self.connection_username = connection_username
         self.connection_password = connection_password
         self.port = port
+        self.login_timeout = login_timeout  # seconds - None leaves the driver default
 
 
         self.conn, self.cursor, self.con_err = self.make_connection()
+        # prepared statement cache - one cursor per parameterised query, see statement_cursor()
+        self.statements = OrderedDict()
 
     def __str__(self):
         return f'Driver Name: {self.driver_name}, Server Name: {self.server_name}, Database Name: {self.db_name}, Port: {self.port}, Connection Username: {self.connection_username}, Connection Password: {self.connection_password}'
@@ -108,7 +251,7 @@ class connectcls_postgres:
     def make_connection(self):
         
         try:
-            conn = pyodbc.connect(self.connect_str())
+            conn = pyodbc.connect(self.connect_str(), timeout=self.login_timeout or 0)
             print("Connection to PostgreSQL is successful")
             cursor = conn.cursor()
             return conn, cursor, None
@@ -124,12 +267,35 @@ class connectcls_postgres:
             return None, None, [{"error": f"General error - {str(e)}"}]
 
 
-    def query(self, query):
+    def statement_cursor(self, query):
+        """
+        Return the cursor used for a parameterised query.
+        pyodbc prepares a statement the first time a cursor runs it and reuses the plan while the cursor keeps
+        running the same SQL, so each query template gets its own cursor. The least recently used are closed.
+        """
+        cursor = self.statements.get(query)
+        if cursor is not None:
+            self.statements.move_to_end(query)
+            return cursor
+        cursor = self.conn.cursor()
+        self.statements[query] = cursor
+        if len(self.statements) > STATEMENT_CACHE_SIZE:
+            _, old_cursor = self.statements.popitem(last=False)
+            old_cursor.close()
+        return cursor
+
+    def query(self, query, params=None):
+        # params are bound to ? placeholders in the query
         try: 
             
-            self.cursor.execute(query)
-            rows = self.cursor.fetchall()
-            return [dict(zip([column[0] for column in self.cursor.description], row)) for row in rows]
+            if params is None:
+                cursor = self.cursor
+                cursor.execute(query)
+            else:
+                cursor = self.statement_cursor(query)
+                cursor.execute(query, params)
+            rows = cursor.fetchall()
+            return [dict(zip([column[0] for column in cursor.description], row)) for row in rows]
         except pyodbc.ProgrammingError as e:
             print(f"Query failed: {e}")
             return [{"error": "Query failure - Check SQL syntax"}]
@@ -140,8 +306,581 @@ class connectcls_postgres:
             print(f"Query failed: {e}")
             return [{"error": f"General error - {str(e)}"}]
 
+    def query_chunks(self, query, chunk_size=10000, params=None):
+        """
+        Run a query and yield the result in lists of at most chunk_size row dicts using fetchmany,
+        so the full result is never held in memory. On failure a single error list is yielded.
+        """
+        try:
+            if params is None:
+                cursor = self.cursor
+                cursor.execute(query)
+            else:
+                cursor = self.statement_cursor(query)
+                cursor.execute(query, params)
+            columns = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [dict(zip(columns, row)) for row in rows]
+        except pyodbc.ProgrammingError as e:
+            print(f"Query failed: {e}")
+            yield [{"error": "Query failure - Check SQL syntax"}]
+        except pyodbc.DatabaseError as e:
+            print(f"Database failure: {e}")
+            yield [{"error": "Database failure - Check database connection and query"}]
+        except pyodbc.Error as e:
+            print(f"Query failed: {e}")
+            yield [{"error": f"General error - {str(e)}"}]
+
+    def available(self):
+        # a query can be tried on this connection
+        return self.conn is not None
+
+    def close_connection(self):
+        for cursor in self.statements.values():
+            cursor.close()
+        self.statements.clear()
+        if self.conn is not None:
+            self.conn.close()
+        print("Connection closed")
+
+
+
+# returned by connectcls_pool._open when another thread took the last slot - not a connect failure
+POOL_FULL = object()
+
+
+# class for a bounded pool of connections to a single endpoint
+# one connectcls_* object holds one pyodbc connection and one cursor, so sharing a single object between
+# concurrent /data requests serialises every query on that cursor - the pool hands each request its own object
+
+class connectcls_pool:
+
+    def __init__(self, factory, endpoint_name=None, min_size=1, max_size=5, checkout_timeout=30, idle_timeout=300, health_check_after=30, lazy=False):
+        """
+        Pool of connectcls_sql_server / connectcls_postgres objects for one endpoint.
+
+        Args:
+            factory: callable that returns a new connectcls_* object
+            min_size: connections opened up front and never reaped
+            max_size: upper bound on open connections
+            checkout_timeout: seconds to wait for a free connection before giving up
+            idle_timeout: seconds an idle connection above min_size is kept before being closed
+            health_check_after: idle seconds after which a connection is probed before being handed out
+            lazy: do not open min_size connections here - call fill() later, e.g. from a worker thread at startup
+        """
+        self.factory = factory
+        self.endpoint_name = endpoint_name
+        self.dialect = getattr(factory, 'func', factory)  # connection class - used for its SQL syntax helpers
+        self.min_size = max(0, int(min_size))
+        self.max_size = max(1, int(max_size), self.min_size)
+        self.checkout_timeout = checkout_timeout
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+
+        self._idle = deque()  # (connection object, time returned to the pool)
+        self._size = 0  # open connections - idle and checked out
+        self._cond = threading.Condition()
+        self._closed = False
+        self.con_err = None
+        # blocking queries for this endpoint run on their own threads so a slow endpoint cannot use up
+        # the default asyncio thread pool that every other endpoint shares
+        self.executor = ThreadPoolExecutor(max_workers=self.max_size, thread_name_prefix=f"pool-{endpoint_name}")
+
+        if not lazy:
+            self.fill()
+
+    def fill(self):
+        """
+        Open connections until min_size are open. Returns True if the pool has at least one connection.
+        """
+        if self.min_size == 0:
+            return self.probe() is not False
+        while self._size < self.min_size:
+            con = self._open()
+            if con is None or con is POOL_FULL:
+                break
+            with self._cond:
+                self._idle.append((con, time.monotonic()))
+                self._cond.notify()
+        return self._size > 0
+
+    def __str__(self):
+        return f'Connection Pool: {self.endpoint_name}, Size: {self._size}/{self.max_size}, Idle: {len(self._idle)}, Min Size: {self.min_size}'
+
+    @property
+    def is_open(self):
+        # at least one connection is open, idle or checked out
+        return self._size > 0
+
+    def available(self):
+        # a query can be tried - the pool opens connections on demand, so only a closed pool refuses
+        return not self._closed
+
+    def _open(self):
+        # open a new connection and count it against the pool size
+        # returns None if the connect failed, POOL_FULL if another thread took the last slot first
+        with self._cond:
+            if self._size >= self.max_size:
+                return POOL_FULL
+            self._size += 1
+        con = None
+        try:
+            con = self.factory()
+        except Exception as e:
+            self.con_err = [{"error": f"General error - {str(e)}"}]
+        if con is None or con.conn is None:
+            if con is not None:
+                self.con_err = con.con_err
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return None
+        self.con_err = None
+        return con
+
+    def _discard(self, con):
+        try:
+            con.close_connection()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _is_healthy(self, con):
+        try:
+            cursor = con.conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except pyodbc.Error:
+            return False
+
+    def reap_idle(self):
+        """
+        Close idle connections above min_size that have not been used for idle_timeout seconds.
+        """
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            keep = deque()
+            for con, returned in self._idle:
+                if now - returned > self.idle_timeout and self._size - len(expired) > self.min_size:
+                    expired.append(con)
+                else:
+                    keep.append((con, returned))
+            self._idle = keep
+        for con in expired:
+            self._discard(con)
+        return len(expired)
+
+    def checkout(self, timeout=None):
+        """
+        Take a connection from the pool, opening a new one if below max_size.
+        Waits up to timeout (default checkout_timeout) seconds and raises TimeoutError if none is free.
+        Raises ConnectionError if the endpoint refuses new connections.
+        """
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        self.reap_idle()
+
+        while True:
+            con = None
+            returned = None
+            open_new = False
+            with self._cond:
+                if self._closed:
+                    raise ConnectionError(f"Connection pool for {self.endpoint_name} is closed")
+                if self._idle:
+                    con, returned = self._idle.pop()  # most recently used first
+                elif self._size < self.max_size:
+                    open_new = True
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"Timed out waiting for a connection to {self.endpoint_name}")
+                    self._cond.wait(remaining)
+                    continue
+
+            if open_new:
+                con = self._open()
+                if con is POOL_FULL:
+                    continue  # lost the last slot to another thread - wait for a connection like everyone else
+                if con is None:
+                    raise ConnectionError(f"Could not open connection to {self.endpoint_name}: {self.con_err}")
+                return con
+
+            # health check connections that have been sitting idle before handing them out
+            if time.monotonic() - returned >= self.health_check_after and not self._is_healthy(con):
+                self._discard(con)
+                continue
+            return con
+
+    def checkin(self, con, broken=False):
+        """
+        Return a connection to the pool - broken connections are closed and their slot freed.
+        """
+        if broken or self._closed or con.conn is None:
+            self._discard(con)
+            return
+        with self._cond:
+            self._idle.append((con, time.monotonic()))
+            self._cond.notify()
+
+    def probe(self, timeout=5):
+        """
+        Check the endpoint with SELECT 1 on a pooled connection - used by the connection supervisor.
+        Opens a new connection if none are open, so calling this again after an outage is the reconnect.
+        Returns True if the endpoint answered, False if not and None if every connection is busy.
+        """
+        try:
+            con = self.checkout(timeout)
+        except TimeoutError:
+            return None
+        except ConnectionError:
+            return False
+        healthy = self._is_healthy(con)
+        self.checkin(con, broken=not healthy)
+        if not healthy:
+            # the endpoint dropped so the other idle connections are dead as well
+            with self._cond:
+                idle = [con for con, _ in self._idle]
+                self._idle.clear()
+            for con in idle:
+                self._discard(con)
+        return healthy
+
+    @contextmanager
+    def connection(self, timeout=None):
+        con = self.checkout(timeout)
+        broken = False
+        try:
+            yield con
+        except pyodbc.Error:
+            broken = not self._is_healthy(con)
+            raise
+        finally:
+            self.checkin(con, broken=broken)
+
+    def query(self, query, params=None):
+        try:
+            con = self.checkout()
+        except TimeoutError as e:
+            print(f"Pool checkout failed: {e}")
+            return [{"error": "Connection pool exhausted - Try again shortly"}]
+        except ConnectionError as e:
+            print(f"Pool checkout failed: {e}")
+            return self.con_err or [{"error": "Operational error - Check database connection and server status"}]
+
+        broken = False
+        try:
+            result = con.query(query, params)
+            # query() swallows driver errors - probe the connection so a dead one is not handed out again
+            if isinstance(result, list) and result and isinstance(result[0], dict) and "error" in result[0]:
+                broken = not self._is_healthy(con)
+            return result
+        finally:
+            self.checkin(con, broken=broken)
+
+    def query_chunks(self, query, chunk_size=10000, params=None):
+        # the connection stays checked out until the caller has consumed (or closed) the generator
+        try:
+            con = self.checkout()
+        except TimeoutError as e:
+            print(f"Pool checkout failed: {e}")
+            yield [{"error": "Connection pool exhausted - Try again shortly"}]
+            return
+        except ConnectionError as e:
+            # the endpoint is down - report the connect error as query() does, not a busy pool
+            print(f"Pool checkout failed: {e}")
+            yield self.con_err or [{"error": "Operational error - Check database connection and server status"}]
+            return
+
+        broken = False
+        try:
+            for chunk in con.query_chunks(query, chunk_size, params):
+                if chunk and isinstance(chunk[0], dict) and "error" in chunk[0]:
+                    broken = not self._is_healthy(con)
+                yield chunk
+        finally:
+            self.checkin(con, broken=broken)
 
-    
     def close_connection(self):
-        self.conn.close()
+        with self._cond:
+            self._closed = True
+            idle = [con for con, _ in self._idle]
+            self._idle.clear()
+        for con in idle:
+            self._discard(con)
+        self.executor.shutdown(wait=False)
+        print("Connection pool closed")
+
+
+# async versions of the connection classes - asyncpg for PostgreSQL and aioodbc for SQL Server
+# each object holds the driver's own connection pool and is used from the event loop directly, so an in-flight
+# query does not pin a thread. They subclass the pyodbc classes for the SQL syntax helpers only.
+# query() and query_chunks() are coroutines / async generators - callers check is_async
+
+def to_numbered_params(query):
+    # asyncpg uses $1, $2 ... instead of ? - placeholders inside quoted strings are left alone
+    parts = re.split(r"('(?:[^']|'')*')", query)
+    count = 0
+    for i in range(0, len(parts), 2):
+        pieces = parts[i].split("?")
+        text = pieces[0]
+        for piece in pieces[1:]:
+            count += 1
+            text += f"${count}" + piece
+        parts[i] = text
+    return "".join(parts)
+
+
+class connectcls_postgres_async(connectcls_postgres):
+
+    is_async = True
+
+    def __init__(self, driver_name, server_name, db_name, connection_username, connection_password, port=5432,
+                 endpoint_name=None, min_size=1, max_size=5, checkout_timeout=30, max_concurrency=None, **kwargs):
+        """
+        Args:
+            max_size: connections in the asyncpg pool
+            max_concurrency: queries allowed in flight for this endpoint - defaults to max_size
+            checkout_timeout: seconds a query waits for a free slot before giving up
+        Call open() from the event loop before use.
+        """
+        self.driver_name = driver_name
+        self.server_name = server_name
+        self.db_name = db_name
+        self.connection_username = connection_username
+        self.connection_password = connection_password
+        self.port = port
+        self.endpoint_name = endpoint_name
+        self.dialect = connectcls_postgres
+        self.min_size = max(0, int(min_size))
+        self.max_size = max(1, int(max_size), self.min_size)
+        self.checkout_timeout = checkout_timeout
+        self.limit = asyncio.Semaphore(int(max_concurrency or self.max_size))
+        self.pool = None
+        self.conn = None
+        self.con_err = None
+
+    def __str__(self):
+        return f'Async Postgres Pool: {self.endpoint_name}, Server Name: {self.server_name}, Database Name: {self.db_name}, Max Size: {self.max_size}'
+
+    async def open(self):
+        if asyncpg is None:
+            self.con_err = [{"error": "asyncpg is not installed"}]
+            return None
+        try:
+            self.pool = await asyncpg.create_pool(
+                host=self.server_name, port=int(self.port), database=self.db_name,
+                user=self.connection_username, password=self.connection_password,
+                min_size=self.min_size, max_size=self.max_size
+            )
+            self.conn = self.pool
+            self.con_err = None
+        except (OSError, asyncpg.PostgresError) as e:
+            print(f"Connection failed: {e}")
+            self.con_err = [{"error": "Operational error - Check database connection and server status"}]
+        return self.pool
+
+    async def query(self, query, params=None):
+        if self.pool is None:
+            # open() failed or has not run - the supervisor reopens it
+            return self.con_err or [{"error": f"{self.endpoint_name} is not connected"}]
+        try:
+            await asyncio.wait_for(self.limit.acquire(), self.checkout_timeout)
+        except asyncio.TimeoutError:
+            return [{"error": "Connection pool exhausted - Try again shortly"}]
+        try:
+            # asyncpg prepares and caches each statement per connection itself
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(to_numbered_params(query), *(params or ()))
+            return [dict(row) for row in rows]
+        except asyncpg.PostgresSyntaxError as e:
+            print(f"Query failed: {e}")
+            return [{"error": "Query failure - Check SQL syntax"}]
+        except asyncpg.PostgresError as e:
+            print(f"Database failure: {e}")
+            return [{"error": "Database failure - Check database connection and query"}]
+        except (OSError, asyncpg.InterfaceError) as e:
+            print(f"Query failed: {e}")
+            return [{"error": f"General error - {str(e)}"}]
+        finally:
+            self.limit.release()
+
+    async def query_chunks(self, query, chunk_size=10000, params=None):
+        if self.pool is None:
+            yield self.con_err or [{"error": f"{self.endpoint_name} is not connected"}]
+            return
+        try:
+            await asyncio.wait_for(self.limit.acquire(), self.checkout_timeout)
+        except asyncio.TimeoutError:
+            yield [{"error": "Connection pool exhausted - Try again shortly"}]
+            return
+        try:
+            async with self.pool.acquire() as conn:
+                # asyncpg cursors only exist inside a transaction
+                async with conn.transaction():
+                    cursor = await conn.cursor(to_numbered_params(query), *(params or ()))
+                    while True:
+                        rows = await cursor.fetch(chunk_size)
+                        if not rows:
+                            break
+                        yield [dict(row) for row in rows]
+        except asyncpg.PostgresSyntaxError as e:
+            print(f"Query failed: {e}")
+            yield [{"error": "Query failure - Check SQL syntax"}]
+        except asyncpg.PostgresError as e:
+            print(f"Database failure: {e}")
+            yield [{"error": "Database failure - Check database connection and query"}]
+        except (OSError, asyncpg.InterfaceError) as e:
+            print(f"Query failed: {e}")
+            yield [{"error": f"General error - {str(e)}"}]
+        finally:
+            self.limit.release()
+
+    def available(self):
+        # open() has succeeded - the supervisor reopens the pool otherwise
+        return self.pool is not None
+
+    async def probe(self):
+        # supervisor check - opens the pool if it never opened, otherwise runs SELECT 1
+        if self.pool is None:
+            return await self.open() is not None
+        result = await self.query("SELECT 1")
+        return not (result and "error" in result[0])
+
+    async def close_connection(self):
+        if self.pool is not None:
+            await self.pool.close()
+        self.conn = None
         print("Connection closed")
+
+
+class connectcls_sql_server_async(connectcls_sql_server):
+
+    is_async = True
+
+    def __init__(self, driver_name, server_name, db_name, connection_username, connection_password,
+                 endpoint_name=None, min_size=1, max_size=5, checkout_timeout=30, max_concurrency=None, **kwargs):
+        """
+        Same arguments as connectcls_postgres_async. Call open() from the event loop before use.
+        """
+        self.driver_name = driver_name
+        self.server_name = server_name
+        self.db_name = db_name
+        self.connection_username = connection_username
+        self.connection_password = connection_password
+        self.endpoint_name = endpoint_name
+        self.dialect = connectcls_sql_server
+        self.min_size = max(0, int(min_size))
+        self.max_size = max(1, int(max_size), self.min_size)
+        self.checkout_timeout = checkout_timeout
+        self.limit = asyncio.Semaphore(int(max_concurrency or self.max_size))
+        self.pool = None
+        self.conn = None
+        self.con_err = None
+
+    def __str__(self):
+        return f'Async SQL Server Pool: {self.endpoint_name}, Server Name: {self.server_name}, Database Name: {self.db_name}, Max Size: {self.max_size}'
+
+    async def open(self):
+        if aioodbc is None:
+            self.con_err = [{"error": "aioodbc is not installed"}]
+            return None
+        try:
+            self.pool = await aioodbc.create_pool(dsn=self.connect_str(), minsize=self.min_size, maxsize=self.max_size)
+            self.conn = self.pool
+            self.con_err = None
+        except pyodbc.Error as e:
+            print(f"Connection failed: {e}")
+            self.con_err = [{"error": "Operational error - Check database connection and server status"}]
+        return self.pool
+
+    async def query(self, query, params=None):
+        chunks = []
+        async for chunk in self.query_chunks(query, None, params):
+            if chunk and "error" in chunk[0]:
+                return chunk
+            chunks.extend(chunk)
+        return chunks
+
+    async def query_chunks(self, query, chunk_size=10000, params=None):
+        # chunk_size None fetches everything in one go
+        if self.pool is None:
+            # open() failed or has not run - the supervisor reopens it
+            yield self.con_err or [{"error": f"{self.endpoint_name} is not connected"}]
+            return
+        try:
+            await asyncio.wait_for(self.limit.acquire(), self.checkout_timeout)
+        except asyncio.TimeoutError:
+            yield [{"error": "Connection pool exhausted - Try again shortly"}]
+            return
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    if params is None:
+                        await cursor.execute(query)
+                    else:
+                        await cursor.execute(query, params)
+                    columns = [column[0] for column in cursor.description]
+                    while True:
+                        rows = await (cursor.fetchall() if chunk_size is None else cursor.fetchmany(chunk_size))
+                        if not rows:
+                            break
+                        yield [dict(zip(columns, row)) for row in rows]
+                        if chunk_size is None:
+                            break
+        except pyodbc.ProgrammingError as e:
+            print(f"Query failed: {e}")
+            yield [{"error": "Query failure - Check SQL syntax"}]
+        except pyodbc.DatabaseError as e:
+            print(f"Database failure: {e}")
+            yield [{"error": "Database failure - Check database connection and query"}]
+        except pyodbc.Error as e:
+            print(f"Query failed: {e}")
+            yield [{"error": f"General error - {str(e)}"}]
+        finally:
+            self.limit.release()
+
+    def available(self):
+        # open() has succeeded - the supervisor reopens the pool otherwise
+        return self.pool is not None
+
+    async def probe(self):
+        # supervisor check - opens the pool if it never opened, otherwise runs SELECT 1
+        if self.pool is None:
+            return await self.open() is not None
+        result = await self.query("SELECT 1")
+        return not (result and "error" in result[0])
+
+    async def close_connection(self):
+        if self.pool is not None:
+            self.pool.close()
+            await self.pool.wait_closed()
+        self.conn = None
+        print("Connection closed")
+
+
+def blocking_chunks(con_obj, query, chunk_size, params, loop):
+    """
+    Iterate query_chunks from a worker thread for either kind of connection.
+    Async connections are driven on the event loop (loop) one chunk at a time.
+    """
+    if not getattr(con_obj, 'is_async', False):
+        yield from con_obj.query_chunks(query, chunk_size, params)
+        return
+    chunks = con_obj.query_chunks(query, chunk_size, params)
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(chunks.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        asyncio.run_coroutine_threadsafe(chunks.aclose(), loop).result()
@@ -5,18 +5,30 @@ This file is responsible for the abstraction layer of the system where general c
 and passed to respective database connections
 
 '''
-from connections import connectcls_sql_server, connectcls_postgres
-from fastapi import FastAPI, Request
+from connections import connectcls_sql_server, connectcls_postgres, connectcls_pool, IDENTIFIER, TABLE_IDENTIFIER, AGGREGATES, BUCKETS
+from connections import connectcls_sql_server_async, connectcls_postgres_async, blocking_chunks
+import connections
+from fastapi import FastAPI, Request, Response
 import subprocess
+import os
 import logging
 from contextlib import asynccontextmanager
 import time
 import asyncio
 import redis as rd
+import redis.asyncio as ard
 import random
 import json
-from datetime import datetime
+import re
+import base64
+import cache_codec
+import audit_log
+import cache_manager
+import cache_warmer
+import metrics
+from datetime import datetime, date, timedelta
 import time as time
+from functools import partial
 
 logging.basicConfig(filename="fastapi_lifespan.log", level=logging.INFO, format="%(asctime)s - %(message)s")
 
@@ -29,12 +41,34 @@ postgres_server_con = None  # Global variable for Postgres Server connection
 # Global dictionary for all external DB connections
 db_connections = {}
 db_time_cols = {}
-redis_client = None  # Global variable for Redis connection
-
-def app_startup_routine():
+redis_client = None  # Global variable for Redis connection - used from worker threads (streaming / partitions)
+async_redis = None  # redis.asyncio client on a shared connection pool - used by the endpoints on the event loop
+config_settings = {}  # the config file as read at startup - per request settings come from here, not the file
+cache_settings = {}  # "cache" section of the config file - compression etc.
+spill_settings = {}  # "spill" section - results over threshold_bytes are kept in files under dir, see spill_to_disk()
+audit = None  # write-behind queue for the redis_data audit tables - see audit_log.py
+cache_idx = None  # size / hit index of the cached results with the memory budget - see cache_manager.py
+last_data_request = 0.0  # time.monotonic() of the last /data request from a user - warm_cache() waits for a quiet spell
+inflight_requests = {}  # redis_query_key -> asyncio.Future for /data requests running in this worker
+db_status = {}  # endpoint_name -> connection state kept by supervise_connections(), served on /connections
+startup_state = "warming"  # "ready" once the platform database and the external endpoints have been tried
+table_catalog = {}  # (database, table) -> (loaded at, catalog entry) - see get_table_catalog()
+
+# served on /metrics - see metrics.py
+HTTP_SECONDS = metrics.histogram("abstraction_http_request_seconds", "Time to answer an HTTP request", ("path", "status"))
+QUERY_SECONDS = metrics.histogram("abstraction_query_seconds", "Time to run a query on a database endpoint", ("endpoint", "kind"))
+ROWS_FETCHED = metrics.counter("abstraction_rows_fetched_total", "Rows read from database endpoints", ("endpoint",))
+RESULT_ROWS = metrics.histogram("abstraction_result_rows", "Rows in a query result", ("endpoint",), buckets=metrics.SIZE_BUCKETS)
+PAYLOAD_BYTES = metrics.histogram("abstraction_payload_bytes", "Size of a value written to redis after compression", ("kind",), buckets=metrics.SIZE_BUCKETS)
+BYTES_STORED = metrics.counter("abstraction_bytes_stored_total", "Bytes written to redis (or spill files) for results", ("kind",))
+SERIALIZE_SECONDS = metrics.histogram("abstraction_serialize_seconds", "Time to encode and compress a value for redis", ("kind",))
+CACHE_REQUESTS = metrics.counter("abstraction_cache_requests_total", "/data lookups - hit, miss or joined (shared another request's query)", ("route", "result"))
+
+async def app_startup_routine(connect_timeout=10):
     # this will serve as the app startup routine to check if the database connections are established 
+    # runs in the background after the app is already serving - the driver gives up each attempt after connect_timeout
+    # seconds itself, so a slow attempt is not left running (and its connection leaked) on an abandoned thread
     global postgres_server_con  
-    global redis_client
  
     attempt = 0
     max_attempts = 5
@@ -42,21 +76,22 @@ def app_startup_routine():
     logging.info("Starting FastAPI lifespan function...")
     logging.info("Connecting to Postgres Server side database...")
 
-    while postgres_server_con is None or attempt < max_attempts:
+    while attempt < max_attempts:
         try:
-            postgres_server_con = open_server_db_con()
-            if postgres_server_con.conn is not None:
+            postgres_server_con = await asyncio.to_thread(open_server_db_con, connect_timeout)
+            if postgres_server_con is not None and postgres_server_con.conn is not None:
                 logging.info(f"Postgres Server connection established. {postgres_server_con}")
                 break
         except Exception as e:
             logging.error(f"Error While starting connection to backend database server: {e}")
             postgres_server_con = None
         wait_time = (5 * attempt) + 3
-        time.sleep(wait_time)
         attempt += 1
+        if attempt >= max_attempts:
+            break  # no point backing off after the last attempt
         
         logging.info(f"Retrying in {wait_time}s... (Attempt {attempt}/{max_attempts})")
-        time.sleep(wait_time)
+        await asyncio.sleep(wait_time)
 
     if postgres_server_con is None:
         logging.error("Max attempts reached for Postgres Server DB connection.")
@@ -68,9 +103,9 @@ def app_startup_routine():
 
     pass
 
-def connect_to_external_servers():
+def connect_to_external_servers(connect_timeout=10):
     # this will connect to the external servers and check if they are up and running 
-    # we can use this to check if the servers are up and running before starting the app
+    # pools are registered empty and marked "warming" - warm_up_connections() opens them all at once
     global postgres_server_con
 
     
@@ -85,6 +120,9 @@ def connect_to_external_servers():
         """)
         rows = postgres_server_con.query(query)
 
+        # pool sizing defaults from the config file - can be overridden per endpoint with a "pool" entry in metadata
+        pool_defaults = load_config().get('connection_pool', {})
+
         for row in rows:
             endpoint_name = row["endpoint_name"]
             endpoint_type = row["endpoint_type"]
@@ -96,39 +134,70 @@ def connect_to_external_servers():
             connection_pwd = row["connection_pwd"]
             metadata = row["metadata"]
 
-            logging.info(f"Attempting to connect to {endpoint_name} [{endpoint_type}] at {endpoint_ip}:{endpoint_port}...")
+            logging.info(f"Registering {endpoint_name} [{endpoint_type}] at {endpoint_ip}:{endpoint_port}...")
 
+            metadata_load = json.loads(metadata) if metadata else {}
+            pool_settings = {**pool_defaults, **metadata_load.get('pool', {})}
+            # async_driver swaps the pyodbc pool for asyncpg / aioodbc - opened in lifespan as it needs the event loop
+            async_driver = pool_settings.pop('async_driver', False)
+            max_concurrency = pool_settings.pop('max_concurrency', None)
+            if async_driver and endpoint_type == 'sqlserver' and connections.aioodbc is None:
+                logging.warning(f"aioodbc not installed - using pyodbc pool for {endpoint_name}")
+                async_driver = False
+            if async_driver and endpoint_type == 'postgresql' and connections.asyncpg is None:
+                logging.warning(f"asyncpg not installed - using pyodbc pool for {endpoint_name}")
+                async_driver = False
+
+            con = None
             try:
-                if endpoint_type == 'sqlserver':
-                    con = connectcls_sql_server(
-                        driver_name, endpoint_ip, database_name, connection_uname, connection_pwd
+                if async_driver and endpoint_type == 'sqlserver':
+                    con = connectcls_sql_server_async(
+                        driver_name, endpoint_ip, database_name, connection_uname, connection_pwd,
+                        endpoint_name=endpoint_name, max_concurrency=max_concurrency, **pool_settings
+                    )
+                    factory = None
+                elif async_driver and endpoint_type == 'postgresql':
+                    con = connectcls_postgres_async(
+                        driver_name, endpoint_ip, database_name, connection_uname, connection_pwd, port=endpoint_port,
+                        endpoint_name=endpoint_name, max_concurrency=max_concurrency, **pool_settings
+                    )
+                    factory = None
+                elif endpoint_type == 'sqlserver':
+                    factory = partial(
+                        connectcls_sql_server, driver_name, endpoint_ip, database_name, connection_uname, connection_pwd,
+                        login_timeout=connect_timeout
                     )
-                    logging.info(f"SQL Server connection [{endpoint_name}] established.")
-
                 elif endpoint_type == 'postgresql':
-                    con = connectcls_postgres(
+                    factory = partial(
+                        connectcls_postgres,
                         driver_name=driver_name,
                         server_name=endpoint_ip,
                         db_name=database_name,
                         connection_username=connection_uname,
-                        connection_password=connection_pwd
+                        connection_password=connection_pwd,
+                        login_timeout=connect_timeout
                     )
-                    logging.info(f"PostgreSQL connection [{endpoint_name}] established.")
-
                 else:
+                    factory = None
                     logging.warning(f"Unsupported DB type: {endpoint_type} for {endpoint_name}")
 
+                if factory is not None:
+                    con = connectcls_pool(factory, endpoint_name=endpoint_name, lazy=True, **pool_settings)
+
             except Exception as e:
                 logging.error(f"Failed to connect to {endpoint_name}: {e}")
 
+            if con is None:
+                continue
+
             # need to extract 'time_col_name' from metadata and add to the dict along with the connection obj
-            metadata_load = json.loads(metadata) if metadata else {}
             time_col_name = metadata_load.get('time_col_name', None)
             if time_col_name:
                 logging.info(f"Time column name for {endpoint_name}: {time_col_name}")
             else:
                 logging.warning(f"No time column name found in metadata for {endpoint_name}.")
                 
+            db_status[endpoint_name] = {"state": "warming", "failures": 0, "last_error": None}
             db_connections[endpoint_name] = con
             db_time_cols[endpoint_name] = time_col_name
 
@@ -138,52 +207,139 @@ def connect_to_external_servers():
 
 
 
+async def warm_up_connections(connect_timeout=10):
+    # open the first connections of every registered endpoint concurrently - a slow or unreachable
+    # endpoint only holds up itself, and for at most connect_timeout seconds
+    async def warm(db_name, con):
+        status = db_status.setdefault(db_name, {"state": "warming", "failures": 0, "last_error": None})
+        try:
+            if getattr(con, 'is_async', False):
+                ok = await asyncio.wait_for(con.open(), connect_timeout) is not None
+            else:
+                ok = await asyncio.wait_for(asyncio.to_thread(con.fill), connect_timeout)
+            error = None if ok else str(con.con_err)
+        except asyncio.TimeoutError:
+            ok = False
+            error = f"Timed out after {connect_timeout}s"
+        except Exception as e:
+            ok = False
+            error = str(e)
+        if ok:
+            logging.info(f"Connection to {db_name} established. {con}")
+            status.update(state="up", last_error=None)
+        else:
+            # the supervisor keeps retrying it with backoff
+            logging.error(f"Connection to {db_name} failed: {error}")
+            status.update(state="down", last_error=error)
+
+    await asyncio.gather(*[warm(db_name, con) for db_name, con in list(db_connections.items())])
+
+
+async def startup_connections(connect_timeout=10):
+    # background part of startup - the app serves /healthcheck and cached reads while this runs
+    global startup_state
+    try:
+        await app_startup_routine(connect_timeout)
+        if postgres_server_con is not None:
+            await asyncio.to_thread(connect_to_external_servers, connect_timeout)
+            await asyncio.to_thread(pull_config_data)
+            logging.info("Connecting to external databases...")
+            await warm_up_connections(connect_timeout)
+    except Exception as e:
+        logging.error(f"Error during startup: {e}")
+    startup_state = "ready"
+    logging.info(f"Startup complete: {db_status}")
+
+
 @asynccontextmanager
 async def lifespan(app):
     # Runs at FastAPI startup
+    # only the local pieces (config, redis, audit queue) are set up before serving - the databases connect in the background
 
     global postgres_server_con
     global redis_client
-    app_startup_routine()
-    if postgres_server_con is not None:
-        connect_to_external_servers()
-        pull_config_data()
+    global async_redis
+    global audit
+    global cache_idx
 
     config_data = load_config()
+    config_settings.update(config_data)
+    connect_timeout = config_data.get('startup', {}).get('connect_timeout', 10)
+    startup_task = asyncio.create_task(startup_connections(connect_timeout))
+
+    # probes the external connections and reconnects dropped ones in the background
+    supervisor_task = asyncio.create_task(supervise_connections())
+
+    cache_settings.update(config_data.get('cache', {}))
+
+    # off unless spill.dir is set - the directory has to be readable at the same path by the backend and Dash
+    # (a shared mount), a local directory here leaves every spilled result unreadable for them.
+    # Only whole results written by send_to_redis spill - partitioned and streamed reads still go to redis
+    spill_settings.update(config_data.get('spill', {}))
+    sweeper_task = None
+    index_task = None
+    # off unless warming.enabled is set - it runs historian queries on a schedule nobody asked for directly
+    warming_task = asyncio.create_task(warm_cache(config_data.get('warming', {}))) if config_data.get('warming', {}).get('enabled', False) else None
+    if spill_settings.get('dir'):
+        try:
+            os.makedirs(spill_settings['dir'], exist_ok=True)
+            sweeper_task = asyncio.create_task(sweep_spill_files())
+        except OSError as e:
+            logging.error(f"Spill directory {spill_settings['dir']} not usable, results stay in Redis: {e}")
+            spill_settings['dir'] = None
+
+    # audit rows are written by a background thread on its own platform connection
+    audit = audit_log.audit_queue(open_server_db_con, **config_data.get('audit', {}))
+    audit.start()
+    logging.info(f"Audit queue started. {audit}")
     redis_host = config_data['endpoints']['redis-memory-store']['ip']
     redis_port = config_data['endpoints']['redis-memory-store']['port']
     logging.info(f"Connecting to Redis server at {redis_host}:{redis_port}...")
     try:
-        redis_client = rd.StrictRedis(host=redis_host, port=redis_port, db=0)
+        redis_client = rd.StrictRedis(host=redis_host, port=redis_port, db=0, socket_connect_timeout=connect_timeout)
         redis_client.ping()
+        async_pool = ard.ConnectionPool(host=redis_host, port=redis_port, db=0, socket_connect_timeout=connect_timeout,
+                                        max_connections=config_data.get('redis', {}).get('max_connections', 50))
+        async_redis = ard.Redis(connection_pool=async_pool)
+        await async_redis.ping()
         logging.info("Connected to Redis server successfully.")
+        index_settings = dict(config_data.get('cache_index', {}))
+        reconcile_interval = index_settings.pop('reconcile_interval', 300)
+        cache_idx = cache_manager.cache_index(redis_client, **index_settings)
+        index_task = asyncio.create_task(reconcile_cache_index(reconcile_interval))
+        logging.info(f"Cache index ready. {cache_idx}")
     except rd.ConnectionError as e:
         logging.error(f"Redis connection error: {e}")
 
 
-    logging.info("Connecting to external databases...")
-    # loop through the global db_connections dictionary and log connections 
-    for db_name, con in db_connections.items():
-        if con.conn is None:
-            logging.error(f"Connection to {db_name} failed.")
-        else:
-            logging.info(f"Connection to {db_name} established.")
-
-
-
+    yield
 
+    for task in (startup_task, supervisor_task, sweeper_task, index_task, warming_task):
+        if task is None:
+            continue
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
 
-    yield
+    # write out any audit rows still queued before the connections go
+    try:
+        await asyncio.to_thread(audit.stop)
+        logging.info(f"Audit queue flushed and stopped. {audit}")
+    except Exception as e:
+        logging.error(f"Error stopping audit queue: {e}")
 
     # loop through the global db_connections dictionary and close the connections
 
+    # closed whether or not they connected - a pool with nothing idle still has its executor to shut down
     for db_name, con in db_connections.items():
         try:
-            if con.conn is not None:
-                con.close_connection()
-                logging.info(f"Connection to {db_name} closed.")
+            if getattr(con, 'is_async', False):
+                await con.close_connection()
             else:
-                logging.warning(f"Connection to {db_name} was not established.")
+                con.close_connection()
+            logging.info(f"Connection to {db_name} closed.")
         except Exception as e:
             logging.error(f"Error closing connection to {db_name}: {e}")
 
@@ -191,6 +347,8 @@ async def lifespan(app):
     try:
         if redis_client:
             redis_client.close()
+            if async_redis:
+                await async_redis.aclose()
             logging.info("Redis connection closed.")
         else:
             logging.warning("Redis connection was not established.")
@@ -205,6 +363,22 @@ async def lifespan(app):
 app = FastAPI(lifespan=lifespan)
 
 
+@app.middleware("http")
+async def record_request_time(request: Request, call_next):
+    # labelled with the route template so query strings do not create new series
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_SECONDS.observe(time.perf_counter() - start, path=route.path if route else "unmatched", status=response.status_code)
+    return response
+
+
+@app.get("/metrics")
+async def get_metrics():
+    # Prometheus text format - counters are per worker process
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 def load_config():
     try:
         with open(CONFIG_FILE, "r") as file:
@@ -219,6 +393,7 @@ def load_config():
 def save_config(config_data):
     with open(CONFIG_FILE, "w") as file:
         json.dump(config_data, file, indent=4)
+    config_settings.update(config_data)
 
 
 
@@ -280,8 +455,183 @@ def pull_config_data():
 @app.get("/healthcheck")
 async def healthcheck():
     #Health check endpoint to verify if the service is running.
+    # answers as soon as the app starts - startup is "warming" until the databases have been tried
     
-    return {"status": "OK"}
+    return {"status": "OK", "startup": startup_state}
+
+async def probe_endpoint(con):
+    # True when the endpoint answered, None when it is too busy to check (so it is up)
+    if getattr(con, 'is_async', False):
+        return await con.probe()
+    if isinstance(con, connectcls_pool):
+        return await asyncio.to_thread(con.probe)
+    return con.available()
+
+
+async def supervise_connections():
+    """
+    Background task started in lifespan - probes each entry in db_connections and reconnects dropped ones.
+    Healthy endpoints are checked every interval seconds. After a failure the endpoint is retried with
+    exponential backoff (backoff_base, doubling up to backoff_max), so a historian that comes back is
+    picked up within seconds without restarting the service.
+    """
+    settings = load_config().get('supervisor', {})
+    interval = settings.get('interval', 15)
+    backoff_base = settings.get('backoff_base', 2)
+    backoff_max = settings.get('backoff_max', 300)
+    next_check = {}
+
+    while True:
+        now = time.monotonic()
+        # endpoints still warming up are left to warm_up_connections()
+        due = [(name, con) for name, con in list(db_connections.items())
+               if next_check.get(name, 0) <= now and db_status.get(name, {}).get("state") != "warming"]
+        for name, _ in due:
+            status = db_status.setdefault(name, {"state": "unknown", "failures": 0, "last_error": None})
+            if status["state"] == "down":
+                status["state"] = "reconnecting"
+
+        results = await asyncio.gather(*[probe_endpoint(con) for _, con in due], return_exceptions=True)
+
+        for (name, con), ok in zip(due, results):
+            status = db_status[name]
+            error = None
+            if isinstance(ok, Exception):
+                error = str(ok)
+                ok = False
+            if ok is not False:
+                if status["state"] not in ("up", "unknown"):
+                    logging.info(f"Connection to {name} restored after {status['failures']} failed checks")
+                status.update(state="up", failures=0, last_error=None, next_retry=None)
+                next_check[name] = now + interval
+            else:
+                status["failures"] += 1
+                delay = min(backoff_base * 2 ** (status["failures"] - 1), backoff_max)
+                error = error or str(con.con_err or "Endpoint did not answer")
+                logging.warning(f"Connection to {name} failed check {status['failures']}, retrying in {delay}s: {error}")
+                status.update(state="down", last_error=error, next_retry=datetime.now().replace(microsecond=0) + timedelta(seconds=delay))
+                next_check[name] = now + delay
+            status["last_check"] = datetime.now().replace(microsecond=0)
+
+        wake = min(next_check.values(), default=now + interval)
+        await asyncio.sleep(max(0.5, min(wake - time.monotonic(), interval)))
+
+
+@app.get("/connections")
+async def get_connections():
+    # state of each external database connection as seen by the supervisor
+    return db_status
+
+
+# types reported by INFORMATION_SCHEMA.COLUMNS.DATA_TYPE on SQL Server and PostgreSQL
+TIME_TYPES = {"date", "datetime", "datetime2", "smalldatetime", "datetimeoffset",
+              "timestamp", "timestamp without time zone", "timestamp with time zone"}
+ID_TYPES = {"int", "integer", "bigint", "smallint", "tinyint", "uniqueidentifier", "uuid"}
+ID_NAME = re.compile(r'(^|_)id$', re.IGNORECASE)
+
+
+async def get_table_catalog(database, table_name, refresh=False):
+    """
+    Columns of a table read from INFORMATION_SCHEMA, cached per worker for catalog.ttl seconds.
+
+    Returns:
+        dict: columns (name, type, nullable), time_column and id_column - or an error dict
+    """
+    key = (database, table_name.lower())
+    cached = table_catalog.get(key)
+    ttl = config_settings.get('catalog', {}).get('ttl', 3600)
+    if cached and not refresh and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+
+    connection_obj = db_connections.get(database)
+    if connection_obj is None:
+        return {"error": f"Connection to {database} failed."}
+    if not TABLE_IDENTIFIER.match(table_name):
+        return {"error": "Invalid table name"}
+
+    schema, _, table = table_name.rpartition('.')
+    query = ("SELECT TABLE_SCHEMA, COLUMN_NAME, DATA_TYPE, IS_NULLABLE FROM INFORMATION_SCHEMA.COLUMNS "
+             "WHERE LOWER(TABLE_NAME) = LOWER(?)")
+    params = [table]
+    if schema:
+        query += " AND LOWER(TABLE_SCHEMA) = LOWER(?)"
+        params.append(schema)
+    query += " ORDER BY TABLE_SCHEMA, ORDINAL_POSITION"
+    rows = await db_query(query, connection_obj, params)
+    if not isinstance(rows, list):
+        return rows if isinstance(rows, dict) else {"error": str(rows)}
+    if rows and "error" in rows[0]:
+        return rows[0]
+    if not rows:
+        return {"error": f"Table {table_name} not found in {database}"}
+
+    # drivers differ in the case of the column labels - postgres lower cases them
+    rows = [{k.lower(): v for k, v in row.items()} for row in rows]
+    # a table name without a schema is taken from the first schema that has it
+    rows = [row for row in rows if row["table_schema"] == rows[0]["table_schema"]]
+    columns = [{"name": row["column_name"], "type": str(row["data_type"]).lower(), "nullable": row["is_nullable"] == "YES"} for row in rows]
+
+    # the configured time column wins, otherwise the first date / time typed column
+    configured = (db_time_cols.get(database) or "").lower()
+    time_column = next((c["name"] for c in columns if c["name"].lower() == configured), None)
+    if time_column is None:
+        time_column = next((c["name"] for c in columns if c["type"] in TIME_TYPES), None)
+    # a leading integer / uuid column named id or *_id is the row id the backend should drop
+    first = columns[0]
+    id_column = first["name"] if first["type"] in ID_TYPES and ID_NAME.search(first["name"]) else None
+
+    entry = {"database": database, "schema": rows[0]["table_schema"], "table": table,
+             "columns": columns, "time_column": time_column, "id_column": id_column}
+    table_catalog[key] = (time.monotonic(), entry)
+    logging.info(f"Catalog loaded for {database}.{table_name}: {len(columns)} columns, time column {time_column}, id column {id_column}")
+    return entry
+
+
+def resolve_columns(catalog, columns):
+    # map requested column names onto the names in the catalog, ignoring case
+    # returns the comma separated canonical names or an error dict for columns the table does not have
+    names = {c["name"].lower(): c["name"] for c in catalog["columns"]}
+    requested = [c.strip() for c in columns.split(",") if c.strip()]
+    unknown = [c for c in requested if c.lower() not in names]
+    if unknown:
+        return {"error": f"Unknown columns for {catalog['table']}: {unknown}"}
+    return ",".join(names[c.lower()] for c in requested)
+
+
+def result_meta(database, table_name, time_col, catalog, projected):
+    # header meta for a result - the backend uses it instead of guessing which columns are time / id
+    meta = {"database": database, "table": table_name, "time_column": time_col}
+    if projected:
+        meta["id_column"] = None  # projections never include the id
+    elif "error" not in catalog:
+        meta["id_column"] = catalog["id_column"]
+    if "error" not in catalog:
+        meta["types"] = {c["name"]: c["type"] for c in catalog["columns"]}
+    return meta
+
+
+@app.get("/catalog")
+async def get_catalog(database: str, table_name: str = None, refresh: bool = False):
+    # table_name given - columns, types, time column and id column of the table
+    # otherwise the base tables of the database
+    if db_status.get(database, {}).get("state") == "warming":
+        return {"error": f"Connection to {database} is warming up - try again shortly"}
+    if table_name:
+        return await get_table_catalog(database, table_name, refresh)
+
+    connection_obj = db_connections.get(database)
+    if connection_obj is None:
+        return {"error": f"Connection to {database} failed."}
+    query = ("SELECT TABLE_SCHEMA, TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_TYPE = 'BASE TABLE' "
+             "AND TABLE_SCHEMA NOT IN ('information_schema', 'pg_catalog', 'sys') ORDER BY TABLE_SCHEMA, TABLE_NAME")
+    rows = await db_query(query, connection_obj)
+    if not isinstance(rows, list):
+        return rows if isinstance(rows, dict) else {"error": str(rows)}
+    if rows and "error" in rows[0]:
+        return rows[0]
+    rows = [{k.lower(): v for k, v in row.items()} for row in rows]
+    return {"database": database, "tables": [f"{row['table_schema']}.{row['table_name']}" for row in rows]}
+
 
 def fetch_configuration_Data():
 
@@ -292,6 +642,10 @@ def fetch_configuration_Data():
     
     
     # Check if the Postgres Server connection is established
+    if postgres_server_con is None:
+        # still connecting in the background at startup
+        logging.error("Postgres Server connection not established")
+        return {"error": "Postgres Server connection not established"}
     if postgres_server_con.conn is None:
         if postgres_server_con.con_err:
             logging.error(f"Postgres Server connection error: {postgres_server_con.con_err}")
@@ -442,21 +796,32 @@ async def add_database_connection(request: Request):
 
 
 @app.get("/data")
-async def get_data(database: str = "null",table_name: str = "null", fil_condition: str = '1=1', limit: int = 10, start: str = None, end: str = None, user:str = "null"):
+async def get_data(database: str = "null",table_name: str = "null", fil_condition: str = '1=1', limit: int = 10, start: str = None, end: str = None, user:str = "null", stream: bool = False, chunk_size: int = None,
+                   bucket: str = None, agg: str = None, columns: str = None, paginate: bool = False, cursor: str = None):
     # Check if the database is SQL Server
     # log all the inputs to the function
+    # bucket / agg / columns push the aggregation down to the source database e.g. bucket=day&agg=avg&columns=temp,pressure
+    # paginate=true returns one page of limit rows and a next_cursor to pass back as cursor for the page after
     global db_connections
     global postgres_server_con
 
+    global last_data_request
+
     # build a query string to store in a lookup in redis 
     logging.info(f"user: {user}")
-    redis_query_key = f"{database}_{table_name}_{start}_{end}"
+    if user != cache_warmer.WARMER_USER:
+        last_data_request = time.monotonic()
+    redis_query_key = query_key(database, table_name, start, end, fil_condition, bucket, agg, columns)
+    if paginate:
+        return await get_page(database, table_name, fil_condition, limit, start, end, user, cursor, redis_query_key)
     # check redis for key and return value to front end if it exsits 
     try:
         # check if the key exists in redis
-        redis_value = redis_client.get(redis_query_key)
+        redis_value = await async_redis.get(redis_query_key)
         if redis_value:
             logging.info(f"Key {redis_query_key} found in Redis, returning cached value.")
+            CACHE_REQUESTS.inc(route="/data", result="hit")
+            track_hit(redis_value)
             store_query_data(redis_value, reuse_qry=True)
             
             return {"redis_key": redis_value}
@@ -464,6 +829,26 @@ async def get_data(database: str = "null",table_name: str = "null", fil_conditio
         logging.error(f"Error checking Redis for key {redis_query_key}: {e}")
         return {"error": f"Error checking Redis for key {redis_query_key}"}
 
+    # identical requests that arrive while this one is running share its result - see single_flight()
+    return await single_flight(redis_query_key, partial(
+        load_data, database, table_name, fil_condition, limit, start, end, user, stream, chunk_size, bucket, agg, columns, redis_query_key
+    ))
+
+
+def query_key(database, table_name, start, end, fil_condition='1=1', bucket=None, agg=None, columns=None):
+    # redis key of the pointer to the cached result of a /data request
+    redis_query_key = f"{database}_{table_name}_{start}_{end}"
+    if fil_condition != '1=1':
+        redis_query_key += f"_{fil_condition}"
+    if bucket or agg or columns:
+        redis_query_key += f"_{bucket}_{agg}_{columns}"
+    return redis_query_key
+
+
+async def load_data(database, table_name, fil_condition, limit, start, end, user, stream, chunk_size, bucket, agg, columns, redis_query_key):
+    # cache miss path of /data - runs the query and stores the result under redis_query_key
+    global db_connections
+    CACHE_REQUESTS.inc(route="/data", result="miss")
 
     logging.info(f"Received request for /data with database: {database},  table_name: {table_name}, fil_condition: {fil_condition}, limit: {limit}, start: {start}, end: {end}")
     if start is None or end is None:
@@ -476,6 +861,16 @@ async def get_data(database: str = "null",table_name: str = "null", fil_conditio
     except ValueError as e:
         logging.error(f"Date format error: {e}")
         return {"error": "Invalid date format"}
+
+    # the table name is the only part of the statement that cannot be a bound parameter
+    if table_name and not TABLE_IDENTIFIER.match(table_name):
+        logging.error(f"Invalid table name: {table_name}")
+        return {"error": "Invalid table name"}
+    filter_sql = parse_filter(fil_condition)
+    if isinstance(filter_sql, dict):
+        logging.error(f"Invalid filter condition: {fil_condition}")
+        return filter_sql
+    filter_sql, filter_params = filter_sql
     
     # database sent will be 
 
@@ -484,41 +879,408 @@ async def get_data(database: str = "null",table_name: str = "null", fil_conditio
     connection_obj = db_connections.get(database)
     time_col_name = db_time_cols.get(database)
     if connection_obj is None:
+        if startup_state == "warming":
+            return {"error": f"Connection to {database} is warming up - try again shortly"}
         logging.error(f"Connection to {database} failed.")
         return {"error": f"Connection to {database} failed."}
+    if db_status.get(database, {}).get("state") == "warming":
+        return {"error": f"Connection to {database} is warming up - try again shortly"}
+
+    # the catalog gives the real column names and the time / id columns - without it the request
+    # goes ahead on the configured time column and the names as given
+    catalog = await get_table_catalog(database, table_name) if table_name else {"error": "No table name provided"}
+    if "error" in catalog:
+        logging.warning(f"No catalog for {database}.{table_name}: {catalog['error']}")
+    else:
+        time_col_name = catalog["time_column"] or time_col_name
+        if columns:
+            columns = resolve_columns(catalog, columns)
+            if isinstance(columns, dict):
+                return columns
+    meta = result_meta(database, table_name, time_col_name, catalog, bool(bucket or agg or columns))
     
+    # aggregated / projected reads are built for the dialect of the endpoint
+    if bucket or agg or columns:
+        query = build_aggregate_query(connection_obj, table_name, time_col_name, start_date, end_date, bucket, agg, columns,
+                                      filter_sql, filter_params)
+        if isinstance(query, dict):
+            return query
+        query, params = query
+        logging.info(f"Executing aggregate query: {query} with values {params}")
+        redis_db_key = await fetch_to_redis(query, connection_obj, redis_query_key, stream=stream, chunk_size=chunk_size, params=params, meta=meta)
+        if isinstance(redis_db_key, dict) and "error" in redis_db_key:
+            return redis_db_key
+        store_query_data(redis_db_key, query_table=table_name, query_db=database, reuse_qry=False, qry=render_query(query, params), user=user)
+        return {"redis_key": redis_db_key}
+
+    # plain time range reads are cached in day partitions so overlapping ranges reuse what is already in redis
+    partition_days = int(cache_settings.get('partition_days', 1))
+    if partition_days > 0 and table_name and time_col_name and fil_condition == '1=1':
+        start_day = datetime.strptime(start_date, '%Y-%m-%d').date()
+        end_day = datetime.strptime(end_date, '%Y-%m-%d').date()
+        if chunk_size is None:
+            chunk_size = config_settings.get('streaming', {}).get('chunk_rows', 10000)
+        redis_db_key, query = await asyncio.to_thread(
+            partitioned_to_redis, connection_obj, database, table_name, time_col_name,
+            start_day, end_day, redis_query_key, partition_days, chunk_size, asyncio.get_running_loop(), meta
+        )
+        if isinstance(redis_db_key, dict) and "error" in redis_db_key:
+            return redis_db_key
+        store_query_data(redis_db_key, query_table=table_name, query_db=database, reuse_qry=False, qry=query, user=user)
+        return {"redis_key": redis_db_key}
+
     if "server" in database.lower():
 
         if table_name:
-            date_filter = ""
-            if start and end:
-                date_filter = f" {time_col_name} BETWEEN '{start_date}' AND '{end_date}'"
-            query = f"SELECT * from {table_name} WHERE {date_filter}"
-            logging.info(f"Executing SQL Server query: {query}")
-            result = await db_query(query, connection_obj)
-            redis_db_key = send_to_redis(result, redis_query_key)
+            # dates are bound as parameters so the statement text is the same for every range and the plan is reused
+            query = f"SELECT * from {table_name} WHERE {filter_sql} AND {time_col_name} BETWEEN ? AND ?"
+            params = filter_params + [datetime.strptime(start_date, '%Y-%m-%d'), datetime.strptime(end_date, '%Y-%m-%d')]
+            logging.info(f"Executing SQL Server query: {query} with values {params}")
+            redis_db_key = await fetch_to_redis(query, connection_obj, redis_query_key, stream=stream, chunk_size=chunk_size, params=params, meta=meta)
+            if isinstance(redis_db_key, dict) and "error" in redis_db_key:
+                return redis_db_key
             # we need to send to postgres server db to store key id etc 
-            store_query_data(redis_db_key, query_table=table_name, query_db=database, reuse_qry=False, qry=query, user=user)
+            store_query_data(redis_db_key, query_table=table_name, query_db=database, reuse_qry=False, qry=render_query(query, params), user=user)
             return {"redis_key": redis_db_key}
         else:
             return {"error": "No table name provided"}
     # Check if the database contains 'postgres'
     elif 'postgres' in database.lower():
         if table_name:
-            date_filter = ""
-            if start and end:
-                date_filter = f" AND {table_name}.{time_col_name} BETWEEN '{start}' AND '{end}'"
-            query = f"SELECT * from {table_name} WHERE {fil_condition}{date_filter}"
-            logging.info(f"Executing PostgreSQL query: {query}")
-            result = await db_query(query, connection_obj)
-            redis_db_key = send_to_redis(result, redis_query_key)
-            store_query_data(redis_db_key, query_table=table_name, query_db=database, reuse_qry=False, qry=query, user=user)
+            query = f"SELECT * from {table_name} WHERE {filter_sql} AND {table_name}.{time_col_name} BETWEEN ? AND ?"
+            params = filter_params + [datetime.strptime(start_date, '%Y-%m-%d'), datetime.strptime(end_date, '%Y-%m-%d')]
+            logging.info(f"Executing PostgreSQL query: {query} with values {params}")
+            redis_db_key = await fetch_to_redis(query, connection_obj, redis_query_key, stream=stream, chunk_size=chunk_size, params=params, meta=meta)
+            if isinstance(redis_db_key, dict) and "error" in redis_db_key:
+                return redis_db_key
+            store_query_data(redis_db_key, query_table=table_name, query_db=database, reuse_qry=False, qry=render_query(query, params), user=user)
             return {"redis_key": redis_db_key}
         else:
             return {"error": "No table name provided"}
     else:
         return {"error": "No database provided"}
-    
+
+
+# fields of a /data_batch spec and their defaults - the same as the /data query parameters
+BATCH_DEFAULTS = {"database": "null", "table_name": "null", "fil_condition": '1=1', "limit": 10, "start": None, "end": None,
+                  "stream": False, "chunk_size": None, "bucket": None, "agg": None, "columns": None}
+
+
+@app.post("/data_batch")
+async def get_data_batch(request: Request):
+    """
+    Several /data reads in one call e.g. the same range from a process line and the LIMS.
+    Body: {"user": "...", "requests": [{"database": ..., "table_name": ..., "start": ..., "end": ..., "columns": ...}, ...]}
+
+    All reads run concurrently so the batch takes about as long as its slowest read. Every endpoint is a
+    connection pool or an async pool, so reads on the same database each check out their own connection
+    and wait for one when the pool is at max_size.
+
+    Returns:
+        dict: results in the order of the specs, each with the redis_key or an error
+    """
+    try:
+        data = await request.json()
+    except Exception as e:
+        logging.error(f"Invalid /data_batch body: {e}")
+        return {"error": "Invalid JSON body"}
+    specs = data.get("requests") if isinstance(data, dict) else None
+    if not isinstance(specs, list) or not specs:
+        return {"error": "No requests provided"}
+    max_requests = int(config_settings.get('batch', {}).get('max_requests', 20))
+    if len(specs) > max_requests:
+        return {"error": f"A batch can hold at most {max_requests} requests"}
+    user = data.get("user", "null")
+    logging.info(f"Received request for /data_batch with {len(specs)} requests from user: {user}")
+
+    async def run(spec):
+        if not isinstance(spec, dict):
+            return {"error": "Each request must be an object"}
+        unknown = [k for k in spec if k not in BATCH_DEFAULTS]
+        if unknown:
+            return {"error": f"Unknown fields: {unknown}"}
+        try:
+            return await get_data(user=user, **{k: spec.get(k, v) for k, v in BATCH_DEFAULTS.items()})
+        except Exception as e:
+            logging.error(f"Batch request {spec} failed: {e}")
+            return {"error": f"Error processing request {e}"}
+
+    start_time = time.monotonic()
+    done = await asyncio.gather(*(run(spec) for spec in specs))
+    results = []
+    for spec, result in zip(specs, done):
+        spec = spec if isinstance(spec, dict) else {}
+        results.append({"database": spec.get("database"), "table_name": spec.get("table_name"), **result})
+    logging.info(f"/data_batch finished {len(specs)} requests in {time.monotonic() - start_time:.2f}s")
+    return {"results": results}
+
+
+def encode_cursor(values, skip=0):
+    # continuation token - the sort key (time column then tiebreaker columns) of the last row returned
+    # and how many rows with exactly that key have been returned (only more than 1 for duplicate rows)
+    def plain(value):
+        if isinstance(value, (datetime, date)):
+            return {"d": value.isoformat()}
+        if isinstance(value, (bytes, bytearray)):
+            return {"b": bytes(value).hex()}
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        return str(value)  # decimal / uuid - passed back as text, the database converts it for the comparison
+    return base64.urlsafe_b64encode(json.dumps({"k": [plain(v) for v in values], "n": skip}).encode()).decode()
+
+
+def decode_cursor(cursor):
+    def typed(value):
+        if isinstance(value, dict) and "d" in value:
+            return datetime.fromisoformat(value["d"])
+        if isinstance(value, dict) and "b" in value:
+            return bytes.fromhex(value["b"])
+        return value
+    try:
+        token = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return [typed(v) for v in token["k"]], int(token["n"])
+    except (ValueError, KeyError, TypeError) as e:
+        logging.error(f"Invalid cursor {cursor}: {e}")
+        return None
+
+
+def page_keys(dialect, catalog, time_col):
+    # sort key for pages - the time column then the id column, or every column that can be sorted when
+    # there is no id, so rows sharing a timestamp still have a fixed order to resume from
+    if catalog["id_column"]:
+        tiebreak = [c for c in catalog["columns"] if c["name"] == catalog["id_column"]]
+    else:
+        tiebreak = [c for c in catalog["columns"] if c["name"].lower() != time_col.lower()
+                    and IDENTIFIER.match(c["name"]) and c["type"] not in dialect.unordered_types]
+    return [(time_col, False)] + [(c["name"], c["nullable"]) for c in tiebreak]
+
+
+def keyset_order(dialect, table_name, keys):
+    # NULLs sort last on both databases - SQL Server puts them first by default
+    order = []
+    for i, (name, nullable) in enumerate(keys):
+        col = f"{table_name}.{name}" if i == 0 else dialect.quote_ident(name)
+        order.append(f"CASE WHEN {col} IS NULL THEN 1 ELSE 0 END, {col}" if nullable else col)
+    return ", ".join(order)
+
+
+def keyset_after(dialect, table_name, keys, values):
+    # rows at or after values in keyset_order - expanded into ORs as SQL Server has no row value comparison
+    # rows equal to values are included so duplicate rows can be skipped by count
+    # https://use-the-index-luke.com/sql/partial-results/fetch-next-page
+    clause, params = "1=1", []
+    for i in reversed(range(len(keys))):
+        name, nullable = keys[i]
+        col = f"{table_name}.{name}" if i == 0 else dialect.quote_ident(name)
+        value = values[i]
+        if value is None:
+            # nothing sorts after NULL in this column - only rows that are also NULL can continue
+            clause = f"({col} IS NULL AND ({clause}))"
+        else:
+            greater = f"{col} > ? OR {col} IS NULL" if nullable else f"{col} > ?"
+            clause = f"({greater} OR ({col} = ? AND ({clause})))"
+            params = [value, value] + params
+    return clause, params
+
+
+async def get_page(database, table_name, fil_condition, limit, start, end, user, cursor, redis_query_key):
+    """
+    One page of a time range read, in time order - keyset pagination on the time column plus a tiebreaker
+    (the id column, or all sortable columns). Each page starts after the sort key of the last row of the page
+    before, so a page costs the same however deep into the range it is and rows sharing a time are not lost.
+
+    Returns:
+        dict: redis_key for the page and next_cursor, which is None on the last page
+    """
+    max_page = int(config_settings.get('streaming', {}).get('max_page_rows', 50000))
+    if limit < 1 or limit > max_page:
+        return {"error": f"Page size must be between 1 and {max_page}"}
+
+    # pages are cached like any other read - the next cursor is kept alongside the pointer
+    page_query_key = f"{redis_query_key}_page_{limit}_{cursor or 'first'}"
+    try:
+        pipe = async_redis.pipeline(transaction=False)
+        pipe.get(page_query_key)
+        pipe.get(f"{page_query_key}:next")
+        redis_value, next_cursor = await pipe.execute()
+        if redis_value:
+            logging.info(f"Key {page_query_key} found in Redis, returning cached page.")
+            CACHE_REQUESTS.inc(route="/data?paginate", result="hit")
+            track_hit(redis_value)
+            store_query_data(redis_value, reuse_qry=True)
+            return {"redis_key": redis_value, "next_cursor": next_cursor.decode() if next_cursor else None}
+    except Exception as e:
+        logging.error(f"Error checking Redis for key {page_query_key}: {e}")
+        return {"error": f"Error checking Redis for key {page_query_key}"}
+
+    CACHE_REQUESTS.inc(route="/data?paginate", result="miss")
+    logging.info(f"Received request for /data page with database: {database}, table_name: {table_name}, fil_condition: {fil_condition}, limit: {limit}, start: {start}, end: {end}, cursor: {cursor}")
+    if start is None or end is None:
+        return {"error": "No start or end date provided"}
+    try:
+        start_dt = datetime.strptime(start, '%Y-%m-%d')
+        end_dt = datetime.strptime(end, '%Y-%m-%d')
+    except ValueError as e:
+        logging.error(f"Date format error: {e}")
+        return {"error": "Invalid date format"}
+    if not table_name or not TABLE_IDENTIFIER.match(table_name):
+        return {"error": "Invalid table name"}
+    filter_sql = parse_filter(fil_condition)
+    if isinstance(filter_sql, dict):
+        return filter_sql
+    filter_sql, filter_params = filter_sql
+
+    connection_obj = db_connections.get(database)
+    time_col_name = db_time_cols.get(database)
+    if connection_obj is None or db_status.get(database, {}).get("state") == "warming":
+        if startup_state == "warming" or connection_obj is not None:
+            return {"error": f"Connection to {database} is warming up - try again shortly"}
+        logging.error(f"Connection to {database} failed.")
+        return {"error": f"Connection to {database} failed."}
+    # the catalog gives the tiebreaker columns - without it pages could skip or repeat rows sharing a time
+    catalog = await get_table_catalog(database, table_name)
+    if "error" in catalog:
+        return catalog
+    time_col_name = catalog["time_column"] or time_col_name
+    if not time_col_name:
+        return {"error": "No time column configured for this database"}
+
+    dialect = connection_obj.dialect if isinstance(connection_obj, connectcls_pool) else type(connection_obj)
+    keys = page_keys(dialect, catalog, time_col_name)
+    after, skip, keyset_sql, keyset_params = start_dt, 0, "1=1", []
+    if cursor:
+        decoded = decode_cursor(cursor)
+        if decoded is None or len(decoded[0]) != len(keys):
+            return {"error": "Invalid cursor"}
+        values, skip = decoded
+        after = values[0]
+        keyset_sql, keyset_params = keyset_after(dialect, table_name, keys, values)
+
+    # the offset only skips rows identical to the last one returned - 0 unless the table has duplicate rows
+    page_sql, page_params = dialect.page(skip, limit)
+    time_ref = f"{table_name}.{time_col_name}"
+    query = (f"SELECT * from {table_name} WHERE {filter_sql} AND {time_ref} >= ? AND {time_ref} <= ? AND {keyset_sql} "
+             f"ORDER BY {keyset_order(dialect, table_name, keys)} {page_sql}")
+    params = filter_params + [after, end_dt] + keyset_params + page_params
+    logging.info(f"Executing page query: {query} with values {params}")
+    rows = await db_query(query, connection_obj, params)
+    if isinstance(rows, dict):
+        return rows
+    if rows and "error" in rows[0]:
+        return rows[0]
+
+    next_cursor = None
+    if len(rows) == limit:
+        # column names come back from the driver - match the key columns without case
+        def key(row):
+            row = {k.lower(): v for k, v in row.items()}
+            return [row.get(name.lower()) for name, _ in keys]
+        last = key(rows[-1])
+        same = sum(1 for row in rows if key(row) == last)
+        if cursor and encode_cursor(last) == encode_cursor(values):
+            same += skip  # still on copies of the cursor row - compared encoded as the cursor holds decimals as text
+        next_cursor = encode_cursor(last, same)
+
+    redis_db_key = await send_to_redis(rows, page_query_key, result_meta(database, table_name, time_col_name, catalog, False))
+    if not isinstance(redis_db_key, str):
+        return {"error": "Error storing result in Redis"}
+    try:
+        await async_redis.set(f"{page_query_key}:next", next_cursor or "", ex=3600)
+    except Exception as e:
+        logging.error(f"Error storing next cursor in Redis: {e}")
+    store_query_data(redis_db_key, query_table=table_name, query_db=database, reuse_qry=False, qry=render_query(query, params), user=user)
+    return {"redis_key": redis_db_key, "next_cursor": next_cursor}
+
+
+async def single_flight(redis_query_key, load):
+    """
+    Run load() once for concurrent identical /data requests.
+    Inside a worker later callers await the first caller's future. Across gunicorn workers the
+    first worker takes a short redis lease and the others wait for the query pointer it writes.
+    """
+    future = inflight_requests.get(redis_query_key)
+    if future is not None:
+        logging.info(f"Joining in-flight request for {redis_query_key}")
+        CACHE_REQUESTS.inc(route="/data", result="joined")
+        return await asyncio.shield(future)
+
+    future = asyncio.get_running_loop().create_future()
+    inflight_requests[redis_query_key] = future
+    try:
+        result = await lease_and_load(redis_query_key, load)
+        future.set_result(result)
+        return result
+    finally:
+        inflight_requests.pop(redis_query_key, None)
+        if not future.done():
+            future.set_result({"error": "Error loading data"})
+
+
+async def lease_and_load(redis_query_key, load):
+    # SET NX PX takes the lease - it expires on its own if the worker holding it dies
+    lease_ms = int(cache_settings.get('lock_lease_ms', 30000))
+    max_ms = int(cache_settings.get('lock_max_ms', 600000))  # longest a holder keeps renewing its lease
+    poll_ms = int(cache_settings.get('lock_poll_ms', 100))
+    lock_key = f"lock:{redis_query_key}"
+    token = random_redis_key()
+
+    while True:
+        try:
+            acquired = await async_redis.set(lock_key, token, nx=True, px=lease_ms)
+        except Exception as e:
+            logging.error(f"Error taking lease {lock_key}, running query without it: {e}")
+            return await load()
+
+        if acquired:
+            heartbeat = asyncio.create_task(renew_lease(lock_key, token, lease_ms, max_ms))
+            try:
+                return await load()
+            finally:
+                heartbeat.cancel()
+                # only release our own lease - a slow query may have outlived it and another worker holds it now
+                try:
+                    if await async_redis.get(lock_key) == token.encode():
+                        await async_redis.delete(lock_key)
+                except Exception as e:
+                    logging.error(f"Error releasing lease {lock_key}: {e}")
+
+        logging.info(f"Request for {redis_query_key} is running in another worker, waiting for its result")
+        # no fixed deadline - the holder renews the lease while its query runs, so waiting on the lease
+        # lasts as long as the query does and ends within lock_lease_ms if the holder dies
+        while True:
+            await asyncio.sleep(poll_ms / 1000)
+            try:
+                pipe = async_redis.pipeline(transaction=False)
+                pipe.get(redis_query_key)
+                pipe.exists(lock_key)
+                redis_value, locked = await pipe.execute()
+            except Exception as e:
+                logging.error(f"Error waiting for {redis_query_key}: {e}")
+                return await load()
+            if redis_value:
+                CACHE_REQUESTS.inc(route="/data", result="joined")
+                store_query_data(redis_value, reuse_qry=True)
+                return {"redis_key": redis_value}
+            if not locked:
+                break  # finished without a result, the holder died or gave up - try to take the lease
+
+
+async def renew_lease(lock_key, token, lease_ms, max_ms):
+    # heartbeat for lease_and_load - push the lease expiry out while load() runs, up to max_ms in total
+    # https://redis.io/docs/latest/develop/use/patterns/distributed-locks/
+    stop = time.monotonic() + max_ms / 1000
+    while True:
+        await asyncio.sleep(lease_ms / 3000)
+        if time.monotonic() >= stop:
+            logging.warning(f"Query holding {lock_key} ran past {max_ms} ms, letting the lease lapse")
+            return
+        try:
+            if await async_redis.get(lock_key) != token.encode():
+                logging.warning(f"Lost lease {lock_key}, another worker may run the same query")
+                return
+            await async_redis.pexpire(lock_key, lease_ms)
+        except Exception as e:
+            logging.error(f"Error renewing lease {lock_key}: {e}")
 
 
 @app.get("/command")
@@ -538,102 +1300,532 @@ async def get_command(rst: str = "null"):
 async def rec_store_req(key_proc: str = "null", key_raw: str = "null", analysis_type: str = "null"):  
     # recieve the request from backend to store in redis db - redis_processed_log - this will be passed to 
     logging.info(f"Received request for /store_processed_data with key_proc: {key_proc}, key_raw: {key_raw}, analysis_type: {analysis_type}")
-    if postgres_server_con.conn is None:
-        if postgres_server_con.con_err:
-            logging.error(f"Postgres Server connection error: {postgres_server_con.con_err}")
-            return postgres_server_con.con_err
-        else:
-            logging.error("Postgres Server connection not established")
-            return {"error": "SQL Server connection not established"}
+    if audit is None:
+        logging.error("Audit queue not started")
+        return {"error": "Audit queue not started"}
     
     table = "redis_data.redis_processed_log"
-    query = f"INSERT INTO {table} (redis_processed_key, redis_key, analysis_type, processed_request) VALUES (?, ?, ?, ?)"
+    columns = ("redis_processed_key", "redis_key", "analysis_type", "processed_request")
     values = (key_proc, key_raw, analysis_type, 1)
-    try:
-        postgres_server_con.cursor.execute(query, values)
-        postgres_server_con.conn.commit()
-        logging.info(f"Query executed successfully: {query}")
-    except Exception as e:
-        logging.error(f"Error executing query: {e}")
-        return {"error": "Error executing query"}
+    # queued - written in the next batch by the audit thread
+    audit.log(table, columns, values)
 
 
 
 
 def store_query_data(key, query_table="", query_db="", reuse_qry=False, qry="", user="null"):
     # this will take the redis key and the query and store iin the data base 
-     # Shared connection check
-    if postgres_server_con.conn is None:
-        if postgres_server_con.con_err:
-            logging.error(f"Postgres Server connection error: {postgres_server_con.con_err}")
-            return postgres_server_con.con_err
-        else:
-            logging.error("Postgres Server connection not established")
-            return {"error": "SQL Server connection not established"}
+    # rows are queued and written in batches by the audit thread - nothing here waits on the platform database
+    if audit is None:
+        logging.error("Audit queue not started")
+        return {"error": "Audit queue not started"}
     logging.info(f"value of reuse_qry: {reuse_qry}")
     if reuse_qry:
         logging.info(f"Received request for /store_query_data with reuse_qry: {reuse_qry}, key: {key}, query_table: {query_table}, query_db: {query_db}")
         table = "redis_data.reused_queries"
-        query = f"INSERT INTO {table} (redis_key) VALUES (?)"
+        columns = ("redis_key",)
         values = (key,) # one tuple value req
     else:
         logging.info(f"Received request for /store_query_data")
         table = "redis_data.redis_cache_log"
-        query = f"INSERT INTO {table} (redis_key, query_text, query_database, query_table, client_ip) VALUES (?, ?, ?, ?, ?)"
+        columns = ("redis_key", "query_text", "query_database", "query_table", "client_ip")
         values = (key, qry, query_db, query_table, user)
-    logging.info(f"Executing Postgres Server query: {query} with values {values}")
-    # execute and commit the query
-    try:
-        postgres_server_con.cursor.execute(query, values)
-        postgres_server_con.conn.commit()
-        logging.info(f"Query executed successfully: {query}")
-    except Exception as e:
-        logging.error(f"Error executing query: {e}")
-        return {"error": "Error executing query"}
+    logging.info(f"Queueing audit row for {table} with values {values}")
+    audit.log(table, columns, values)
 
 
     
 # Function to query SQL Server database
-async def db_query(query, con_obj):
+async def db_query(query, con_obj, params=None):
     # standard function to query the database and return the result
+    # params are bound to the ? placeholders in the query
     
-    logging.info(f"Received request for /db_query with query: {query}")
-    if con_obj.conn is None:
+    logging.info(f"Received request for /db_query with query: {query} with values {params}")
+    # pools open connections on demand - available() is only false for a closed pool or a failed connection
+    if not con_obj.available():
         if con_obj.con_err:
             return con_obj.con_err
         else:
             return {"error": "SQL Server connection not established"}
-    result = await asyncio.to_thread(con_obj.query, query)
+    endpoint = endpoint_label(con_obj)
+    with QUERY_SECONDS.time(endpoint=endpoint, kind="query"):
+        if getattr(con_obj, 'is_async', False):
+            # async drivers run on the event loop - no thread is held while the query is in flight
+            result = await con_obj.query(query, params)
+        elif isinstance(con_obj, connectcls_pool):
+            # each pool has its own threads so one busy endpoint does not queue queries for the others
+            result = await asyncio.get_running_loop().run_in_executor(con_obj.executor, con_obj.query, query, params)
+        else:
+            result = await asyncio.to_thread(con_obj.query, query, params)
+    if isinstance(result, list) and not (result and "error" in result[0]):
+        record_rows(endpoint, len(result))
 
     return result
 
 
+def endpoint_label(con_obj):
+    # endpoint name for the metrics - the platform database connection is not in db_connections
+    return getattr(con_obj, 'endpoint_name', None) or next((name for name, con in db_connections.items() if con is con_obj), "platform")
 
-# function to send to redis
 
-def send_to_redis(redis_value, redis_qry_key):
-    # Send data to Redis with a random key and return the key to the call which returns to user
+def record_rows(endpoint, rows):
+    ROWS_FETCHED.inc(rows, endpoint=endpoint)
+    RESULT_ROWS.observe(rows, endpoint=endpoint)
+
+
+def encode_for_redis(rows, kind, meta=None):
+    # columnar encode + compress, recorded in the serialization and payload size metrics
+    with SERIALIZE_SECONDS.time(kind=kind):
+        payload = compress_payload(cache_codec.encode_records(rows, default=json_serial, meta=meta))
+    record_payload(payload, kind)
+    return payload
+
+
+def encode_result(rows, meta=None):
+    # encode_for_redis for a whole result - a result over spill.threshold_bytes comes back uncompressed
+    # with spill=True so it can go to a file, where readers map it without decompressing
+    threshold = spill_settings.get('threshold_bytes') if spill_settings.get('dir') else None
+    with SERIALIZE_SECONDS.time(kind="result"):
+        payload = cache_codec.encode_records(rows, default=json_serial, meta=meta)
+        if threshold and len(payload) > threshold:
+            return payload, True
+        payload = compress_payload(payload)
+    record_payload(payload, "result")
+    return payload, False
+
+
+def record_payload(payload, kind):
+    PAYLOAD_BYTES.observe(len(payload), kind=kind)
+    BYTES_STORED.inc(len(payload), kind=kind)
+
+
+
+def build_aggregate_query(con_obj, table_name, time_col, start_date, end_date, bucket=None, agg=None, columns=None,
+                          filter_sql=None, filter_params=None):
+    """
+    Build a query that returns only the requested columns, optionally grouped into time buckets
+    on the database server, for the range [start_date, end_date).
+
+    Args:
+        bucket (str): one of BUCKETS - omit for a plain column projection
+        agg (str): one of AGGREGATES, applied to every column - defaults to avg when bucket is set
+        columns (str): comma separated column names
+        filter_sql, filter_params: the parsed fil_condition from parse_filter(), ANDed into the WHERE
+    Returns:
+        (str, list): the query and its parameters, or an error dict if the parameters are not valid
+    """
+    dialect = con_obj.dialect if isinstance(con_obj, connectcls_pool) else type(con_obj)
+    if not table_name or not TABLE_IDENTIFIER.match(table_name):
+        return {"error": "Invalid table name"}
+    if not time_col:
+        return {"error": "No time column configured for this database"}
+    column_list = [c.strip() for c in columns.split(",") if c.strip()] if columns else []
+    bad = [c for c in column_list if not IDENTIFIER.match(c)]
+    if bad:
+        return {"error": f"Invalid column names: {bad}"}
+    if bucket and bucket not in BUCKETS:
+        return {"error": f"Invalid bucket - use one of {list(BUCKETS)}"}
+    if agg and agg not in AGGREGATES:
+        return {"error": f"Invalid aggregate - use one of {list(AGGREGATES)}"}
+    if agg and not bucket:
+        return {"error": "An aggregate needs a bucket"}
+    if bucket and not column_list:
+        return {"error": "Columns to aggregate must be provided with a bucket"}
+
+    time_ref = f"{table_name}.{dialect.quote_ident(time_col)}"
+    where = f"{time_ref} >= ? AND {time_ref} < ?"
+    params = [datetime.strptime(start_date, '%Y-%m-%d'), datetime.strptime(end_date, '%Y-%m-%d')]
+    if filter_sql and filter_sql != "1=1":
+        where += f" AND ({filter_sql})"
+        params += list(filter_params or [])
+    if bucket:
+        bucket_expr = dialect.time_bucket(time_ref, bucket)
+        selects = [f"{bucket_expr} AS {dialect.quote_ident(time_col)}"]
+        selects += [f"{dialect.aggregate(agg or 'avg', dialect.quote_ident(c))} AS {dialect.quote_ident(c)}" for c in column_list if c != time_col]
+        return f"SELECT {', '.join(selects)} FROM {table_name} WHERE {where} GROUP BY {bucket_expr} ORDER BY {dialect.quote_ident(time_col)}", params
+
+    selects = [dialect.quote_ident(c) for c in ([time_col] + [c for c in column_list if c != time_col])]
+    return f"SELECT {', '.join(selects)} FROM {table_name} WHERE {where} ORDER BY {time_ref}", params
+
+
+# operators allowed in fil_condition - each comparison is column OP literal, joined with AND
+FILTER_TERM = re.compile(r"^\s*([A-Za-z_][A-Za-z0-9_]*)\s*(<=|>=|<>|!=|=|<|>)\s*('(?:[^']|'')*'|-?\d+(?:\.\d+)?)\s*$")
+
+
+def parse_filter(fil_condition):
+    """
+    Turn fil_condition into SQL with ? placeholders so the values are bound and never spliced into the statement.
+    Only simple comparisons are accepted e.g. "line_id = 3 AND status <> 'off'".
+
+    Returns:
+        (str, list): the condition and its parameters, or an error dict
+    """
+    if not fil_condition or fil_condition.strip() == '1=1':
+        return "1=1", []
+    terms = []
+    params = []
+    for term in re.split(r"\s+AND\s+", fil_condition.strip(), flags=re.IGNORECASE):
+        match = FILTER_TERM.match(term)
+        if not match:
+            return {"error": f"Invalid filter condition: {term}"}
+        column, op, literal = match.groups()
+        if literal.startswith("'"):
+            value = literal[1:-1].replace("''", "'")
+        elif "." in literal:
+            value = float(literal)
+        else:
+            value = int(literal)
+        terms.append(f"{column} {op} ?")
+        params.append(value)
+    return " AND ".join(terms), params
+
+
+def render_query(query, params):
+    # query text with the values filled in - only for the query log, never executed
+    if not params:
+        return query
+    parts = query.split("?")
+    if len(parts) != len(params) + 1:
+        return f"{query} {params}"
+    values = [f"'{p}'" if isinstance(p, (str, date)) else str(p) for p in params]
+    return "".join(part + value for part, value in zip(parts, values)) + parts[-1]
+
+
+async def fetch_to_redis(query, con_obj, redis_qry_key, stream=False, chunk_size=None, params=None, meta=None):
+    # run the query and store the result in redis - returns the redis key for the stored data
+    # meta is written into the columnar header (time / id column from the catalog) for the backend
+    if not stream:
+        result = await db_query(query, con_obj, params)
+        return await send_to_redis(result, redis_qry_key, meta)
+
+    logging.info(f"Received request for streamed query: {query}")
+    if not con_obj.available():
+        return {"error": con_obj.con_err or "SQL Server connection not established"}
+    if chunk_size is None:
+        chunk_size = config_settings.get('streaming', {}).get('chunk_rows', 10000)
+    loop = asyncio.get_running_loop()
+    return await asyncio.to_thread(stream_to_redis, query, con_obj, redis_qry_key, chunk_size, params, loop, meta)
+
+
+def stream_to_redis(query, con_obj, redis_qry_key, chunk_size, params=None, loop=None, meta=None):
+    # Fetch the result chunk_size rows at a time and write each chunk to redis as it arrives
+    # The main key holds a manifest of the chunk keys - only one chunk is held in memory at a time
+    # loop is the event loop that async connections run their query on
+
+    redis_key = generate_redis_key()
+    if not isinstance(redis_key, str):
+        return {"error": "Error generating random key"}
+
+    chunk_keys = []
+    total_rows = 0
+    stored_bytes = 0
+    endpoint = endpoint_label(con_obj)
+    start_time = time.perf_counter()
+    try:
+        for chunk in blocking_chunks(con_obj, query, chunk_size, params, loop):
+            if chunk and "error" in chunk[0]:
+                logging.error(f"Streamed query failed after {total_rows} rows: {chunk[0]['error']}")
+                redis_client.delete(redis_key, *chunk_keys)
+                return chunk[0]
+            key = cache_codec.chunk_key(redis_key, len(chunk_keys))
+            payload = encode_for_redis(chunk, "chunk", meta)
+            redis_client.set(key, payload, ex=3600)  # Set TTL to 1 hour
+            stored_bytes += len(payload)
+            chunk_keys.append(key)
+            total_rows += len(chunk)
+
+        # manifest written last so a reader never sees a partial result
+        pipe = redis_client.pipeline()
+        pipe.set(redis_key, cache_codec.build_manifest(chunk_keys, total_rows), ex=3600)
+        pipe.set(redis_qry_key, redis_key, ex=3600)
+        pipe.execute()
+        # includes the redis writes between chunks - the query and the writes overlap
+        QUERY_SECONDS.observe(time.perf_counter() - start_time, endpoint=endpoint, kind="stream")
+        record_rows(endpoint, total_rows)
+        index_result(redis_key, stored_bytes, [redis_qry_key])
+        logging.info(f"Stored {total_rows} rows in {len(chunk_keys)} chunks under Redis key: {redis_key}")
+    except Exception as e:
+        logging.error(f"Error streaming result to Redis: {e}")
+        return {"error": "Error storing result in Redis"}
+
+    return redis_key
+
+
+def compress_payload(payload):
+    # compress a value for redis using the codec and size threshold from the config file
+    return cache_codec.compress(
+        payload,
+        codec=cache_settings.get('compression', cache_codec.DEFAULT_CODEC),
+        min_bytes=cache_settings.get('compression_min_bytes', cache_codec.DEFAULT_MIN_BYTES),
+        level=cache_settings.get('compression_level', 3)
+    )
+
+
+def partition_index(day, partition_days):
+    # partitions are aligned to the epoch so every request agrees on the boundaries
+    return (day - date(1970, 1, 1)).days // partition_days
+
+
+def partition_start(index, partition_days):
+    return date(1970, 1, 1) + timedelta(days=index * partition_days)
+
+
+def partition_key(database, table_name, index, partition_days):
+    return f"part:{database}:{table_name}:{partition_start(index, partition_days).isoformat()}:{partition_days}"
+
+
+def partitioned_to_redis(con_obj, database, table_name, time_col, start_day, end_day, redis_qry_key, partition_days, chunk_size, loop=None, meta=None, retry=True, redis_key=None):
+    """
+    Serve start_day 00:00 to end_day 00:00 from day partitions cached in redis, querying only the missing ones.
+    Both ends are inclusive so the result matches the BETWEEN ? AND ? of an unpartitioned read.
+
+    Partitions that are entirely in the past are cached under their own key (partition_ttl) and reused by any
+    later request that overlaps them. The partition holding today is always queried as it is still filling.
+    The result key holds a chunk manifest pointing at the partitions, so nothing is copied to stitch them
+    together - only partitions that stick out of the requested range are trimmed into new chunks.
+
+    Returns:
+        (str, str): the redis key for the result and the query text run against the database
+    """
+    partition_ttl = max(int(cache_settings.get('partition_ttl', 21600)), 3600)  # never shorter than the result
+    if redis_key is None:
+        redis_key = generate_redis_key()  # a retry reuses the placeholder it already reserved
+        if not isinstance(redis_key, str):
+            return {"error": "Error generating random key"}, ""
+    own_chunks = []
+
+    def fail(error, query_text):
+        # drop the placeholder and any chunks written for this result so a failed read leaves nothing behind
+        try:
+            redis_client.delete(redis_key, *own_chunks)
+        except Exception as e:
+            logging.error(f"Error removing placeholder {redis_key}: {e}")
+        return error, query_text
+
+    today = date.today()
+    # end_day 00:00 is in the range so its partition is read as well
+    indexes = list(range(partition_index(start_day, partition_days), partition_index(end_day, partition_days) + 1)) if end_day >= start_day else []
+    final = [i for i in indexes if partition_start(i + 1, partition_days) <= today]
+    keys = {i: partition_key(database, table_name, i, partition_days) for i in indexes}
+
+    def sticks_out(i):
+        return partition_start(i, partition_days) < start_day or partition_start(i + 1, partition_days) > end_day
 
+    try:
+        pipe = redis_client.pipeline()
+        for i in final:
+            pipe.exists(keys[i])
+        hits = {i for i, found in zip(final, pipe.execute()) if found}
+    except Exception as e:
+        logging.error(f"Error reading partitions from Redis: {e}")
+        return fail({"error": "Error reading partitions from Redis"}, "")
+    missing = [i for i in indexes if i not in hits]
+    logging.info(f"Partitions for {database}.{table_name} {start_day} to {end_day}: {len(hits)} cached, {len(missing)} to query")
+
+    # query contiguous runs of missing partitions - rows come back in time order so each partition
+    # is encoded and written as soon as the next one starts
+    # fetched[i] is the encoded partition when it still has to go into a chunk, True when the cached
+    # partition key can be used as-is and None when the partition is empty
+    fetched = {}
+    queries = []
+    runs = []
+    for i in missing:
+        if runs and runs[-1][-1] == i - 1:
+            runs[-1].append(i)
+        else:
+            runs.append([i])
+    for run in runs:
+        run_start = partition_start(run[0], partition_days)
+        run_end = partition_start(run[-1] + 1, partition_days)
+        upper = "<"
+        if run[-1] not in final:
+            # no need to read past the request for a partition that is not cached - up to and including end_day 00:00
+            run_end, upper = end_day, "<="
+        query = (f"SELECT * from {table_name} WHERE {table_name}.{time_col} >= ? "
+                 f"AND {table_name}.{time_col} {upper} ? ORDER BY {table_name}.{time_col}")
+        params = [datetime.combine(run_start, datetime.min.time()), datetime.combine(run_end, datetime.min.time())]
+        queries.append(render_query(query, params))
+        logging.info(f"Executing partition query: {query} with values {params}")
+
+        rows = []
+        current = run[0]
+        run_rows = 0
+        time_key = None
+        null_times = 0
+        start_time = time.perf_counter()
+        for chunk in blocking_chunks(con_obj, query, chunk_size, params, loop):
+            if chunk and "error" in chunk[0]:
+                logging.error(f"Partition query failed: {chunk[0]['error']}")
+                return fail(chunk[0], query)
+            run_rows += len(chunk)
+            if chunk and time_key is None:
+                # column names come back from the driver - match the configured time column without case, as get_page does
+                time_key = next((k for k in chunk[0] if k.lower() == time_col.lower()), None)
+                if time_key is None:
+                    logging.error(f"Time column {time_col} not in the result of {table_name}")
+                    return fail({"error": f"Time column {time_col} not found in {table_name}"}, query)
+            for row in chunk:
+                value = row[time_key]
+                if value is None:
+                    null_times += 1  # can't be placed in a day - and is outside any time range anyway
+                    continue
+                day = value.date() if isinstance(value, datetime) else date.fromisoformat(str(value)[:10])
+                # rows come back in time order - a row that maps to an earlier partition stays in the current one
+                index = min(partition_index(day, partition_days), run[-1])
+                while current < index:
+                    fetched[current] = store_partition(keys[current], rows, current in final, partition_ttl, not sticks_out(current), meta)
+                    rows = []
+                    current += 1
+                rows.append(row)
+        while current <= run[-1]:
+            fetched[current] = store_partition(keys[current], rows, current in final, partition_ttl, not sticks_out(current), meta)
+            rows = []
+            current += 1
+        if null_times:
+            logging.warning(f"Skipped {null_times} rows of {table_name} with no {time_col}")
+        QUERY_SECONDS.observe(time.perf_counter() - start_time, endpoint=endpoint_label(con_obj), kind="partition")
+        record_rows(endpoint_label(con_obj), run_rows)
+
+    # build the manifest - whole cached partitions are referenced directly, everything else becomes a chunk
+    range_start = datetime.combine(start_day, datetime.min.time())
+    range_end = datetime.combine(end_day, datetime.min.time())
+    chunk_keys = []
+    referenced = []
+    stored_bytes = 0  # only the trimmed chunks belong to the result - whole partitions are shared
+    try:
+        pipe = redis_client.pipeline()
+        for i in indexes:
+            if i in hits and not sticks_out(i) or fetched.get(i) is True:
+                referenced.append(i)
+                chunk_keys.append(keys[i])
+                continue
+            payload = redis_client.get(keys[i]) if i in hits else fetched[i]
+            if payload is None:
+                if i in hits:
+                    raise KeyError(keys[i])  # expired since it was checked
+                continue
+            payload = cache_codec.slice_columnar(cache_codec.decompress(payload), time_col, range_start, range_end, end_inclusive=True)
+            if cache_codec.read_header(payload)[0]["rows"] == 0:
+                continue
+            key = cache_codec.chunk_key(redis_key, len(chunk_keys))
+            payload = compress_payload(payload)
+            record_payload(payload, "chunk")
+            pipe.set(key, payload, ex=3600)
+            stored_bytes += len(payload)
+            chunk_keys.append(key)
+            own_chunks.append(key)
+
+        # keep referenced partitions alive at least as long as the result
+        for i in referenced:
+            pipe.expire(keys[i], partition_ttl)
+        results = pipe.execute()
+        if not all(results[len(results) - len(referenced):]):
+            raise KeyError("partition expired while building the result")
+
+        pipe = redis_client.pipeline()
+        pipe.set(redis_key, cache_codec.build_manifest(chunk_keys, None), ex=3600)
+        pipe.set(redis_qry_key, redis_key, ex=3600)
+        pipe.execute()
+        index_result(redis_key, stored_bytes, [redis_qry_key])
+    except KeyError as e:
+        # a cached partition expired between the check and its use - build the result again, querying it this time
+        logging.warning(f"Cached partition went missing ({e}), rebuilding result")
+        if retry:
+            # same placeholder - the chunks are numbered from 0 again and overwrite the ones written this time
+            return partitioned_to_redis(con_obj, database, table_name, time_col, start_day, end_day, redis_qry_key, partition_days, chunk_size, loop, meta, retry=False, redis_key=redis_key)
+        return fail({"error": "Error storing result in Redis"}, "; ".join(queries))
+    except ValueError as e:
+        # a cached partition without the time column can't be trimmed to the range
+        logging.error(f"Error trimming partition for {table_name}: {e}")
+        return fail({"error": f"Error trimming cached partition - {e}"}, "; ".join(queries))
+    except Exception as e:
+        logging.error(f"Error storing partitioned result in Redis: {e}")
+        return fail({"error": "Error storing result in Redis"}, "; ".join(queries))
+
+    logging.info(f"Stored result from {len(chunk_keys)} partitions under Redis key: {redis_key}")
+    # the requested range leads the text so the history shows what was asked for, not just the partitions queried
+    requested = f"partition read: {database}.{table_name} {start_day} to {end_day}"
+    return redis_key, "; ".join([requested] + queries) if queries else f"{requested} (all partitions cached)"
+
+
+def store_partition(key, rows, cacheable, ttl, whole, meta=None):
+    # encode one partition and, if it is complete, cache it for reuse
+    # returns True when the cached key can be referenced directly, None for an empty partition,
+    # otherwise the encoded value so it can be trimmed into a chunk
+    with SERIALIZE_SECONDS.time(kind="partition"):
+        payload = cache_codec.encode_records(rows, default=json_serial, meta=meta)
+    if cacheable:
+        try:
+            compressed = compress_payload(payload)
+            record_payload(compressed, "partition")
+            redis_client.set(key, compressed, ex=ttl)
+            if whole:
+                return True
+        except Exception as e:
+            logging.error(f"Error storing partition {key} in Redis: {e}")
+    if not rows:
+        return None
+    return payload
+
+
+def random_redis_key():
+    rand_number = random.randint(1, 1000)
+    # add 6 random alpha chars to the rand_number to make it unique
+    return str(rand_number) + ''.join(random.choices('abcdefghijklmnopqrstuvwxyz', k=6))
+
+
+def generate_redis_key():
+    # reserve a random key that is not already in use in redis - SET NX claims it in one round trip
+    # so two requests can never be handed the same key. The placeholder is overwritten with the result.
 
     while True:
         try:
             logging.info(f"Storing result in Redis with random key")
-            rand_number = random.randint(1, 1000)
-            # add 5 random alpha chars to the rand_number to make it unique
-            redis_key = str(rand_number) + ''.join(random.choices('abcdefghijklmnopqrstuvwxyz', k=6))
-            # check if key already exists in redis
-            if redis_client.exists(redis_key):
-                logging.info(f"Key {redis_key} already exists in Redis, generating a new key...")
-                continue  # Key exists, generate a new one
-            else:
+            redis_key = random_redis_key()
+            if redis_client.set(redis_key, b"", nx=True, ex=3600):
                 logging.info(f"Generated random key: {redis_key}")
                 break  # Key is unique, exit the loop
+            logging.info(f"Key {redis_key} already exists in Redis, generating a new key...")
             
         except Exception as e:
             logging.error(f"Error generating random key: {e}")
             return {"Error generating random key"}
+    return redis_key
+
+
+# function to send to redis
+
+async def send_to_redis(redis_value, redis_qry_key, meta=None):
+    # Send data to Redis with a random key and return the key to the call which returns to user
+    # the data is written with SET NX so the key is reserved and filled in the same round trip,
+    # then the query pointer is set - two round trips on the async client for a cache miss
+
+    try:
+        # row results are stored in the columnar format, anything else (error dicts) as JSON
+        # encoding runs in a worker thread so a large result does not hold up the event loop
+        spill = False
+        if isinstance(redis_value, list):
+            payload, spill = await asyncio.to_thread(encode_result, redis_value, meta)
+        else:
+            payload = compress_payload(json.dumps(redis_value, default=json_serial))
+    except Exception as e:
+        logging.error(f"Error encoding result for Redis: {e}")
+        return {"Error storing result in Redis"}
+
+    redis_key = await spill_to_disk(payload) if spill else None
+    if spill and redis_key is None:
+        # could not write the file - store it in redis as usual
+        payload = await asyncio.to_thread(compress_payload, payload)
+        record_payload(payload, "result")
+    stored_bytes = 0 if redis_key is not None else len(payload)  # a spilled result only has its pointer in redis
+
     try:
-        redis_client.set(redis_key, json.dumps(redis_value, default=json_serial), ex=3600)  # Set TTL to 1 hour
+        while redis_key is None:
+            key = random_redis_key()
+            if await async_redis.set(key, payload, nx=True, ex=3600):  # Set TTL to 1 hour
+                redis_key = key
+            else:
+                logging.info(f"Key {key} already exists in Redis, generating a new key...")
         logging.info(f"Stored result in Redis with key: {redis_key}")
     except Exception as e:
         logging.error(f"Error storing result in Redis: {e}")
@@ -642,17 +1834,189 @@ def send_to_redis(redis_value, redis_qry_key):
     
 	#  store the query in redis with the key as the query string - pointer to main redis key
     try:
-        redis_client.set(redis_qry_key, redis_key,  ex=3600)  # Set TTL to 1 hour
+        await async_redis.set(redis_qry_key, redis_key,  ex=3600)  # Set TTL to 1 hour
         logging.info(f"Stored result in Redis with key: {redis_qry_key}")
     except Exception as e:
         logging.error(f"Error storing result in Redis: {e}")
         return {"Error storing result in Redis"}
 
+    await asyncio.to_thread(index_result, redis_key, stored_bytes, [redis_qry_key])
     return redis_key
 
 
-def open_server_db_con():
-    # Open the connection to the server side database
+def index_result(redis_key, size, pointers):
+    # add a stored result to the cache index - may evict older results to stay in the budget
+    if cache_idx is not None:
+        cache_idx.register(redis_key, size, pointers)
+
+
+async def reconcile_cache_index(interval):
+    # runs for the life of the app - takes results that expired on their TTL out of the cache index
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = await asyncio.to_thread(cache_idx.reconcile)
+            if removed:
+                logging.info(f"Removed {removed} expired results from the cache index")
+        except Exception as e:
+            logging.error(f"Error reconciling cache index: {e}")
+
+
+@app.get("/cache")
+async def get_cache_stats():
+    # bytes held by indexed results against the budget
+    if cache_idx is None:
+        return {"error": "Cache index not started"}
+    return await asyncio.to_thread(cache_idx.stats)
+
+
+def mine_request_patterns(settings):
+    # history is read on a connection of its own so it does not share a cursor with the endpoints
+    con = open_server_db_con()
+    if con is None or con.conn is None:
+        raise ConnectionError("Platform database connection not established")
+    try:
+        history = cache_warmer.load_history(con, settings.get('lookback_days', 14), settings.get('time_column', 'created_at'))
+    finally:
+        con.close_connection()
+    return cache_warmer.find_patterns(history, settings.get('min_days', 3))
+
+
+async def warm_cache(settings):
+    """
+    Runs for the life of the app - reads requests that repeat daily from the audit history and
+    runs them in the lead_minutes before they are usually made, so the first request is a cache hit.
+    Warming only starts when no user request has arrived for quiet_seconds and none is running.
+    """
+    interval = settings.get('check_interval', 300)
+    lead = timedelta(minutes=settings.get('lead_minutes', 45))
+    quiet_seconds = settings.get('quiet_seconds', 60)
+    max_per_check = settings.get('max_per_check', 5)
+    patterns = []
+    mined_on = None
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            today = date.today()
+            if mined_on != today and startup_state == "ready":
+                patterns = await asyncio.to_thread(mine_request_patterns, settings)
+                mined_on = today
+            now = datetime.now()
+            warmed = 0
+            for pattern in patterns:
+                # next time the request is due - a pattern at 00:00 is warmed late the evening before
+                due = datetime.combine(today, datetime.min.time()) + timedelta(hours=pattern["hour"])
+                if due <= now:
+                    due += timedelta(days=1)
+                if not due - lead <= now < due or warmed >= max_per_check:
+                    continue
+                if inflight_requests or time.monotonic() - last_data_request < quiet_seconds:
+                    logging.info("Cache warming waiting for a quiet period")
+                    break
+                start, end = cache_warmer.window_for(pattern, due.date())
+                redis_query_key = query_key(pattern["database"], pattern["table"], start, end)
+                # one worker warms each pattern per day - the others see the claim and move on
+                claim = f"warm:{redis_query_key}:{due.date().isoformat()}"
+                if await async_redis.exists(redis_query_key) or not await async_redis.set(claim, 1, nx=True, ex=86400):
+                    continue
+                logging.info(f"Warming {pattern['database']}.{pattern['table']} {start} to {end} (requested around {pattern['hour']:02d}:00 on {pattern['days']} days)")
+                result = await get_data(pattern["database"], pattern["table"], start=start, end=end, user=cache_warmer.WARMER_USER, stream=True)
+                if "error" in result:
+                    logging.warning(f"Cache warming for {redis_query_key} failed: {result['error']}")
+                warmed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Error warming cache: {e}")
+
+
+def track_hit(redis_key):
+    # recorded on a worker thread without waiting, so a cache hit is not held up by the index
+    if cache_idx is not None:
+        asyncio.get_running_loop().run_in_executor(None, cache_idx.touch, redis_key)
+
+
+async def spill_to_disk(payload):
+    """
+    Keep an oversized columnar result in a file under spill.dir and store a pointer to it in redis,
+    so one large value does not push everyone else's cached data out of redis.
+    The file is named after the redis key so sweep_spill_files() can tell when it is no longer used.
+
+    Returns:
+        str: the redis key, or None if the file could not be written
+    """
+    redis_key = None
+    try:
+        while redis_key is None:
+            key = random_redis_key()
+            if await async_redis.set(key, b"", nx=True, ex=3600):
+                redis_key = key
+        path = os.path.join(spill_settings['dir'], f"{redis_key}.col")
+        await asyncio.to_thread(cache_codec.write_spill, path, payload)
+        rows = cache_codec.read_header(payload)[0]["rows"]
+        await async_redis.set(redis_key, cache_codec.build_spill(path, rows, len(payload)), ex=3600)
+        record_payload(payload, "spill")
+        logging.info(f"Spilled {len(payload)} byte result to {path} under Redis key: {redis_key}")
+        return redis_key
+    except Exception as e:
+        logging.error(f"Error spilling result to disk: {e}")
+        if redis_key is not None:
+            try:
+                await async_redis.delete(redis_key)
+            except Exception:
+                pass
+        return None
+
+
+async def sweep_spill_files():
+    # runs for the life of the app - removes spill files whose redis key has expired
+    interval = spill_settings.get('sweep_interval', 300)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = await asyncio.to_thread(remove_expired_spills)
+            if removed:
+                logging.info(f"Removed {removed} expired spill files")
+        except Exception as e:
+            logging.error(f"Error sweeping spill files: {e}")
+
+
+def remove_expired_spills(grace=60):
+    # files younger than grace seconds are left alone - their pointer may not be in redis yet
+    spill_dir = spill_settings['dir']
+    now = time.time()
+    candidates = []
+    for name in os.listdir(spill_dir):
+        if not name.endswith((".col", ".col.tmp")):
+            continue
+        path = os.path.join(spill_dir, name)
+        try:
+            if now - os.path.getmtime(path) < grace:
+                continue
+        except FileNotFoundError:
+            continue
+        candidates.append((name, path))
+    if not candidates:
+        return 0
+
+    pipe = redis_client.pipeline(transaction=False)
+    for name, _ in candidates:
+        pipe.exists(name.split(".")[0])
+    removed = 0
+    for (name, path), found in zip(candidates, pipe.execute()):
+        if found and name.endswith(".col"):
+            continue
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass  # another worker removed it first
+    return removed
+
+
+def open_server_db_con(connect_timeout=None):
+    # Open the connection to the server side database - connect_timeout is the driver login timeout in seconds
     logging.info("IDB-Opening connection to server side database...")
     try:
         with open('pwd.json') as json_file:
@@ -662,7 +2026,8 @@ def open_server_db_con():
                 server_name=data['postgres']['host'],
                 db_name=data['postgres']['db_name'],
                 connection_username=data['postgres']['uname'],
-                connection_password=data['postgres']['password']
+                connection_password=data['postgres']['password'],
+                login_timeout=connect_timeout
             )
 
         if postgres_con2.conn is None:
@@ -0,0 +1,110 @@
+'''
+Minimal metrics registry served as Prometheus text on /metrics
+
+Counters and histograms with labels, kept in memory per worker process.
+This file is shared by the abstraction layer and the backend - keep the copies identical.
+
+Text format: https://prometheus.io/docs/instrumenting/exposition_formats/#text-based-format
+
+'''
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# seconds - from a cached lookup up to a long query
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# bytes / rows - powers of ten up to 100M
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+registry = []
+
+
+def _label_text(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class counter:
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, key)} {_number(value)}")
+        return lines
+
+
+class histogram:
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # labels -> [count per bucket (last one is +Inf), sum]
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        index = bisect_left(self.buckets, value)  # buckets are upper bounds, le is inclusive
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        # with some_histogram.time(endpoint="x"): ... - observes the elapsed seconds, also when the block raises
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_label_text(self.labels, key, ('le', _number(bound)))} {cumulative}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {_number(total)}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {cumulative}")
+        return lines
+
+
+def render():
+    # the whole registry in the Prometheus text format
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,55 @@
+'''
+build_aggregate_query has to apply fil_condition - run the generated SQL on an in-memory SQLite table
+(date_trunc registered as a function so the PostgreSQL bucket expression runs as written)
+
+Run from this folder:  python -m pytest -q test_aggregate_filter.py
+
+'''
+import sqlite3
+from datetime import datetime
+
+import main_abstraction
+from connections import connectcls_postgres
+
+
+def date_trunc(unit, value):
+    # only the day bucket is used below
+    return value[:10] + " 00:00:00"
+
+
+def run(query, params):
+    con = sqlite3.connect(":memory:")
+    con.create_function("date_trunc", 2, date_trunc)
+    con.execute("CREATE TABLE readings (created_at TEXT, line_id INTEGER, temp REAL)")
+    con.executemany("INSERT INTO readings VALUES (?, ?, ?)", [
+        ("2025-01-01 08:00:00", 3, 10.0),
+        ("2025-01-01 09:00:00", 3, 20.0),
+        ("2025-01-01 10:00:00", 4, 90.0),
+        ("2025-01-02 08:00:00", 4, 70.0),
+    ])
+    params = [p.strftime("%Y-%m-%d %H:%M:%S") if isinstance(p, datetime) else p for p in params]
+    return con.execute(query, params).fetchall()
+
+
+def build(fil_condition=None, **kwargs):
+    con_obj = object.__new__(connectcls_postgres)
+    filter_sql, filter_params = main_abstraction.parse_filter(fil_condition)
+    return main_abstraction.build_aggregate_query(con_obj, "readings", "created_at", "2025-01-01", "2025-01-03",
+                                                  filter_sql=filter_sql, filter_params=filter_params, **kwargs)
+
+
+def test_filtered_aggregate_differs_from_unfiltered():
+    unfiltered = run(*build(bucket="day", agg="avg", columns="temp"))
+    filtered = run(*build("line_id = 3", bucket="day", agg="avg", columns="temp"))
+    assert unfiltered == [("2025-01-01 00:00:00", 40.0), ("2025-01-02 00:00:00", 70.0)]
+    assert filtered == [("2025-01-01 00:00:00", 15.0)]
+
+
+def test_filtered_projection():
+    rows = run(*build("line_id = 4", columns="temp"))
+    assert [temp for _, temp in rows] == [90.0, 70.0]
+
+
+def test_no_filter_leaves_where_alone():
+    query, params = build(columns="temp")
+    assert "1=1" not in query and len(params) == 2
@@ -0,0 +1,112 @@
+'''
+Partitioned /data reads have to return the same rows as the unpartitioned BETWEEN ? AND ? read - run
+partitioned_to_redis against an in-memory table and a dict standing in for redis, cold and warm
+
+Run from this folder:  python -m pytest -q test_partitioned_read.py
+
+'''
+from datetime import date, datetime, timedelta
+
+import cache_codec
+import main_abstraction
+
+
+class fake_redis:
+    # the sync client calls partitioned_to_redis makes
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.store:
+            return None
+        self.store[key] = value
+        return True
+
+    def exists(self, key):
+        return int(key in self.store)
+
+    def expire(self, key, ttl):
+        return key in self.store
+
+    def delete(self, *keys):
+        return sum(self.store.pop(key, None) is not None for key in keys)
+
+    def pipeline(self, transaction=True):
+        redis, calls = self, []
+
+        class pipe:
+            def __getattr__(self, name):
+                return lambda *a, **k: calls.append((name, a, k))
+
+            def execute(self):
+                return [getattr(redis, name)(*a, **k) for name, a, k in calls]
+        return pipe()
+
+
+class fake_table:
+    # query_chunks filters on the two bound times and honours < or <= on the upper one
+    def __init__(self, rows, fail=False):
+        self.rows = rows
+        self.fail = fail
+
+    def query_chunks(self, query, chunk_size, params):
+        if self.fail:
+            yield [{"error": "Operational error"}]
+            return
+        lo, hi = params
+        inclusive = "<= ?" in query
+        yield [r for r in self.rows if lo <= r["created_at"] and (r["created_at"] <= hi if inclusive else r["created_at"] < hi)]
+
+
+ROWS = [{"created_at": datetime(2025, 1, 1) + timedelta(hours=6 * i), "temp": float(i)} for i in range(16)]
+
+
+def between(start, end):
+    return [r["temp"] for r in ROWS if start <= r["created_at"] <= end]
+
+
+def read(monkeypatch, redis, con, start, end):
+    monkeypatch.setattr(main_abstraction, "redis_client", redis)
+    monkeypatch.setattr(main_abstraction, "cache_settings", {"compression": "none"})
+    monkeypatch.setattr(main_abstraction, "cache_idx", None)
+    key, _ = main_abstraction.partitioned_to_redis(con, "test", "readings", "created_at", start, end,
+                                                   "qry", 1, 1000)
+    if isinstance(key, dict):
+        return key
+    temps = []
+    for chunk in cache_codec.read_manifest(redis.get(key))["chunks"]:
+        frame = cache_codec.decode_frame(cache_codec.decompress(redis.get(chunk)))
+        temps += list(frame["temp"])
+    return temps
+
+
+def test_end_day_is_inclusive_cold_and_warm(monkeypatch):
+    redis = fake_redis()
+    con = fake_table(ROWS)
+    # rows exactly at 2025-01-03 00:00 belong to the range, as with BETWEEN
+    assert read(monkeypatch, redis, con, date(2025, 1, 1), date(2025, 1, 3)) == between(datetime(2025, 1, 1), datetime(2025, 1, 3))
+    # second read comes from the cached partitions
+    assert read(monkeypatch, redis, fake_table([]), date(2025, 1, 1), date(2025, 1, 3)) == between(datetime(2025, 1, 1), datetime(2025, 1, 3))
+
+
+def test_start_equals_end(monkeypatch):
+    assert read(monkeypatch, fake_redis(), fake_table(ROWS), date(2025, 1, 2), date(2025, 1, 2)) == [4.0]
+
+
+def test_failed_read_leaves_no_placeholder(monkeypatch):
+    redis = fake_redis()
+    result = read(monkeypatch, redis, fake_table(ROWS, fail=True), date(2025, 1, 1), date(2025, 1, 3))
+    assert result == {"error": "Operational error"}
+    assert redis.store == {}
+
+
+def test_slice_without_time_column_is_an_error():
+    payload = cache_codec.encode_records([{"ts": datetime(2025, 1, 1), "temp": 1.0}])
+    try:
+        cache_codec.slice_columnar(payload, "created_at", datetime(2025, 1, 1), datetime(2025, 1, 2))
+    except ValueError:
+        return
+    assert False, "untrimmed payload returned"
@@ -22,6 +22,7 @@ import logging
 import redis as rd
 
 import layouts
+import cache_codec
 
 logging.basicConfig(filename="dash_main.log", level=logging.INFO, format="%(asctime)s - %(message)s")
 
@@ -300,6 +301,9 @@ def main_page_layout():
                 style={'fontSize': '16px', 'marginRight': '10px'}
             ),
              html.Button('Get Raw Data', id='get-all-data-button', n_clicks=0, className='button', style=button_style2),
+             # paged read straight into the table - one small query per page instead of the whole range
+             html.Button('Preview Data', id='preview-data-button', n_clicks=0, className='button', style=button_style2),
+             html.Button('Load Next Page', id='next-page-button', n_clicks=0, className='button', style=button_style2, disabled=True),
                     ], style={'textAlign': 'center', 'marginBottom': '20px', 'display': 'flex', 'alignItems': 'center', 'justifyContent': 'center', 'gap': '10px'}),
             html.Div([
             dcc.Input(id='redis-key-for-proc', type='text', placeholder="Enter Raw Data Key", style={'marginRight': '10px', 'fontSize': '16px', 'padding': '5px'}),
@@ -389,6 +393,7 @@ def main_page_layout():
                                         )
                 ], style={'marginTop': '20px'}),
         dcc.Store(id='store', data={'get_data_clicks': 0, 'get_all_data_clicks': 0, 'onscreen_data':[]}, storage_type='session'),  # Store to keep track of click counts // onscreen data
+        dcc.Store(id='page-state-store', data={}, storage_type='session'),  # request and next cursor for the paged preview
     ])
 
 
@@ -814,9 +819,10 @@ def update_output(clear_btn, get_data_btn, fetch_data_btn, fetch_processed_data_
                         redis_key_store, html.Ul([html.Li(key) for key in redis_key_store]), dash.no_update, dash.no_update,
                         dash.no_update, dash.no_update, [], []
                     )
+                # streamed results are stored as a manifest of chunk keys
+                redis_data = cache_codec.resolve_payload(redis_client, redis_data)
                 if redis_data:
-                    redis_data = json.loads(redis_data)
-                    dataframe = pd.DataFrame(redis_data)
+                    dataframe = load_cached_frame(redis_data)
                     column_options = [{"label": col, "value": col} for col in dataframe.columns]
                     # update to ensure that columns that are not numeric are not shown in the y axis dropdown but string types that contian only numeric (steps) are allowed to be plotted
                     numeric_columns = [{"label": col, "value": col} for col in dataframe.columns if pd.to_numeric(dataframe[col], errors='coerce').notnull().all()]
@@ -846,10 +852,10 @@ def update_output(clear_btn, get_data_btn, fetch_data_btn, fetch_processed_data_
                 logging.info(f"Fetching Redis Key - Processed Data: {redis_key}")
                 redis_data = redis_client.get(redis_key)
                 logging.info(f"Redis key {redis_key} exists")
+                redis_data = cache_codec.resolve_payload(redis_client, redis_data)
                 if redis_data:
-                    redis_data = json.loads(redis_data)
+                    dataframe = load_cached_frame(redis_data)
                     logging.info(f"Redis data loaded")
-                    dataframe = pd.DataFrame(redis_data)
                     column_options = [{"label": col, "value": col} for col in dataframe.columns]
                     # update to ensure that columns that are not numeric are not shown in the y axis dropdown but string types that contian only numeric (steps) are allowed to be plotted
                     numeric_columns = [{"label": col, "value": col} for col in dataframe.columns if pd.to_numeric(dataframe[col], errors='coerce').notnull().all()]
@@ -966,6 +972,73 @@ def update_output(clear_btn, get_data_btn, fetch_data_btn, fetch_processed_data_
     )
    
 
+# Paged preview - first page on Preview Data, further pages appended on Load Next Page
+# https://dash.plotly.com/duplicate-callback-outputs - shares the table outputs with update_output
+@app.callback(
+    [Output('output-container', 'children', allow_duplicate=True),
+     Output('data-table', 'columns', allow_duplicate=True),
+     Output('data-table', 'data', allow_duplicate=True),
+     Output('store', 'data', allow_duplicate=True),
+     Output('page-state-store', 'data'),
+     Output('next-page-button', 'disabled'),
+     Output('x-axis-dropdown', 'options', allow_duplicate=True),
+     Output('y-axis-dropdown', 'options', allow_duplicate=True)],
+    [Input('preview-data-button', 'n_clicks'),
+     Input('next-page-button', 'n_clicks')],
+    [State('database', 'value'),
+     State('table_name', 'value'),
+     State('data-date-range', 'start_date'),
+     State('data-date-range', 'end_date'),
+     State('page-state-store', 'data'),
+     State('store', 'data'),
+     State('client-ip-store', 'data')],
+    prevent_initial_call=True
+)
+def load_data_page(preview_btn, next_btn, db_sel, tbl_sel, st_date, end_date, page_state, store_data, client_ip):
+    global dataframe
+    button_id = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
+
+    if button_id == 'preview-data-button':
+        if db_sel is None or tbl_sel is None or st_date is None or end_date is None:
+            return ("Please Ensure a database, table, and date range are selected.", dash.no_update, dash.no_update, dash.no_update,
+                    dash.no_update, dash.no_update, dash.no_update, dash.no_update)
+        page_state = {'database': db_sel, 'table': tbl_sel, 'start': st_date, 'end': end_date, 'cursor': None, 'page': 0}
+        rows = []
+    else:
+        # next page continues the request the preview started, not whatever is selected now
+        if not page_state or not page_state.get('cursor'):
+            return ("No further pages.", dash.no_update, dash.no_update, dash.no_update, dash.no_update, True, dash.no_update, dash.no_update)
+        rows = store_data.get('onscreen_data', [])
+
+    try:
+        response_json = get_data_page(page_state['database'], page_state['table'], page_state['start'], page_state['end'],
+                                      page_state['cursor'], client_ip)
+        redis_key = response_json.get("redis_key")
+        if not redis_key:
+            return (f"Failed to retrieve page: {response_json.get('error')}", dash.no_update, dash.no_update, dash.no_update,
+                    dash.no_update, dash.no_update, dash.no_update, dash.no_update)
+        redis_data = cache_codec.resolve_payload(redis_client, redis_client.get(redis_key))
+        page_df = load_cached_frame(redis_data) if redis_data else pd.DataFrame()
+    except Exception as e:
+        logging.error(f"Paged Data Fetch Error: {e}")
+        return (f"Error retrieving page: {e}", dash.no_update, dash.no_update, dash.no_update,
+                dash.no_update, dash.no_update, dash.no_update, dash.no_update)
+
+    rows = rows + page_df.to_dict('records')
+    dataframe = pd.DataFrame(rows)
+    page_state['cursor'] = response_json.get("next_cursor")
+    page_state['page'] += 1
+    store_data['onscreen_data'] = rows
+    column_options = [{"label": col, "value": col} for col in dataframe.columns]
+    numeric_columns = [{"label": col, "value": col} for col in dataframe.columns if pd.to_numeric(dataframe[col], errors='coerce').notnull().all()]
+    more = "more available" if page_state['cursor'] else "end of range"
+    return (
+        f"Loaded {page_state['page']} page(s), {len(rows)} rows - {more}",
+        [{"name": i, "id": i} for i in dataframe.columns], rows, store_data,
+        page_state, not page_state['cursor'], column_options, numeric_columns
+    )
+
+
 @app.callback(
     Output("data-plot", "figure"),
     [Input("x-axis-dropdown", "value"),
@@ -1020,6 +1093,13 @@ def update_graph(x_axis, y_axes, g_type ,store_data):
 
 
 
+def load_cached_frame(redis_data):
+    # cached data is either the columnar format or the older JSON list of rows
+    if cache_codec.is_columnar(redis_data):
+        return cache_codec.decode_frame(redis_data)
+    return pd.DataFrame(json.loads(redis_data))
+
+
 def clear_screen():
     return ''
 
@@ -1071,7 +1151,7 @@ def get_data_all(db_sel, tbl_sel, st_date, end_date, user_ip):
     endpoint_ip = CONFIG['endpoints']['db-connection-layer']['ip']
     endpoint_port = CONFIG['endpoints']['db-connection-layer']['port']
     logging.info(f"Fetching data from {endpoint_ip}:{endpoint_port}")
-    response = requests.get(f'http://{endpoint_ip}:{endpoint_port}/data?database={db_sel}&table_name={tbl_sel}&start={st_date}&end={end_date}&user={user_ip}') # updated to take the table name from the dropdown
+    response = requests.get(f'http://{endpoint_ip}:{endpoint_port}/data?database={db_sel}&table_name={tbl_sel}&start={st_date}&end={end_date}&user={user_ip}&stream=true') # updated to take the table name from the dropdown - streamed into redis in chunks
     response_json = response.json()
     # send response to redis first 
     logging.info(f"Response Rec: {response_json}")
@@ -1090,6 +1170,21 @@ def get_data_all(db_sel, tbl_sel, st_date, end_date, user_ip):
         return response_json
 
 
+def get_data_page(db_sel, tbl_sel, st_date, end_date, cursor, user_ip):
+    # one page of the range - cursor is the next_cursor from the page before, None for the first page
+    endpoint_ip = CONFIG['endpoints']['db-connection-layer']['ip']
+    endpoint_port = CONFIG['endpoints']['db-connection-layer']['port']
+    params = {'database': db_sel, 'table_name': tbl_sel, 'start': st_date, 'end': end_date, 'user': user_ip,
+              'paginate': 'true', 'limit': CONFIG.get('page_size', 500)}
+    if cursor:
+        params['cursor'] = cursor
+    logging.info(f"Fetching data page from {endpoint_ip}:{endpoint_port}")
+    response = requests.get(f'http://{endpoint_ip}:{endpoint_port}/data', params=params)
+    response_json = response.json()
+    logging.info(f"Response Rec: {response_json}")
+    return response_json
+
+
 def send_data_for_processing(redis_key_proc, analysis_typ):
     # This function will send data to the appropriate LxCT for processing
 